@@ -0,0 +1,242 @@
+# ASGI entry point next to the WSGI app in main.py, run it with: uvicorn asgi:application
+# The sync search() and locate() views wait for Google while holding a worker. Here the Google calls of a valid
+# search/locate form are awaited first on one shared async client, where a waiting request costs no thread,
+# and then the unchanged Flask view runs on a bounded thread pool (DB, templates) with the answers at hand.
+# ASYNC_GOOGLE=0 keeps the Google calls inside the views, ASGI_THREADS sets the size of the view pool.
+import asyncio
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import request
+
+from maps_client import AsyncMapsClient, MapsUnavailable
+from cache import normalize_query
+from instrumentation import GOOGLE_PREFETCH_SECONDS
+import places
+from models import known_places
+from extensions import read_session
+from main import app
+
+
+ASYNC_GOOGLE = os.environ.get("ASYNC_GOOGLE", "1") != "0"
+# caches and the sync client of the app, shared with its views
+app_places = app.extensions["places"]
+view_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("ASGI_THREADS", 16)), thread_name_prefix="view")
+
+# created on the first request, an httpx client belongs to the event loop it is used in
+async_maps_client = None
+# photo lookups that missed the deadline of their page, they still fill the photo cache
+background_tasks = set()
+
+
+def get_async_maps_client():
+    global async_maps_client
+    if async_maps_client is None:
+        sync_client = app_places.maps_client()
+        connect_timeout, read_timeout = sync_client.timeout
+        async_maps_client = AsyncMapsClient(sync_client.key, base_url=sync_client.base_url,
+                                            connect_timeout=connect_timeout, read_timeout=read_timeout,
+                                            retries=sync_client.retries, backoff=sync_client.backoff,
+                                            pool_maxsize=int(os.environ.get("ASYNC_GOOGLE_POOL_SIZE", 100)),
+                                            breaker=sync_client.breaker)
+    return async_maps_client
+
+
+def planned_google_calls(environ):
+    # (places query, photos wanted) of a submitted search or locate form, None for anything else;
+    # the form is validated first (CSRF included), so invalid posts never reach Google
+    with app.request_context(environ):
+        endpoint = request.url_rule.endpoint if request.url_rule else None
+        if endpoint == "web.search":
+            from forms import SearchForm
+            form = SearchForm()
+            if form.validate_on_submit():
+                return form.location.data, False
+        elif endpoint == "web.locate":
+            from forms import LocateNewCafeForm
+            form = LocateNewCafeForm()
+            if form.validate_on_submit():
+                return form.text_input.data + "restaurant", True
+    return None
+
+
+async def places_text_search(query):
+    # same as places.places_text_search(), None if Google is not available
+    key = normalize_query(query)
+    results = app_places.places_cache.get(key)
+    if results is None:
+        try:
+            results = await get_async_maps_client().text_search(query)
+        except MapsUnavailable as error:
+            app.logger.warning("Places text search for %s failed: %s", key, error)
+        else:
+            app_places.remember_places_results(key, results)
+    return key, results
+
+
+async def fetch_photo_url(photo_reference):
+    photo_url = await get_async_maps_client().photo_url(photo_reference)
+    app_places.photo_cache.set(photo_reference, photo_url)
+    return photo_url
+
+
+async def resolve_photo_urls(photo_references):
+    # same as places.resolve_photo_urls(), photos still loading after the deadline finish in the background
+    photo_urls = {}
+    pending = {}
+    for photo_reference in set(photo_references):
+        photo_url = app_places.photo_cache.get(photo_reference)
+        if photo_url is not None:
+            photo_urls[photo_reference] = photo_url
+        else:
+            pending[asyncio.ensure_future(fetch_photo_url(photo_reference))] = photo_reference
+
+    if pending:
+        done, not_done = await asyncio.wait(pending, timeout=places.PHOTO_DEADLINE)
+        for task in done:
+            try:
+                photo_urls[pending[task]] = task.result()
+            except Exception as error:
+                app.logger.warning("Photo %s could not be resolved: %s", pending[task], error)
+        if not_done:
+            app.logger.warning("%s photos missed the deadline, default picture used", len(not_done))
+            background_tasks.update(not_done)
+            for task in not_done:
+                task.add_done_callback(background_tasks.discard)
+    return photo_urls
+
+
+def known_place_ids(place_ids):
+    # runs in the view pool, the candidates already in the DB get no photo lookup (as in locate())
+    with app.app_context():
+        return set(known_places(read_session, place_ids))
+
+
+async def prefetch(query, with_photos):
+    # environ entries read by places.places_text_search() and places.resolve_photo_urls()
+    key, results = await places_text_search(query)
+    prefetched = {places.PREFETCHED_PLACES: {key: results}}
+    if with_photos and results is not None:
+        candidates = results.get("results", [])
+        known = await asyncio.get_running_loop().run_in_executor(
+            view_executor, known_place_ids, [candidate.get("place_id") for candidate in candidates])
+        photo_refs = places.candidate_photo_refs(candidates)
+        prefetched[places.PREFETCHED_PHOTOS] = await resolve_photo_urls(
+            [photo_ref for candidate, photo_ref in zip(candidates, photo_refs)
+             if photo_ref and candidate.get("place_id") not in known])
+    return prefetched
+
+
+def wsgi_environ(scope, body):
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ["SERVER_NAME"] = server_name
+    environ["SERVER_PORT"] = str(server_port)
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+
+    for name, value in scope["headers"]:
+        name = name.decode("latin1").upper().replace("-", "_")
+        value = value.decode("latin1")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = f"HTTP_{name}"
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+
+def run_view(environ, send, loop):
+    # runs in the view pool, the response goes to the event loop chunk by chunk (streamed responses too)
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = [(name.lower().encode("latin1"), value.encode("latin1")) for name, value in headers]
+
+    def push(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    result = app(environ, start_response)
+    try:
+        headers_sent = False
+        for chunk in result:
+            if not chunk:
+                continue
+            if not headers_sent:
+                push({"type": "http.response.start", **started})
+                headers_sent = True
+            push({"type": "http.response.body", "body": chunk, "more_body": True})
+        if not headers_sent:
+            push({"type": "http.response.start", **started})
+        push({"type": "http.response.body", "body": b"", "more_body": False})
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+
+
+async def read_body(receive):
+    # the whole request body, the views read forms and the bulk import from memory
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return bytes(body)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            for task in list(background_tasks):
+                task.cancel()
+            if async_maps_client is not None:
+                await async_maps_client.close()
+            # the prices still queued (PRICE_WRITE_BEHIND=1) are written before the process ends
+            price_buffer = app.extensions.get("price_buffer")
+            if price_buffer is not None:
+                await asyncio.get_running_loop().run_in_executor(view_executor, price_buffer.close)
+            view_executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    body = await read_body(receive)
+    if body is None:
+        return
+    environ = wsgi_environ(scope, body)
+    if ASYNC_GOOGLE and scope["method"] == "POST":
+        planned = planned_google_calls(wsgi_environ(scope, body))
+        if planned is not None:
+            start = time.perf_counter()
+            environ.update(await prefetch(*planned))
+            # the google span of the request (INSTRUMENTATION=1) includes the wait before the view
+            environ[GOOGLE_PREFETCH_SECONDS] = time.perf_counter() - start
+
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(view_executor, run_view, environ, send, loop)
@@ -0,0 +1,116 @@
+from sqlalchemy import or_, select
+
+from models import Cafe
+from bulk import parse_row, InvalidRow
+
+
+OPERATIONS = ("update_price", "add", "delete")
+
+
+def parse_ids(values):
+    # "1,2,3" or several ids params -> [1, 2, 3] in the given order without repeats, ValueError on garbage
+    ids = []
+    for value in values:
+        for part in str(value).split(","):
+            if part.strip():
+                cafe_id = int(part)
+                if cafe_id not in ids:
+                    ids.append(cafe_id)
+    return ids
+
+
+def _cafe_id(operation):
+    try:
+        return int(operation["id"])
+    except (KeyError, TypeError, ValueError):
+        raise InvalidRow("id of the cafe is missing")
+
+
+def run_batch(session, operations, may_delete=False, queue_prices=None):
+    # applies the operations in one transaction, returns one result per operation in the same order;
+    # every operation is checked before anything is written, the invalid ones are reported and skipped,
+    # the cafes to update or delete are loaded with one IN query, duplicates of adds with another one;
+    # queue_prices({id: price}) takes the price updates after the commit instead of the transaction (the price
+    # buffer), a price written here could be overwritten by an older one still waiting there
+    results = [None] * len(operations)
+    prices = {}
+    ids = set()
+    names = set()
+    urls = set()
+    place_ids = set()
+    rows = {}
+    for index, operation in enumerate(operations):
+        try:
+            if not isinstance(operation, dict) or operation.get("op") not in OPERATIONS:
+                raise InvalidRow(f"op has to be one of {', '.join(OPERATIONS)}")
+            if operation["op"] == "add":
+                row = parse_row(operation.get("cafe"))
+                if row["name"] in names or row["map_url"] in urls or row["place_id"] in place_ids:
+                    raise InvalidRow("the same cafe is added twice")
+                names.add(row["name"])
+                urls.add(row["map_url"])
+                if row["place_id"]:
+                    place_ids.add(row["place_id"])
+                rows[index] = row
+            else:
+                if operation["op"] == "delete" and not may_delete:
+                    raise InvalidRow("Sorry, you are not allowed to permit this operation.")
+                ids.add(_cafe_id(operation))
+        except InvalidRow as error:
+            results[index] = {"status": "error", "error": str(error)}
+
+    cafes = {}
+    if ids:
+        cafes = {cafe.id: cafe for cafe in session.execute(select(Cafe).where(Cafe.id.in_(ids))).scalars()}
+    known_names = set()
+    known_urls = set()
+    known_place_ids = set()
+    if rows:
+        known = session.execute(select(Cafe.name, Cafe.map_url, Cafe.place_id)
+                                .where(or_(Cafe.name.in_(names), Cafe.map_url.in_(urls),
+                                           Cafe.place_id.in_(place_ids)))).all()
+        known_names = {name for name, map_url, place_id in known}
+        known_urls = {map_url for name, map_url, place_id in known}
+        known_place_ids = {place_id for name, map_url, place_id in known if place_id}
+
+    added = {}
+    deleted = set()
+    for index, operation in enumerate(operations):
+        if results[index] is not None:
+            continue
+        if operation["op"] == "add":
+            row = rows[index]
+            if row["name"] in known_names or row["map_url"] in known_urls or row["place_id"] in known_place_ids:
+                results[index] = {"status": "error", "error": "A cafe with this name, map_url or place_id already exists."}
+                continue
+            cafe = Cafe(**row)
+            session.add(cafe)
+            added[index] = cafe
+            continue
+
+        cafe_id = _cafe_id(operation)
+        cafe = cafes.get(cafe_id)
+        if cafe is None or cafe_id in deleted:
+            results[index] = {"status": "error", "id": cafe_id,
+                              "error": "Sorry, a cafe with that id is not in the database."}
+        elif operation["op"] == "update_price":
+            if queue_prices is not None:
+                prices[cafe_id] = operation.get("coffee_price")
+            else:
+                cafe.coffee_price = operation.get("coffee_price")
+            results[index] = {"status": "ok", "id": cafe_id}
+        else:
+            session.delete(cafe)
+            deleted.add(cafe_id)
+            results[index] = {"status": "ok", "id": cafe_id}
+
+    # one flush for all of them, then the new cafes have their ids
+    session.flush()
+    for index, cafe in added.items():
+        results[index] = {"status": "ok", "id": cafe.id}
+    session.commit()
+    # a price of a cafe deleted later in the batch is not queued
+    prices = {cafe_id: price for cafe_id, price in prices.items() if cafe_id not in deleted}
+    if prices:
+        queue_prices(prices)
+    return results
@@ -0,0 +1,55 @@
+#amenity filters: one condition per boolean column against the indexed amenities mask of models.amenity_filters
+#run: python benchmarks/bench_amenities.py --sizes 100000,1000000
+import argparse
+import os
+import tempfile
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from common import create_database, measure, summary_ms
+from models import Cafe, AMENITY_BITS, mask_for, amenity_filters
+
+
+# from common to rare combinations
+COMBINATIONS = (("has_wifi",), ("has_wifi", "can_take_calls"), tuple(AMENITY_BITS))
+
+
+def booleans(amenities):
+    return [getattr(Cafe, amenity) == True for amenity in amenities]
+
+
+def run(size, workdir, repeat):
+    path = os.path.join(workdir, f"amenities_{size}.db")
+    engine = create_database(path, size)
+    results = {}
+    with Session(engine) as session:
+        for amenities in COMBINATIONS:
+            label = "+".join(amenity.split("_", 1)[1] for amenity in amenities)
+            ways = {"booleans": booleans(amenities), "mask": amenity_filters(mask_for(amenities))}
+            # a page of ids like /api/all and the count of all matches
+            pages = {name: select(Cafe.id).where(*filters).order_by(Cafe.id).limit(100) for name, filters in ways.items()}
+            counts = {name: select(func.count()).select_from(Cafe).where(*filters) for name, filters in ways.items()}
+            assert session.execute(pages["booleans"]).all() == session.execute(pages["mask"]).all()
+            assert session.execute(counts["booleans"]).scalar() == session.execute(counts["mask"]).scalar()
+            results[f"{label} matches"] = session.execute(counts["mask"]).scalar()
+            for name in ways:
+                results[f"{label} count: {name}"] = summary_ms(
+                    measure(lambda: session.execute(counts[name]).scalar(), repeat=repeat, warmup=1))
+                results[f"{label} page: {name}"] = summary_ms(
+                    measure(lambda: session.execute(pages[name]).all(), repeat=repeat, warmup=1))
+    engine.dispose()
+    os.remove(path)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="100000,1000000")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in (int(size) for size in args.sizes.split(",")):
+            for label, result in run(size, workdir, args.repeat).items():
+                print(f"{size:>8} {label:40} {result}")
@@ -0,0 +1,76 @@
+#bulk import/export throughput: one ORM add + commit per cafe (like /api/add) against bulk.import_cafes
+#run: python benchmarks/bench_bulk.py --rows 50000
+import argparse
+import csv
+import io
+import os
+import tempfile
+import time
+
+from sqlalchemy.orm import Session
+
+from common import create_database, synthetic_cafes, CAFE_COLUMNS
+from models import Cafe
+import bulk
+
+
+def input_csv(count, start_id):
+    # the cafes as an import file, without ids, new ones are assigned on insert
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CAFE_COLUMNS[1:])
+    for row in synthetic_cafes(count, seed=9, start_id=start_id):
+        writer.writerow(row[1:])
+    buffer.seek(0)
+    return buffer
+
+
+def rate(count, seconds):
+    return {"rows": count, "seconds": round(seconds, 3), "rows_per_s": round(count / seconds)}
+
+
+def run(rows, per_row_rows, existing, workdir):
+    path = os.path.join(workdir, "bulk.db")
+    engine = create_database(path, existing)
+    results = {}
+
+    with Session(engine) as session:
+        # ids above the existing ones, so names and map_urls are new
+        source = input_csv(per_row_rows, start_id=existing + 1)
+        start = time.perf_counter()
+        for record in bulk.read_records(source, "csv"):
+            session.add(Cafe(**bulk.parse_row(record)))
+            session.commit()
+        results["per-row add + commit"] = rate(per_row_rows, time.perf_counter() - start)
+
+        source = input_csv(rows, start_id=existing + per_row_rows + 1)
+        start = time.perf_counter()
+        report = bulk.import_cafes(session, bulk.read_records(source, "csv"))
+        results["bulk import, batches of 1000"] = rate(report["inserted"], time.perf_counter() - start)
+
+        # every cafe again, all of them are duplicates now
+        source = input_csv(rows, start_id=existing + per_row_rows + 1)
+        start = time.perf_counter()
+        report = bulk.import_cafes(session, bulk.read_records(source, "csv"))
+        results["bulk import, all duplicates"] = rate(report["duplicates"], time.perf_counter() - start)
+
+        for data_format, lines in (("csv", bulk.csv_lines), ("ndjson", bulk.ndjson_lines)):
+            start = time.perf_counter()
+            size = sum(len(chunk) for chunk in lines(bulk.export_rows(session)))
+            count = session.query(Cafe).count()
+            results[f"export {data_format} ({size // 1024} KiB)"] = rate(count, time.perf_counter() - start)
+    engine.dispose()
+    os.remove(path)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--per-row-rows", type=int, default=2000, help="the per row commit path is slow")
+    parser.add_argument("--existing", type=int, default=10000, help="cafes in the DB before the import")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for label, result in run(args.rows, args.per_row_rows, args.existing, workdir).items():
+            print(f"{label:36} {result}")
@@ -0,0 +1,90 @@
+#micro-benchmark of the map of all cafes: the original create_map() with its per-cafe ORM loop against the
+#compact map_payload() built from columns
+#run: python benchmarks/bench_create_map.py --size 10000
+import argparse
+import json
+import os
+import tempfile
+
+from common import create_database, measure, summary_ms
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--size", type=int, default=10000)
+parser.add_argument("--repeat", type=int, default=10)
+args = parser.parse_args()
+
+path = os.path.join(tempfile.mkdtemp(), "bench_create_map.db")
+create_database(path, args.size)
+os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+
+from flask import url_for
+from flask_googlemaps import Map
+import cafe_map
+from main import app
+from models import db, Cafe
+
+
+def legacy_create_map(cafes):
+    # create_map() as it was, without the print(markers_list) of every request
+    markers_list = []
+    max_lat = cafes[0].lat
+    max_lon = cafes[0].lon
+    min_lat = cafes[0].lat
+    min_lon = cafes[0].lon
+    for cafe in cafes:
+        cafe_icons = ""
+        if cafe.has_toilet:
+            cafe_icons += f"<img src=\"{url_for('static', filename='assets/img/wc.png')}\" width=\'30px\'/>"
+        if cafe.has_wifi:
+            cafe_icons += f"<img src=\"{url_for('static', filename='assets/img/wifi.png')}\" width=\'30px\'/>"
+        if cafe.can_take_calls:
+            cafe_icons += f"<img src=\"{url_for('static', filename='assets/img/phone.png')}\" width=\'30px\'/>"
+        if cafe.has_sockets:
+            cafe_icons += f"<img src=\"{url_for('static', filename='assets/img/pwr.png')}\" width=\'30px\'/>"
+        if cafe.lat > 90:
+            cafe.lat = 90
+        if cafe.lon > 180:
+            cafe.lon = 180
+        if cafe.lat < -90:
+            cafe.lat = -90
+        if cafe.lon < -180:
+            cafe.lon = -180
+        marker = {
+            'icon': 'http://maps.google.com/mapfiles/ms/icons/red-dot.png',
+            'lat': cafe.lat,
+            'lng': cafe.lon,
+            'infobox': f"<a href = {url_for('web.show_cafe', cafe_id=cafe.id)} ><h6> {cafe.name} </h6> {cafe_icons} <br /> <img src='{cafe.img_url}' width='200px'/></a>",
+        }
+        if max_lat < cafe.lat:
+            max_lat = cafe.lat
+        if max_lon < cafe.lon:
+            max_lon = cafe.lon
+        if min_lat > cafe.lat:
+            min_lat = cafe.lat
+        if min_lon > cafe.lon:
+            min_lon = cafe.lon
+        markers_list.append(marker)
+    return Map(identifier="all_cafes_map", lat=(max_lat + min_lat) / 2, lng=(max_lon + min_lon) / 2,
+               markers=markers_list, style="height:500px;width:100%;margin:0;", fit_markers_to_bounds=True,
+               maptype_control=False)
+
+
+def legacy():
+    cafes = db.session.execute(db.select(Cafe)).scalars().all()
+    legacy_create_map(cafes)
+    db.session.expunge_all()
+
+
+def pipeline():
+    cafes = db.session.execute(db.select(Cafe.id, Cafe.lat, Cafe.lon)).all()
+    json.dumps(cafe_map.map_payload(cafes))
+
+
+if __name__ == "__main__":
+    # every cafe as its own marker, clustering is measured by bench_map.py
+    cafe_map.MAP_CLUSTER_THRESHOLD = args.size + 1
+    with app.test_request_context("/"):
+        for label, function in (("ORM + per cafe url_for", legacy), ("columns + map payload", pipeline)):
+            stats = summary_ms(measure(function, repeat=args.repeat))
+            print(f"{args.size:>8} cafes  {label:<28} p50 {stats['p50']:>9.1f} ms  p95 {stats['p95']:>9.1f} ms")
+    print("numpy:", "yes" if cafe_map.numpy is not None else "no")
@@ -0,0 +1,50 @@
+#text search latency: old contains/exact matching against the FTS5 index
+#run: python benchmarks/bench_fulltext.py --sizes 1000,100000
+import argparse
+import os
+import random
+import tempfile
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from common import create_database, city_centers, measure, summary_ms
+from models import Cafe
+import fulltext
+
+
+def run(size, workdir, repeat, limit):
+    path = os.path.join(workdir, f"fulltext_{size}.db")
+    engine = create_database(path, size)
+    rnd = random.Random(3)
+    queries = [name for name, lat, lon in rnd.sample(city_centers(), 20)]
+
+    statements = {
+        "web: location contains": lambda q: select(Cafe.id).where(Cafe.location.icontains(q.lower())),
+        "api: location == loc": lambda q: select(Cafe.id).where(Cafe.location == q),
+        "fts5 ranked, limit": lambda q: fulltext.search_statement(q, limit=limit, fts=True).with_only_columns(Cafe.id),
+    }
+    results = {}
+    with Session(engine) as session:
+        for label, build in statements.items():
+            def search():
+                for query in queries:
+                    session.execute(build(query)).all()
+            durations = [d / len(queries) for d in measure(search, repeat=repeat, warmup=1)]
+            results[label] = summary_ms(durations)
+    engine.dispose()
+    os.remove(path)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,100000")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in [int(size) for size in args.sizes.split(",")]:
+            for label, stats in run(size, workdir, args.repeat, args.limit).items():
+                print(f"{size:>9} cafes  {label:<26} p50 {stats['p50']:>9.3f} ms  p95 {stats['p95']:>9.3f} ms")
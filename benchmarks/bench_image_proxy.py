@@ -0,0 +1,70 @@
+#photos of the map infoboxes: bytes a browser loads hot-linking the originals (Google photos at maxwidth=1000)
+#against the 200px thumbnails of the image proxy, and the time of the proxy for a photo it has to load and
+#resize (cold) and for one it already has on disk (warm); offline, the photos come from a seeded directory
+#run: python benchmarks/bench_image_proxy.py --photos 50 (needs Pillow to make the test photos)
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from PIL import Image
+
+from common import ROOT, create_database, summary_ms
+
+
+def seed_photos(directory, count, width=1000, height=750):
+    # noisy pictures compress about like photos do, a plain color would make every JPEG tiny
+    rnd = random.Random(5)
+    for number in range(count):
+        noise = Image.frombytes("L", (width // 4, height // 4), rnd.randbytes(width * height // 16))
+        photo = Image.merge("RGB", (noise, noise.rotate(90, expand=False), noise.transpose(Image.FLIP_LEFT_RIGHT)))
+        photo.resize((width, height)).save(os.path.join(directory, f"{number}.jpg"), quality=85)
+
+
+def run(args, workdir):
+    seed_dir = os.path.join(workdir, "seed")
+    os.makedirs(seed_dir)
+    seed_photos(seed_dir, args.photos)
+    database = os.path.join(workdir, "cafes.db")
+    create_database(database, 10).dispose()
+    os.environ.update(DATABASE_URL=f"sqlite:///{database}", FLASK_APP_SECRET_KEY="benchmark",
+                      IMAGE_CACHE_DIR=os.path.join(workdir, "images"), IMAGE_SEED_DIR=seed_dir,
+                      IMAGE_PROXY_OFFLINE="1")
+    import main
+    import image_proxy
+
+    sources = [f"https://lh3.example.com/p/{number}.jpg" for number in range(args.photos)]
+    with main.app.test_request_context():
+        urls = [image_proxy.proxied(source, 200) for source in sources]
+    client = main.app.test_client()
+
+    durations = {"cold": [], "warm": []}
+    sizes = []
+    for phase in ("cold", "warm"):
+        for url in urls:
+            start = time.perf_counter()
+            response = client.get(url)
+            durations[phase].append(time.perf_counter() - start)
+            assert response.status_code == 200, response.status_code
+            if phase == "cold":
+                sizes.append(len(response.data))
+    original = sum(os.path.getsize(os.path.join(seed_dir, f"{number}.jpg")) for number in range(args.photos))
+    return {
+        "originals kB": round(original / 1024),
+        "thumbnails kB": round(sum(sizes) / 1024),
+        "cold ms": summary_ms(durations["cold"]),
+        "warm ms": summary_ms(durations["warm"]),
+        "cache": main.app.extensions["image_proxy"].image_cache.stats(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--photos", type=int, default=50)
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    with tempfile.TemporaryDirectory() as workdir:
+        for label, result in run(args, workdir).items():
+            print(f"{args.photos:>6} photos {label:16} {result}")
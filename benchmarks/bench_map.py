@@ -0,0 +1,53 @@
+#size of the map and time to build it: markers with their infoboxes inlined in the page (flask_googlemaps),
+#the compact data of map_payload() for static/js/cafes_map.js, every cafe as a marker vs server side clusters
+#run: python benchmarks/bench_map.py --sizes 10000,100000
+import argparse
+import json
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+from flask_googlemaps import Map
+
+from common import CAFE_COLUMNS, synthetic_cafes
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_map.db')}")
+import cafe_map
+from main import app
+
+
+def inline(cafes):
+    # the page as it was, every marker and infobox inside the html
+    start = time.perf_counter()
+    with app.test_request_context("/"):
+        fragments = cafe_map.marker_fragments()
+        markers = [cafe_map.cafe_marker(cafe, cafe.lat, cafe.lon, fragments) for cafe in cafes]
+        cafes_map = Map(identifier="all_cafes_map", lat=0, lng=0, markers=markers, fit_markers_to_bounds=True)
+        payload = str(cafes_map.html) + str(cafes_map.js)
+    return time.perf_counter() - start, len(payload.encode()), len(markers)
+
+
+def build(cafes, threshold):
+    cafe_map.MAP_CLUSTER_THRESHOLD = threshold
+    start = time.perf_counter()
+    with app.test_request_context("/"):
+        data = cafe_map.map_payload(cafes)
+        payload = json.dumps(data, separators=(",", ":"))
+    return time.perf_counter() - start, len(payload.encode()), len(data["ids"]) + len(data["clusters"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,100000")
+    parser.add_argument("--threshold", type=int, default=200)
+    args = parser.parse_args()
+
+    for size in [int(size) for size in args.sizes.split(",")]:
+        cafes = [SimpleNamespace(**dict(zip(CAFE_COLUMNS, row))) for row in synthetic_cafes(size)]
+        runs = (("inline, all markers", lambda: inline(cafes)),
+                ("data, all markers", lambda: build(cafes, size + 1)),
+                ("data, clustered", lambda: build(cafes, args.threshold)))
+        for label, run in runs:
+            duration, payload, markers = run()
+            print(f"{size:>8} cafes  {label:<20} {markers:>7} markers  {payload / 1024:>10.1f} KiB  {duration * 1000:>9.1f} ms")
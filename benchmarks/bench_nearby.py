@@ -0,0 +1,76 @@
+#nearest cafes: naive haversine over every row against the geohash cells of spatial.nearby_condition
+#run: python benchmarks/bench_nearby.py --sizes 10000,1000000
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from common import create_database, city_centers, measure, summary_ms
+from geo import haversine_m
+from models import Cafe
+from spatial import nearby_condition, rank_by_distance
+
+
+def points(count, seed=5):
+    # places in the "cities" of the synthetic data, some busy, some empty
+    rnd = random.Random(seed)
+    cities = city_centers()
+    return [(lat + rnd.gauss(0, 0.05), lon + rnd.gauss(0, 0.05))
+            for name, lat, lon in (cities[rnd.randrange(len(cities))] for _ in range(count))]
+
+
+def naive(session, lat, lon, radius, limit):
+    rows = session.execute(select(Cafe.id, Cafe.lat, Cafe.lon)).all()
+    ranked = sorted((haversine_m(lat, lon, row.lat, row.lon), row.id) for row in rows)
+    return [cafe_id for distance, cafe_id in ranked if distance <= radius][:limit]
+
+
+def geohash(session, lat, lon, radius, limit):
+    rows = session.execute(select(Cafe.id, Cafe.lat, Cafe.lon).where(nearby_condition(lat, lon, radius))).all()
+    return [row.id for distance, row in rank_by_distance(lat, lon, radius, rows, limit)]
+
+
+def run(size, workdir, radius, limit, repeat):
+    path = os.path.join(workdir, f"nearby_{size}.db")
+    engine = create_database(path, size)
+    queries = points(20)
+    results = {}
+    with Session(engine) as session:
+        # the full scan takes seconds at a million rows, it runs once for a few points only,
+        # which also checks that both ways find the same cafes
+        durations = []
+        for lat, lon in queries[:5]:
+            start = time.perf_counter()
+            expected = naive(session, lat, lon, radius, limit)
+            durations.append(time.perf_counter() - start)
+            assert expected == geohash(session, lat, lon, radius, limit)
+        results["naive full scan"] = summary_ms(durations)
+
+        def search():
+            for lat, lon in queries:
+                geohash(session, lat, lon, radius, limit)
+        durations = [d / len(queries) for d in measure(search, repeat=repeat, warmup=1)]
+        results["geohash cells"] = summary_ms(durations)
+        found = sum(len(geohash(session, lat, lon, radius, limit)) for lat, lon in queries) / len(queries)
+    results["cafes found per query"] = round(found, 1)
+    engine.dispose()
+    os.remove(path)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,1000000")
+    parser.add_argument("--radius", type=float, default=1000, help="meters")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in (int(size) for size in args.sizes.split(",")):
+            for label, result in run(size, workdir, args.radius, args.limit, args.repeat).items():
+                print(f"{size:>8} {label:22} {result}")
@@ -0,0 +1,64 @@
+#duplicate checks of add() and locate(): cafe name scan against the unique place_id index, and the candidates of
+#one locate page checked one by one against a single IN query of models.known_places; also times the backfill
+#init-db does for a database made before the place_id column existed
+#run: python benchmarks/bench_place_id.py --sizes 10000,100000
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+
+from common import create_database, measure, summary_ms
+from models import Cafe, known_places, init_place_id_column
+
+
+# candidates of one Places text search page
+CANDIDATES = 20
+
+
+def run(size, workdir, repeat):
+    path = os.path.join(workdir, f"place_id_{size}.db")
+    engine = create_database(path, size)
+    rnd = random.Random(3)
+    # half of the candidates are already in the list
+    ids = [rnd.randint(1, size) for _ in range(CANDIDATES // 2)] + list(range(size + 1, size + 1 + CANDIDATES // 2))
+    place_ids = [f"synthetic{cafe_id}" for cafe_id in ids]
+    names = [f"Cafe {cafe_id} High Street" for cafe_id in ids]
+    results = {}
+    with Session(engine) as session:
+        results["add check: name"] = summary_ms(measure(
+            lambda: session.execute(select(Cafe).where(Cafe.name == names[0])).scalar(), repeat=repeat))
+        results["add check: place_id"] = summary_ms(measure(
+            lambda: session.execute(select(Cafe).where(Cafe.place_id == place_ids[0])).scalar(), repeat=repeat))
+        results[f"{CANDIDATES} candidates: one query each"] = summary_ms(measure(
+            lambda: [session.execute(select(Cafe.id, Cafe.img_url).where(Cafe.place_id == place_id)).first()
+                     for place_id in place_ids], repeat=repeat))
+        results[f"{CANDIDATES} candidates: one IN query"] = summary_ms(measure(
+            lambda: known_places(session, place_ids), repeat=repeat))
+        assert len(known_places(session, place_ids)) == CANDIDATES // 2
+
+    # an older database: no column, no index
+    with engine.begin() as connection:
+        connection.execute(text("DROP INDEX ix_cafe_place_id"))
+        connection.execute(text("ALTER TABLE cafe DROP COLUMN place_id"))
+    start = time.perf_counter()
+    init_place_id_column(engine)
+    results["backfill ms"] = round((time.perf_counter() - start) * 1000, 1)
+    engine.dispose()
+    os.remove(path)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,100000")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in (int(size) for size in args.sizes.split(",")):
+            for label, result in run(size, workdir, args.repeat).items():
+                print(f"{size:>8} {label:40} {result}")
@@ -0,0 +1,92 @@
+#sustained price updates from many threads: one ORM load and commit per update (what the views do without
+#PRICE_WRITE_BEHIND) against write_buffer.PriceBuffer, which coalesces them and writes one transaction per flush;
+#reports the updates per second, the write transactions and how long the last flush took after the burst
+#run: python benchmarks/bench_price_buffer.py --size 10000 --threads 8 --seconds 5 --synchronous NORMAL,FULL
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import Session
+
+from common import create_database
+from database import sqlite_pragmas, configure_sqlite
+from models import Cafe
+from write_buffer import PriceBuffer
+
+
+def burst(update, threads, seconds, hot):
+    # every thread updates random cafes of the hot set until the time is up, returns the number of updates
+    counts = [0] * threads
+    stop_at = time.perf_counter() + seconds
+
+    def worker(number):
+        rnd = random.Random(number)
+        while time.perf_counter() < stop_at:
+            update(rnd.randint(1, hot), f"£{rnd.uniform(1.5, 4.5):.2f}")
+            counts[number] += 1
+
+    workers = [threading.Thread(target=worker, args=(number,)) for number in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return sum(counts)
+
+
+def run(size, synchronous, workdir, args):
+    path = os.path.join(workdir, f"prices_{size}.db")
+    create_database(path, size).dispose()
+    results = {}
+    for mode in ("commit", "buffer"):
+        engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+        configure_sqlite(engine, dict(sqlite_pragmas(), synchronous=synchronous))
+        commits = [0]
+        event.listen(engine, "commit", lambda connection: commits.__setitem__(0, commits[0] + 1))
+
+        if mode == "commit":
+            def update(cafe_id, coffee_price):
+                with Session(engine) as session:
+                    cafe = session.execute(select(Cafe).where(Cafe.id == cafe_id)).scalar()
+                    cafe.coffee_price = coffee_price
+                    session.commit()
+            updates = burst(update, args.threads, args.seconds, args.hot)
+            drain_ms = 0.0
+        else:
+            buffer = PriceBuffer(max_size=args.flush_size, interval=args.flush_interval)
+            buffer.bind(engine)
+
+            def update(cafe_id, coffee_price):
+                # the views load the cafe first, from the read connections
+                with Session(engine) as session:
+                    session.execute(select(Cafe.id).where(Cafe.id == cafe_id)).scalar()
+                buffer.add(cafe_id, coffee_price)
+            updates = burst(update, args.threads, args.seconds, args.hot)
+            start = time.perf_counter()
+            buffer.close()
+            drain_ms = (time.perf_counter() - start) * 1000
+        results[mode] = {"updates_per_s": round(updates / args.seconds), "write_transactions": commits[0],
+                         "drain_ms": round(drain_ms, 1)}
+        engine.dispose()
+    os.remove(path)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=10000)
+    parser.add_argument("--hot", type=int, default=1000, help="updates go to the cafes with ids 1..hot")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--synchronous", default="NORMAL,FULL")
+    parser.add_argument("--flush-size", type=int, default=200)
+    parser.add_argument("--flush-interval", type=float, default=1.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for synchronous in args.synchronous.split(","):
+            for mode, result in run(args.size, synchronous, workdir, args).items():
+                print(f"{args.size:>8} synchronous={synchronous:7} {mode:7} {result}")
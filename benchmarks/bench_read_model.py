@@ -0,0 +1,80 @@
+#memory per cafe and latency of the hot reads: ORM instances, rows of the selected columns and read_model.ReadModel
+#run: python benchmarks/bench_read_model.py --sizes 10000,100000
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from common import create_database, measure, summary_ms
+from models import Cafe, API_COLUMNS, MAP_COLUMNS, cafe_to_json
+from read_model import ReadModel
+
+
+def held_bytes(build):
+    # memory still allocated by what build() returns
+    gc.collect()
+    tracemalloc.start()
+    kept = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return kept, size
+
+
+def run(size, workdir, repeat):
+    path = os.path.join(workdir, f"read_model_{size}.db")
+    engine = create_database(path, size)
+    results = {}
+
+    with Session(engine) as session:
+        orm, orm_bytes = held_bytes(lambda: session.execute(select(Cafe)).scalars().all())
+        del orm
+        session.expunge_all()
+        rows, rows_bytes = held_bytes(lambda: session.execute(select(*API_COLUMNS)).all())
+        del rows
+    model = ReadModel(engine)
+    start = time.perf_counter()
+    model.build()
+    build_s = time.perf_counter() - start
+    model, model_bytes = held_bytes(lambda: (model.build(), model)[1])
+    results["memory per cafe, bytes"] = {"orm": round(orm_bytes / size), "rows": round(rows_bytes / size),
+                                         "read model": round(model_bytes / size)}
+    results["read model build, s"] = round(build_s, 2)
+
+    with Session(engine) as session:
+        paths = {
+            "all cafes json: orm": lambda: [cafe_to_json(cafe) for cafe in session.execute(select(Cafe)).scalars()],
+            "all cafes json: rows": lambda: [cafe_to_json(row) for row in session.execute(select(*API_COLUMNS))],
+            "all cafes json: read model": lambda: [cafe_to_json(row) for row in model.api_rows()],
+            "map rows: rows": lambda: session.execute(select(*MAP_COLUMNS)).all(),
+            "map rows: read model": lambda: model.map_rows(),
+            "wifi+calls page of 100: rows": lambda: session.execute(
+                select(*API_COLUMNS).where(Cafe.has_wifi == True, Cafe.can_take_calls == True)
+                .order_by(Cafe.id).limit(100)).all(),
+            "wifi+calls page of 100: read model": lambda: model.api_rows(2 | 8, 0, 100),
+        }
+        for label, function in paths.items():
+            def read():
+                function()
+                # the ORM path keeps its instances in the identity map otherwise
+                session.expunge_all()
+            results[label] = summary_ms(measure(read, repeat=repeat, warmup=1))
+    engine.dispose()
+    os.remove(path)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,100000")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in (int(size) for size in args.sizes.split(",")):
+            for label, result in run(size, workdir, args.repeat).items():
+                print(f"{size:>7} {label:36} {result}")
@@ -0,0 +1,64 @@
+#search latency of the old text() bounding box + OR location query against the spatial index
+#run: python benchmarks/bench_spatial.py --sizes 1000,100000,1000000
+import argparse
+import os
+import random
+import tempfile
+
+from sqlalchemy import select, text, or_
+from sqlalchemy.orm import Session
+
+from common import create_database, city_centers, measure, summary_ms
+from models import Cafe
+import spatial
+
+
+def legacy_query(lat_min, lat_max, lon_min, lon_max, place):
+    # what search() did before: one string condition OR'ed with the location match
+    lat_lon_condition = f'(Cafe.lat < {lat_max}) AND (Cafe.lat > {lat_min}) AND (Cafe.lon < {lon_max}) AND (Cafe.lon > {lon_min})'
+    return [select(Cafe.id).where(or_(text(lat_lon_condition), Cafe.location.icontains(place.lower())))]
+
+
+def indexed_query(lat_min, lat_max, lon_min, lon_max, place):
+    return [select(Cafe.id).where(spatial.bounds_condition(lat_min, lat_max, lon_min, lon_max, rtree=True)),
+            select(Cafe.id).where(Cafe.location.icontains(place.lower()))]
+
+
+def viewport_only_query(lat_min, lat_max, lon_min, lon_max, place):
+    return [select(Cafe.id).where(spatial.bounds_condition(lat_min, lat_max, lon_min, lon_max, rtree=True))]
+
+
+def run(size, workdir, repeat):
+    path = os.path.join(workdir, f"spatial_{size}.db")
+    engine = create_database(path, size)
+    rnd = random.Random(1)
+    viewports = []
+    for name, lat, lon in rnd.sample(city_centers(), 20):
+        viewports.append((lat - 0.05, lat + 0.05, lon - 0.05, lon + 0.05, name))
+
+    results = {}
+    with Session(engine) as session:
+        for label, builder in (("legacy text() OR", legacy_query),
+                               ("viewport index + location", indexed_query),
+                               ("viewport index only", viewport_only_query)):
+            def search():
+                for viewport in viewports:
+                    for statement in builder(*viewport):
+                        session.execute(statement).all()
+            durations = [d / len(viewports) for d in measure(search, repeat=repeat, warmup=1)]
+            results[label] = summary_ms(durations)
+    engine.dispose()
+    os.remove(path)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,100000,1000000")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in [int(size) for size in args.sizes.split(",")]:
+            for label, stats in run(size, workdir, args.repeat).items():
+                print(f"{size:>9} cafes  {label:<28} p50 {stats['p50']:>9.3f} ms  p95 {stats['p95']:>9.3f} ms")
@@ -0,0 +1,97 @@
+#mixed read/write throughput of the SQLite setup: SQLite defaults (rollback journal) against the tuned
+#connections of database.py (WAL, synchronous=NORMAL, busy timeout, cache, read only engine for the readers)
+#run: python benchmarks/bench_sqlite.py --readers 8 --writers 2 --duration 10
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from common import create_database, percentile
+from models import Cafe, MAP_COLUMNS
+from spatial import bounds_condition
+import database
+
+
+def reader(engine, count, stop_at, stats):
+    rnd = random.Random()
+    with Session(engine) as session:
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            try:
+                if rnd.random() < 0.5:
+                    session.execute(select(Cafe).where(Cafe.id == rnd.randint(1, count))).scalar()
+                else:
+                    lat, lon = rnd.uniform(-50, 60), rnd.uniform(-160, 160)
+                    session.execute(select(*MAP_COLUMNS).where(bounds_condition(lat - 2, lat + 2, lon - 2, lon + 2, rtree=True))).all()
+                session.rollback()
+            except OperationalError:
+                session.rollback()
+                stats["read_errors"] += 1
+                continue
+            stats["read_latency"].append(time.perf_counter() - start)
+
+
+def writer(engine, count, stop_at, stats):
+    rnd = random.Random()
+    with Session(engine) as session:
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            try:
+                session.execute(update(Cafe).where(Cafe.id == rnd.randint(1, count))
+                                .values(coffee_price=f"{rnd.uniform(1, 5):.2f}"))
+                session.commit()
+            except OperationalError:
+                session.rollback()
+                stats["write_errors"] += 1
+                continue
+            stats["write_latency"].append(time.perf_counter() - start)
+
+
+def run(label, write_engine, read_engine, count, readers, writers, duration):
+    stats = {"read_latency": [], "write_latency": [], "read_errors": 0, "write_errors": 0}
+    stop_at = time.perf_counter() + duration
+    threads = [threading.Thread(target=reader, args=(read_engine, count, stop_at, stats)) for _ in range(readers)]
+    threads += [threading.Thread(target=writer, args=(write_engine, count, stop_at, stats)) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"{label:8} reads/s {len(stats['read_latency']) / duration:8.0f}"
+          f"  p99 {percentile(stats['read_latency'], 0.99) * 1000:7.1f} ms  errors {stats['read_errors']:4}"
+          f"  | writes/s {len(stats['write_latency']) / duration:6.0f}"
+          f"  p99 {percentile(stats['write_latency'], 0.99) * 1000:7.1f} ms  errors {stats['write_errors']:4}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cafes", type=int, default=50000)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "sqlite.db")
+        create_database(path, args.cafes).dispose()
+
+        # SQLite defaults, python's sqlite3 waits 5 s for a lock, the same as the app did
+        engine = create_engine(f"sqlite:///{path}")
+        run("default", engine, engine, args.cafes, args.readers, args.writers, args.duration)
+        engine.dispose()
+
+        pragmas = database.sqlite_pragmas({})
+        engine = create_engine(f"sqlite:///{path}")
+        database.configure_sqlite(engine, pragmas)
+        with engine.connect():
+            # the first connection switches the file to WAL
+            pass
+        read_engine = database.create_read_engine(engine, pragmas)
+        run("tuned", engine, read_engine, args.cafes, args.readers, args.writers, args.duration)
+        read_engine.dispose()
+        engine.dispose()
@@ -0,0 +1,79 @@
+#cold start of a worker: a fresh python process imports the app and answers its first request
+#reports the import time, the time to the first API answer and the first page, peak memory and the heavy
+#packages the process loaded; every run gets its own copy of the database, like a new machine of an autoscaler
+#run: python benchmarks/bench_startup.py --size 10000 --runs 10
+#     python benchmarks/bench_startup.py --env API_ONLY=1   (an API only worker)
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from common import ROOT, create_database
+
+
+# packages of the pages (forms, Google Maps, Bootstrap) and of the Google calls
+WATCHED_MODULES = ("wtforms", "flask_wtf", "flask_googlemaps", "flask_bootstrap", "requests", "httpx", "numpy")
+
+# runs in the fresh process, prints one JSON line
+WORKER = """
+import json, resource, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+client = main.app.test_client()
+api_status = client.get("/api/cafe/1").status_code
+api_done = time.perf_counter()
+page_status = client.get(sys.argv[1]).status_code
+page_done = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "first_api_ms": (api_done - imported) * 1000,
+    "first_page_ms": (page_done - api_done) * 1000,
+    "statuses": [api_status, page_status],
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "modules": len(sys.modules),
+    "loaded": [name for name in %r if name in sys.modules],
+}))
+""" % (WATCHED_MODULES,)
+
+
+def run_once(database, workdir, number, env, page):
+    path = os.path.join(workdir, f"startup_{number}.db")
+    shutil.copy(database, path)
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}", FLASK_APP_SECRET_KEY="benchmark", **env)
+    try:
+        output = subprocess.run([sys.executable, "-c", WORKER, page], cwd=ROOT, env=env, capture_output=True,
+                                text=True, check=True).stdout
+    except subprocess.CalledProcessError as error:
+        raise RuntimeError(f"the worker failed:\n{error.stderr[-2000:]}")
+    finally:
+        for leftover in (path, path + "-wal", path + "-shm"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=10000, help="cafes in the synthetic database")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--page", default="/", help="page asked for after the first API call")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="system var for the app")
+    args = parser.parse_args()
+
+    env = dict(setting.split("=", 1) for setting in args.env)
+    with tempfile.TemporaryDirectory() as workdir:
+        database = os.path.join(workdir, "startup.db")
+        create_database(database, args.size).dispose()
+        # the first run warms the disk cache of the python files, it is not counted
+        runs = [run_once(database, workdir, number, env, args.page) for number in range(args.runs + 1)][1:]
+
+    print(f"{args.size} cafes, {args.runs} runs, env {env or '-'}, statuses {runs[0]['statuses']}")
+    for field in ("import_ms", "first_api_ms", "first_page_ms", "peak_rss_mb", "modules"):
+        values = [run[field] for run in runs]
+        print(f"{field:14} median {statistics.median(values):8.1f}  min {min(values):8.1f}  max {max(values):8.1f}")
+    print("loaded:", ", ".join(runs[0]["loaded"]) or "-")
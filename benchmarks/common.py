@@ -0,0 +1,137 @@
+#shared helpers of the benchmark scripts: synthetic cafes, throw-away databases and timing
+import os
+import random
+import re
+import socket
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import create_engine
+
+from models import db, init_amenity_column, init_place_id_column
+from spatial import init_spatial_index, init_geohash_column
+from fulltext import init_fulltext_index
+from response_cache import init_cache_versions
+
+
+CAFE_COLUMNS = ("id", "name", "map_url", "img_url", "location", "seats", "has_toilet", "has_wifi",
+                "has_sockets", "can_take_calls", "coffee_price", "lat", "lon")
+
+# token of the Flask-WTF forms, load tests post the forms like a browser does
+CSRF_TOKEN = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+
+STREETS = ["High Street", "Station Road", "Church Lane", "Market Square", "Bridge Street", "Park Avenue",
+           "Mill Lane", "King Street", "Queen Street", "Victoria Road"]
+
+
+def city_centers(count=500, seed=7):
+    rnd = random.Random(seed)
+    return [(f"City{i}", rnd.uniform(-55, 65), rnd.uniform(-170, 170)) for i in range(count)]
+
+
+def synthetic_cafes(count, seed=42, start_id=1, cities=None):
+    # yields rows in CAFE_COLUMNS order, cafes are scattered around a few hundred "cities"
+    rnd = random.Random(seed)
+    cities = cities or city_centers()
+    for cafe_id in range(start_id, start_id + count):
+        city, lat, lon = cities[rnd.randrange(len(cities))]
+        street = STREETS[rnd.randrange(len(STREETS))]
+        yield (
+            cafe_id,
+            f"Cafe {cafe_id} {street}",
+            f"https://www.google.com/maps/place/?q=place_id:synthetic{cafe_id}",
+            f"https://example.com/img/{cafe_id}.jpg",
+            f"{street}, {city}",
+            rnd.choice(["0-10", "10-20", "20-30", "30-40", "50+"]),
+            rnd.random() < 0.7,
+            rnd.random() < 0.8,
+            rnd.random() < 0.5,
+            rnd.random() < 0.4,
+            f"{rnd.uniform(1.5, 4.5):.2f}",
+            lat + rnd.gauss(0, 0.08),
+            lon + rnd.gauss(0, 0.08),
+        )
+
+
+def create_database(path, count, seed=42, batch_size=10000):
+    # fresh sqlite file with the app schema and count synthetic cafes, returns the engine
+    if os.path.exists(path):
+        os.remove(path)
+    engine = create_engine(f"sqlite:///{path}")
+    db.metadata.create_all(engine)
+
+    placeholders = ", ".join("?" for _ in CAFE_COLUMNS)
+    insert = f"INSERT INTO cafe ({', '.join(CAFE_COLUMNS)}) VALUES ({placeholders})"
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        batch = []
+        for row in synthetic_cafes(count, seed):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                cursor.executemany(insert, batch)
+                batch = []
+        if batch:
+            cursor.executemany(insert, batch)
+        connection.commit()
+    finally:
+        connection.close()
+    # the indexes are built after the load, like the app does for a DB made by another tool
+    init_spatial_index(engine)
+    init_geohash_column(engine)
+    init_amenity_column(engine)
+    init_place_id_column(engine)
+    init_fulltext_index(engine)
+    init_cache_versions(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("ANALYZE")
+    return engine
+
+
+def measure(function, repeat=20, warmup=2):
+    # runs function repeat times, returns the list of durations in seconds
+    for _ in range(warmup):
+        function()
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def percentile(durations, share):
+    ordered = sorted(durations)
+    index = min(len(ordered) - 1, max(0, round(share * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summary_ms(durations):
+    return {
+        "p50": round(statistics.median(durations) * 1000, 3),
+        "p95": round(percentile(durations, 0.95) * 1000, 3),
+        "p99": round(percentile(durations, 0.99) * 1000, 3),
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, process, attempts=100):
+    # True once something listens on the port, False if the process died or never got there
+    for _ in range(attempts):
+        if process.poll() is not None:
+            return False
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
@@ -0,0 +1,118 @@
+#local stand-in for the Google Places web service (text search + photo redirect)
+#run:   python benchmarks/fake_places.py --port 8765 --latency 0.05
+#then:  GOOGLE_MAPS_API_URL=http://127.0.0.1:8765 python main.py
+#or start it in-process with start_fake_places() from a benchmark script
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+# smallest valid GIF, served as the "photo"
+PIXEL_GIF = (b"GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00"
+             b",\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;")
+
+
+def fake_text_search(query, candidates=20):
+    # deterministic answer for a query, the same query always lands on the same place
+    seed = int(hashlib.sha1(query.encode()).hexdigest()[:8], 16)
+    rnd = random.Random(seed)
+    lat = rnd.uniform(-60, 60)
+    lng = rnd.uniform(-170, 170)
+    results = []
+    for i in range(candidates):
+        c_lat = lat + rnd.uniform(-0.02, 0.02)
+        c_lng = lng + rnd.uniform(-0.02, 0.02)
+        results.append({
+            "name": f"Fake cafe {seed % 1000}-{i}",
+            "place_id": f"fake{seed:x}{i:02d}",
+            "formatted_address": f"{i} Fake street, {query}",
+            "geometry": {
+                "location": {"lat": c_lat, "lng": c_lng},
+                "viewport": {"northeast": {"lat": lat + 0.05, "lng": lng + 0.05},
+                             "southwest": {"lat": lat - 0.05, "lng": lng - 0.05}},
+            },
+            "photos": [{"photo_reference": f"ref{seed:x}{i:02d}"}],
+        })
+    return {"status": "OK", "results": results}
+
+
+class FakePlacesHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    photo_latency = None
+    failure_rate = 0.0
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+
+        if url.path.startswith("/photos/"):
+            return self._send(200, PIXEL_GIF, "image/gif")
+
+        latency = self.latency
+        if url.path == "/maps/api/place/photo" and self.photo_latency is not None:
+            latency = self.photo_latency
+        if latency:
+            time.sleep(latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            return self._send(503, b'{"status": "UNKNOWN_ERROR"}', "application/json")
+
+        if url.path == "/maps/api/place/textsearch/json":
+            query = params.get("query", [""])[0].strip("'")
+            body = json.dumps(fake_text_search(query)).encode()
+            return self._send(200, body, "application/json")
+
+        if url.path == "/maps/api/place/photo":
+            reference = params.get("photo_reference", [""])[0]
+            host = self.headers.get("Host")
+            self.send_response(302)
+            self.send_header("Location", f"http://{host}/photos/{reference}.gif")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        return self._send(404, b'{"status": "NOT_FOUND"}', "application/json")
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_places(port=0, latency=0.0, photo_latency=None, failure_rate=0.0):
+    # starts the stub in a daemon thread, returns (server, base_url), stop it with server.shutdown()
+    handler = type("ConfiguredFakePlacesHandler", (FakePlacesHandler,),
+                   {"latency": latency, "photo_latency": photo_latency, "failure_rate": failure_rate})
+    # a locate page asks for all candidate photos at once, the default listen backlog of 5 drops connections
+    server_class = type("FakePlacesServer", (ThreadingHTTPServer,), {"request_queue_size": 256})
+    server = server_class(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Google Places API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every API call")
+    parser.add_argument("--photo-latency", type=float, default=None, help="seconds added to photo calls")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of calls answered with 503")
+    args = parser.parse_args()
+
+    server, base_url = start_fake_places(args.port, args.latency, args.photo_latency, args.failure_rate)
+    print(f"Fake Places API running on {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
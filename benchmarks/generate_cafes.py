@@ -0,0 +1,26 @@
+#fills a database file with synthetic cafes (the app schema, indexes included) for benchmarks and manual testing
+#run: python benchmarks/generate_cafes.py --size 100000 --path /tmp/cafes.db
+#then: DATABASE_URL=sqlite:////tmp/cafes.db python main.py
+#or replace the app database: python benchmarks/generate_cafes.py --size 10000 --path instance/cafes.db --force
+import argparse
+import os
+import sys
+import time
+
+from common import ROOT, create_database
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=10000, help="number of cafes")
+    parser.add_argument("--path", default=os.path.join(ROOT, "instance", "cafes.db"))
+    parser.add_argument("--seed", type=int, default=42, help="the same seed and size give the same cafes")
+    parser.add_argument("--force", action="store_true", help="overwrite an existing file")
+    args = parser.parse_args()
+
+    if os.path.exists(args.path) and not args.force:
+        sys.exit(f"{args.path} exists, use --force to replace it")
+    os.makedirs(os.path.dirname(os.path.abspath(args.path)), exist_ok=True)
+    start = time.perf_counter()
+    create_database(args.path, args.size, seed=args.seed).dispose()
+    print(f"{args.size} cafes written to {args.path} in {time.perf_counter() - start:.1f} s")
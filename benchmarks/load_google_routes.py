@@ -0,0 +1,111 @@
+#load test of the Google dependent routes: the sync views against the async Google calls of asgi.py
+#both modes run under uvicorn with the same number of view threads, sync (ASYNC_GOOGLE=0) waits for Google
+#inside the threads like the WSGI workers do, async awaits Google before a thread is taken
+#run: python benchmarks/load_google_routes.py --latency 0.2 --concurrency 64 --threads 8 --duration 10
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from common import ROOT, CSRF_TOKEN, create_database, percentile, free_port, wait_for_port
+from fake_places import start_fake_places
+
+
+ROUTES = {
+    # route: (form page, field with the query)
+    "search": ("/search", "location"),
+    "locate": ("/locate", "text_input"),
+}
+
+
+def start_server(port, env):
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "asgi:application", "--port", str(port),
+                               "--log-level", "warning"], cwd=ROOT, env=env)
+    if not wait_for_port(port, server):
+        server.kill()
+        raise RuntimeError("uvicorn did not start")
+    return server
+
+
+async def user(number, base_url, route, stop_at, latencies, errors):
+    page, field = ROUTES[route]
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        token = CSRF_TOKEN.search((await client.get(page)).text).group(1)
+        request_number = 0
+        while time.perf_counter() < stop_at:
+            request_number += 1
+            # a new place every time, so the Places cache never answers
+            query = f"Town {number}-{request_number}"
+            start = time.perf_counter()
+            try:
+                response = await client.post(page, data={"csrf_token": token, field: query})
+            except httpx.HTTPError as error:
+                errors.append(type(error).__name__)
+                continue
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors.append(response.status_code)
+
+
+async def load(base_url, route, concurrency, duration):
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*[user(number, base_url, route, start + duration, latencies, errors)
+                           for number in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    return {
+        "requests_per_s": round(len(latencies) / elapsed, 1),
+        "ok": len(latencies),
+        "errors": len(errors),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000) if latencies else None,
+    }
+
+
+def run(args, workdir):
+    path = os.path.join(workdir, "load.db")
+    create_database(path, args.cafes).dispose()
+    fake_server, fake_url = start_fake_places(latency=args.latency)
+    results = {}
+    try:
+        for mode in ("sync", "async"):
+            port = free_port()
+            env = dict(os.environ,
+                       DATABASE_URL=f"sqlite:///{path}",
+                       GOOGLE_MAPS_API_URL=fake_url,
+                       FLASK_APP_SECRET_KEY="load-test",
+                       ASYNC_GOOGLE="1" if mode == "async" else "0",
+                       ASGI_THREADS=str(args.threads),
+                       GOOGLE_MAPS_POOL_SIZE=str(max(args.threads, 16)),
+                       PHOTO_CONCURRENCY=str(max(args.threads, 8)))
+            server = start_server(port, env)
+            try:
+                results[mode] = asyncio.run(load(f"http://127.0.0.1:{port}", args.route,
+                                                 args.concurrency, args.duration))
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        fake_server.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--route", choices=sorted(ROUTES), default="search")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds every fake Google call takes")
+    parser.add_argument("--concurrency", type=int, default=64, help="clients sending requests at the same time")
+    parser.add_argument("--threads", type=int, default=8, help="view threads, the sync worker count")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--cafes", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for mode, result in run(args, workdir).items():
+            print(f"{args.route} {mode:5} {result}")
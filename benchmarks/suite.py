@@ -0,0 +1,290 @@
+#benchmark suite of the routes: synthetic database, local Google stub and load runs of the main scenarios
+#every scenario gets a fresh app process and its own copy of the database, the run reports p50/p95/p99 latency,
+#throughput and the peak memory (RSS) of the app process; results are saved in benchmarks/results/ named by commit
+#run:     python benchmarks/suite.py --sizes 1000,10000 --duration 10 --concurrency 8 --latency 0.05
+#config:  python benchmarks/suite.py --env READ_MODEL=1 --env INSTRUMENTATION=1 --label read-model
+#compare: python benchmarks/suite.py --compare benchmarks/results/<older>.json  (runs, then compares)
+#         python benchmarks/suite.py --compare <older>.json <newer>.json       (only compares)
+#the load generator runs on the same machine, compare results of the same machine only
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+from common import ROOT, CSRF_TOKEN, create_database, city_centers, percentile, free_port, wait_for_port
+from fake_places import start_fake_places
+
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+CITIES = len(city_centers())
+WRITE_SHARE = 0.2
+
+
+async def csrf_token(client, state, page):
+    # every simulated user gets its form token once, like a browser keeping its session
+    if page not in state:
+        state[page] = CSRF_TOKEN.search((await client.get(page)).text).group(1)
+    return state[page]
+
+
+async def landing(client, state, rnd, size):
+    # the page and the tiles of the first view of its map (zoom 2, the whole world), like a browser loads them
+    response = await client.get("/")
+    if response.status_code != 200:
+        return response
+    for row in range(2):
+        for column in range(4):
+            response = await client.get(f"/api/tiles/2/{row}/{column}")
+            if response.status_code != 200:
+                return response
+    return response
+
+
+async def search(client, state, rnd, size):
+    # a city of the synthetic data with an amenity filter, the Places answer gets cached after the first time
+    token = await csrf_token(client, state, "/search")
+    return await client.post("/search", data={"csrf_token": token, "location": f"City{rnd.randrange(CITIES)}",
+                                              "has_wifi": "y"})
+
+
+async def locate(client, state, rnd, size):
+    # a new place every time, Google (the stub) is called for the search and the photos
+    token = await csrf_token(client, state, "/locate")
+    state["locates"] = state.get("locates", 0) + 1
+    return await client.post("/locate", data={"csrf_token": token,
+                                              "text_input": f"Town {id(state)}-{state['locates']}"})
+
+
+async def api_all(client, state, rnd, size):
+    return await client.get("/api/all")
+
+
+async def mixed_writes(client, state, rnd, size):
+    # reads of single cafes and searches with a share of price updates and new cafes
+    cafe_id = rnd.randint(1, size)
+    if rnd.random() < WRITE_SHARE:
+        if rnd.random() < 0.5:
+            return await client.patch(f"/api/update-price/{cafe_id}",
+                                      params={"coffee_price": f"£{rnd.uniform(1.5, 4.5):.2f}"})
+        name = f"Bench cafe {rnd.getrandbits(48):x}"
+        return await client.post("/api/add", params={
+            "name": name, "map_url": f"https://www.google.com/maps/place/{name.replace(' ', '+')}",
+            "img_url": "https://example.com/img/bench.jpg", "location": f"Bench Street, City{rnd.randrange(CITIES)}",
+            "seats": "10-20", "has_wifi": "1", "coffee_price": "£2.50",
+            "lat": rnd.uniform(-55, 65), "lon": rnd.uniform(-170, 170)})
+    if rnd.random() < 0.5:
+        return await client.get(f"/api/cafe/{cafe_id}")
+    return await client.get("/api/search", params={"loc": f"City{rnd.randrange(CITIES)}"})
+
+
+async def price_updates(client, state, rnd, size):
+    # a burst of crowd-sourced prices, mostly for the popular cafes; compare with --env PRICE_WRITE_BEHIND=1
+    cafe_id = rnd.randint(1, min(size, 1000))
+    return await client.patch(f"/api/update-price/{cafe_id}", params={"coffee_price": f"£{rnd.uniform(1.5, 4.5):.2f}"})
+
+
+SCENARIOS = {
+    "landing": landing,
+    "search": search,
+    "locate": locate,
+    "api_all": api_all,
+    "mixed_writes": mixed_writes,
+    "price_updates": price_updates,
+}
+
+
+def start_app(server, port, env, log):
+    if server == "uvicorn":
+        command = [sys.executable, "-m", "uvicorn", "asgi:application", "--port", str(port), "--log-level", "warning"]
+    else:
+        command = [sys.executable, "-m", "flask", "--app", "main", "run", "--port", str(port)]
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=log)
+    if not wait_for_port(port, process, attempts=600):
+        process.kill()
+        log.seek(0)
+        raise RuntimeError(f"the app did not start:\n{log.read().decode(errors='replace')[-2000:]}")
+    return process
+
+
+def peak_rss_mb(pid):
+    # high water mark of the resident memory of the process, Linux only
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+async def user(number, base_url, scenario, size, warmup_until, stop_at, latencies, errors):
+    rnd = random.Random(number)
+    state = {}
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            try:
+                response = await scenario(client, state, rnd, size)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            if start < warmup_until:
+                continue
+            if failed:
+                errors.append(1)
+            else:
+                latencies.append(time.perf_counter() - start)
+
+
+async def load(base_url, scenario, size, concurrency, warmup, duration):
+    latencies, errors = [], []
+    warmup_until = time.perf_counter() + warmup
+    stop_at = warmup_until + duration
+    await asyncio.gather(*[user(number, base_url, scenario, size, warmup_until, stop_at, latencies, errors)
+                           for number in range(concurrency)])
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "requests_per_s": round(len(latencies) / duration, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+    }
+
+
+def run_scenario(args, name, size, database, fake_url, workdir):
+    path = os.path.join(workdir, f"{name}_{size}.db")
+    shutil.copy(database, path)
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}", GOOGLE_MAPS_API_URL=fake_url,
+               FLASK_APP_SECRET_KEY="benchmark", RESPONSE_CACHE="1" if args.response_cache else "0")
+    env.update(setting.split("=", 1) for setting in args.env)
+    with open(os.path.join(workdir, f"{name}_{size}.log"), "w+b") as log:
+        process = start_app(args.server, port, env, log)
+        try:
+            result = asyncio.run(load(f"http://127.0.0.1:{port}", SCENARIOS[name], size,
+                                      args.concurrency, args.warmup, args.duration))
+            result["peak_rss_mb"] = peak_rss_mb(process.pid)
+        finally:
+            process.terminate()
+            process.wait()
+    # the WAL files of the app too, a later database of the same name must not pick them up
+    for leftover in (path, path + "-wal", path + "-shm"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    return result
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, dirty
+
+
+def run(args):
+    commit, dirty = git_commit()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "label": args.label,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()}, {os.cpu_count()} cpus",
+        "settings": {"server": args.server, "concurrency": args.concurrency, "duration": args.duration,
+                     "warmup": args.warmup, "latency": args.latency, "response_cache": args.response_cache,
+                     "env": args.env},
+        "results": {},
+    }
+    fake_server, fake_url = start_fake_places(latency=args.latency)
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for size in (int(size) for size in args.sizes.split(",")):
+                database = os.path.join(workdir, f"cafes_{size}.db")
+                create_database(database, size).dispose()
+                results = report["results"][str(size)] = {}
+                for name in args.scenarios.split(","):
+                    results[name] = run_scenario(args, name, size, database, fake_url, workdir)
+                    print(f"{size:>8} {name:13} {results[name]}", flush=True)
+                os.remove(database)
+    finally:
+        fake_server.shutdown()
+    return report
+
+
+def save(report, directory):
+    os.makedirs(directory, exist_ok=True)
+    name = report["commit"] + ("-dirty" if report["dirty"] else "") + (f"-{report['label']}" if report["label"] else "")
+    path = os.path.join(directory, f"{name}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(path, "w") as target:
+        json.dump(report, target, indent=2)
+    return path
+
+
+def change(old, new):
+    if old is None or new is None:
+        return f"{old} -> {new}"
+    percent = f"{(new - old) / old * 100:+.0f}%" if old else ""
+    return f"{old} -> {new} {percent}"
+
+
+def compare(old, new):
+    print(f"{old['commit']} ({old['created']}) -> {new['commit']} ({new['created']})")
+    for size, scenarios in new["results"].items():
+        for name, result in scenarios.items():
+            before = old["results"].get(size, {}).get(name)
+            if before is None:
+                continue
+            print(f"{size:>8} {name:13} p50 {change(before['p50_ms'], result['p50_ms'])}, "
+                  f"p95 {change(before['p95_ms'], result['p95_ms'])}, "
+                  f"req/s {change(before['requests_per_s'], result['requests_per_s'])}, "
+                  f"peak MB {change(before['peak_rss_mb'], result['peak_rss_mb'])}")
+
+
+def load_report(path):
+    with open(path) as source:
+        return json.load(source)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000", help="cafes in the synthetic database")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--server", choices=("flask", "uvicorn"), default="flask",
+                        help="flask: the threaded WSGI server of flask run, uvicorn: asgi.py")
+    parser.add_argument("--concurrency", type=int, default=8, help="simulated users sending requests at once")
+    parser.add_argument("--duration", type=float, default=10, help="measured seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds per scenario before measuring")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds every stub Google call takes")
+    parser.add_argument("--response-cache", action="store_true", help="keep the response cache of the app on")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="system var for the app")
+    parser.add_argument("--label", default="", help="added to the name of the result file")
+    parser.add_argument("--output", default=RESULTS_DIR)
+    parser.add_argument("--compare", nargs="+", metavar="RESULT", help="older result (and newer one, skips the run)")
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios.split(",")) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.compare and len(args.compare) == 2:
+        compare(load_report(args.compare[0]), load_report(args.compare[1]))
+        sys.exit()
+    report = run(args)
+    print(f"saved to {save(report, args.output)}")
+    if args.compare:
+        compare(load_report(args.compare[0]), report)
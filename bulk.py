@@ -0,0 +1,217 @@
+import csv
+import io
+import json
+
+from sqlalchemy import insert, or_, select
+
+from models import Cafe, API_COLUMNS, cafe_to_json, place_id_for
+
+
+# columns of the export, the same names as the API ("lng" for the longitude), import accepts lon as well
+EXPORT_FIELDS = ("id", "name", "map_url", "img_url", "location", "seats", "has_toilet", "has_wifi",
+                 "has_sockets", "can_take_calls", "coffee_price", "lat", "lng")
+REQUIRED_TEXT = ("name", "map_url", "img_url", "location", "seats")
+AMENITY_FIELDS = ("has_toilet", "has_wifi", "has_sockets", "can_take_calls")
+FORMATS = ("csv", "ndjson", "json")
+IMPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK = 1000
+# invalid rows reported back, the rest is only counted
+MAX_REPORTED_ERRORS = 20
+
+TRUE_VALUES = {"1", "true", "yes", "y", "on"}
+FALSE_VALUES = {"", "0", "false", "no", "n", "off", "none", "null"}
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+class InvalidInput(ValueError):
+    # the input itself cannot be read any further (broken CSV quoting, not UTF-8, not JSON), line is where it broke
+    def __init__(self, message, line=None):
+        super().__init__(message)
+        self.line = line
+
+
+def format_for(filename=None, mimetype=None, default="csv"):
+    # "cafes.ndjson" / "application/x-ndjson" -> "ndjson"
+    if filename:
+        extension = filename.rsplit(".", 1)[-1].lower()
+        if extension in FORMATS:
+            return extension
+        if extension == "jsonl":
+            return "ndjson"
+    if mimetype:
+        if "ndjson" in mimetype or "jsonl" in mimetype:
+            return "ndjson"
+        if mimetype.endswith("/json"):
+            return "json"
+        if mimetype.endswith("/csv"):
+            return "csv"
+    return default
+
+
+def read_records(text_stream, data_format):
+    # yields one dict per cafe; csv and ndjson are read line by line, json (the /api/all list) at once;
+    # InvalidInput when the input cannot be read further (the stream decodes ahead, a bad byte has no line)
+    if data_format == "csv":
+        reader = csv.DictReader(text_stream)
+        try:
+            yield from reader
+        except csv.Error as error:
+            raise InvalidInput(str(error), line=reader.reader.line_num)
+        except UnicodeDecodeError as error:
+            raise InvalidInput(str(error))
+    elif data_format == "ndjson":
+        try:
+            for line in text_stream:
+                line = line.strip()
+                if line:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # reported by parse_row() as an invalid row, the import goes on
+                        yield None
+        except UnicodeDecodeError as error:
+            raise InvalidInput(str(error))
+    elif data_format == "json":
+        try:
+            cafes = json.load(text_stream)
+        except json.JSONDecodeError as error:
+            raise InvalidInput(error.msg, line=error.lineno)
+        except UnicodeDecodeError as error:
+            raise InvalidInput(str(error))
+        yield from cafes
+    else:
+        raise ValueError(f"Unknown format {data_format}, use one of {', '.join(FORMATS)}")
+
+
+def _flag(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower() if value is not None else ""
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise InvalidRow(f"{value!r} is not a yes/no value")
+
+
+def parse_row(record):
+    # column values of one cafe, InvalidRow when something is missing or the cafe is not on the Earth
+    if not isinstance(record, dict):
+        raise InvalidRow("not a cafe object")
+    row = {}
+    for field in REQUIRED_TEXT:
+        value = record.get(field)
+        if value is None or not str(value).strip():
+            raise InvalidRow(f"{field} is missing")
+        row[field] = str(value).strip()
+    for field in AMENITY_FIELDS:
+        row[field] = _flag(record.get(field))
+    price = record.get("coffee_price")
+    row["coffee_price"] = str(price).strip() if price not in (None, "") else None
+
+    try:
+        lat = float(record.get("lat"))
+        lon = float(record.get("lon", record.get("lng")))
+    except (TypeError, ValueError):
+        raise InvalidRow("lat and lon have to be numbers")
+    # the same check as the add form
+    if not (lat >= -90 and lat <= 90 and lon >= -180 and lon <= 180):
+        raise InvalidRow("lat and lon are not somewhere on the Earth")
+    row["lat"] = lat
+    row["lon"] = lon
+    row["place_id"] = place_id_for(row["map_url"])
+    return row
+
+
+def import_cafes(session, records, batch_size=IMPORT_BATCH_SIZE):
+    # inserts the valid, not yet known cafes, one executemany and one commit per batch;
+    # a cafe is a duplicate when its name, map_url or place id is already in the DB (or earlier in the input).
+    # Core inserts skip the ORM events, the caller has to invalidate what depends on the cafe table.
+    # Input that cannot be read further stops the import, the cafes before it are inserted and the report
+    # gets "stopped": {"line", "error"}.
+    report = {"read": 0, "inserted": 0, "duplicates": 0, "invalid": 0, "errors": []}
+    seen_names = set()
+    seen_urls = set()
+    seen_place_ids = set()
+    batch = []
+
+    def flush():
+        names = {row["name"] for row in batch}
+        urls = {row["map_url"] for row in batch}
+        place_ids = {row["place_id"] for row in batch if row["place_id"]}
+        known = session.execute(select(Cafe.name, Cafe.map_url, Cafe.place_id)
+                                .where(or_(Cafe.name.in_(names), Cafe.map_url.in_(urls),
+                                           Cafe.place_id.in_(place_ids)))).all()
+        known_names = {name for name, map_url, place_id in known}
+        known_urls = {map_url for name, map_url, place_id in known}
+        known_place_ids = {place_id for name, map_url, place_id in known if place_id}
+        rows = [row for row in batch if row["name"] not in known_names and row["map_url"] not in known_urls
+                and row["place_id"] not in known_place_ids]
+        report["duplicates"] += len(batch) - len(rows)
+        if rows:
+            session.execute(insert(Cafe), rows)
+        session.commit()
+        report["inserted"] += len(rows)
+        batch.clear()
+
+    records = iter(records)
+    number = 0
+    while True:
+        try:
+            record = next(records)
+        except StopIteration:
+            break
+        except InvalidInput as error:
+            report["stopped"] = {"line": error.line, "error": str(error)}
+            break
+        number += 1
+        report["read"] += 1
+        try:
+            row = parse_row(record)
+        except InvalidRow as error:
+            report["invalid"] += 1
+            if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                report["errors"].append({"row": number, "error": str(error)})
+            continue
+        if row["name"] in seen_names or row["map_url"] in seen_urls or row["place_id"] in seen_place_ids:
+            report["duplicates"] += 1
+            continue
+        seen_names.add(row["name"])
+        seen_urls.add(row["map_url"])
+        if row["place_id"]:
+            seen_place_ids.add(row["place_id"])
+        batch.append(row)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return report
+
+
+def export_rows(session, chunk=EXPORT_CHUNK):
+    # all cafes ordered by id, fetched chunk by chunk from the cursor
+    statement = select(*API_COLUMNS).order_by(Cafe.id).execution_options(yield_per=chunk)
+    return session.execute(statement)
+
+
+def csv_lines(rows, chunk=EXPORT_CHUNK):
+    # header and rows of the CSV export, yielded a chunk at a time
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(EXPORT_FIELDS)
+    for number, row in enumerate(rows, start=1):
+        cafe = cafe_to_json(row)
+        writer.writerow([cafe[field] for field in EXPORT_FIELDS])
+        if number % chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ndjson_lines(rows, dumps=json.dumps):
+    for row in rows:
+        yield dumps(cafe_to_json(row)) + "\n"
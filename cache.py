@@ -0,0 +1,163 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+# every cache registers in a registry by its name so the stats endpoint can report all of them,
+# the caches of an app in app_caches(app), others here
+CACHES = {}
+
+
+def normalize_query(query):
+    # "  Prague ", "prague" and "PRAGUE" should hit the same entry
+    return " ".join(str(query).lower().split())
+
+
+class SqliteCacheStore:
+    # optional persistent tier, survives restarts and is shared by all workers using the same file
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entry ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            self._connection.commit()
+
+    def get(self, namespace, key):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, expires_at FROM cache_entry WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        if row is None:
+            return None, None
+        value, expires_at = row
+        if expires_at < time.time():
+            self.delete(namespace, key)
+            return None, None
+        return json.loads(value), expires_at
+
+    def set(self, namespace, key, value, expires_at):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO cache_entry (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), expires_at),
+            )
+            self._connection.commit()
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._connection.execute("DELETE FROM cache_entry WHERE namespace = ? AND key = ?", (namespace, key))
+            self._connection.commit()
+
+    def clear(self, namespace):
+        with self._lock:
+            self._connection.execute("DELETE FROM cache_entry WHERE namespace = ?", (namespace,))
+            self._connection.commit()
+
+
+class TTLCache:
+    # in-process LRU cache, entries expire after ttl seconds, the least recently used one is evicted when full
+    def __init__(self, name, maxsize=256, ttl=3600, store=None, registry=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.store = store
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        (CACHES if registry is None else registry)[name] = self
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at >= now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+
+        if self.store is not None:
+            value, expires_at = self.store.get(self.name, key)
+            if value is not None:
+                with self._lock:
+                    self.store_hits += 1
+                    self._put(key, value, expires_at)
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._put(key, value, expires_at)
+        if self.store is not None:
+            self.store.set(self.name, key, value, expires_at)
+
+    def get_or_load(self, key, loader):
+        # loader returning None means "do not cache", e.g. upstream error
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.store is not None:
+            self.store.delete(self.name, key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.store is not None:
+            self.store.clear(self.name)
+
+    def _put(self, key, value, expires_at):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.store_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "store_hits": self.store_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": round((self.hits + self.store_hits) / lookups, 4) if lookups else 0.0,
+                "persistent": self.store is not None,
+            }
+
+
+def app_caches(app):
+    # registry of the caches of one app, its /api/cache-stats reports them
+    return app.extensions.setdefault("caches", {})
+
+
+def all_stats(registry=None):
+    return {name: cache.stats() for name, cache in (CACHES if registry is None else registry).items()}
@@ -0,0 +1,161 @@
+import logging
+import os
+from html import escape
+
+from flask import request, url_for
+
+from models import db, Cafe, AMENITY_BITS, amenity_mask
+from clustering import zoom_for_bounds, cluster_points
+from extensions import instrumentation, read_session
+from places import GOOGLE_MAPS_KEY
+from image_proxy import proxied
+
+
+# the maps drawn by static/js/cafes_map.js and static/js/index.js: their data, markers and infoboxes
+
+logger = logging.getLogger(__name__)
+
+# maps with more cafes than this show clusters of nearby cafes instead of single markers
+MAP_CLUSTER_THRESHOLD = int(os.environ.get("MAP_CLUSTER_THRESHOLD", 200))
+CLUSTER_ICON = 'http://maps.google.com/mapfiles/ms/icons/blue-dot.png'
+# coordinates sent to the map are rounded to 6 decimals, about 0.1 m
+MAP_DIGITS = 6
+# tiles of the landing page map with more cafes than this show clusters, one per TILE_SPLIT x TILE_SPLIT part
+TILE_MARKER_LIMIT = int(os.environ.get("TILE_MARKER_LIMIT", 50))
+TILE_SPLIT = 4
+
+# infobox of one cafe, the static parts are filled in once by marker_fragments()
+INFOBOX_TEMPLATE = "<a href = {cafe_url}{id} ><h6> {name} </h6> {icons} <br /> <img src='{img_url}' width='200px'/></a>"
+CAFE_ICON = 'http://maps.google.com/mapfiles/ms/icons/red-dot.png'
+# amenity -> picture in the infobox, in the order they are shown
+AMENITY_ICONS = (('has_toilet', 'assets/img/wc.png'), ('has_wifi', 'assets/img/wifi.png'),
+                 ('can_take_calls', 'assets/img/phone.png'), ('has_sockets', 'assets/img/pwr.png'))
+_marker_fragments = {}
+# set by load_numpy()
+numpy = None
+_numpy_loaded = False
+
+
+def load_numpy():
+    # numpy is optional, the map is computed in plain python without it;
+    # imported by the first map, not by every start of a worker
+    global numpy, _numpy_loaded
+    if not _numpy_loaded:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy_loaded = True
+    return numpy
+
+
+def marker_fragments():
+    # icon html for every combination of amenities and the cafe page url prefix,
+    # they never change, so url_for runs once per process (and per script root the app is mounted on);
+    # the cafe page is a path, not url_for, an API only worker (API_ONLY=1) has no web blueprint
+    fragments = _marker_fragments.get(request.script_root)
+    if fragments is None:
+        icons = [(AMENITY_BITS[amenity], f"<img src=\"{url_for('static', filename=filename)}\" width=\'30px\'/>")
+                 for amenity, filename in AMENITY_ICONS]
+        fragments = {
+            'icons': ["".join(html for bit, html in icons if mask & bit) for mask in range(2 ** len(icons))],
+            'cafe_url': f"{request.script_root}/cafe/",
+        }
+        _marker_fragments[request.script_root] = fragments
+    return fragments
+
+
+def cafe_infobox(cafe, fragments):
+    return INFOBOX_TEMPLATE.format(cafe_url=fragments['cafe_url'], id=cafe.id, name=escape(cafe.name),
+                                   icons=fragments['icons'][amenity_mask(cafe)],
+                                   img_url=escape(proxied(cafe.img_url, 200)))
+
+
+def cafe_marker(cafe, lat, lon, fragments):
+    marker = {
+        'icon': CAFE_ICON,
+        'lat': lat,
+        'lng': lon,
+        'infobox': cafe_infobox(cafe, fragments),
+    }
+    return marker
+
+
+def clamp_coordinates(cafes):
+    # DB allows any float, coordinates are clamped to valid values and the bounds computed in one pass
+    # returns (lats, lons, (min_lat, max_lat, min_lon, max_lon))
+    if load_numpy() is not None:
+        lats = numpy.clip(numpy.fromiter((cafe.lat for cafe in cafes), dtype=float, count=len(cafes)), -90, 90)
+        lons = numpy.clip(numpy.fromiter((cafe.lon for cafe in cafes), dtype=float, count=len(cafes)), -180, 180)
+        bounds = (float(lats.min()), float(lats.max()), float(lons.min()), float(lons.max()))
+        return lats.tolist(), lons.tolist(), bounds
+
+    lats = [min(90.0, max(-90.0, cafe.lat)) for cafe in cafes]
+    lons = [min(180.0, max(-180.0, cafe.lon)) for cafe in cafes]
+    return lats, lons, (min(lats), max(lats), min(lons), max(lons))
+
+
+def cluster_marker(cluster, filters=None):
+    # one marker standing for many cafes, the cafes themselves are loaded by static/js/cafes_map.js on demand
+    expand_url = url_for('api.api_cluster', key=cluster['key'], **(filters or {}))
+    marker = {
+        'icon': CLUSTER_ICON,
+        'lat': cluster['lat'],
+        'lng': cluster['lng'],
+        'label': str(cluster['count']),
+        'infobox': f"<h6> {cluster['count']} cafes </h6> <a href='#' onclick=\"expandCluster('{expand_url}', {cluster['lat']}, {cluster['lng']}); return false;\">Show them</a>",
+    }
+    return marker
+
+
+@instrumentation.timed("map")
+def map_payload(cafes, filters=None):
+    # the map as data for static/js/cafes_map.js: bounds computed here, one array per field instead of one object
+    # per marker and no infobox html, the script loads that when a marker is clicked;
+    # clusters are [lat, lng, count, url of their cafes], filters are the amenity flags of that url
+    cafes = [cafe for cafe in cafes if cafe.lat is not None and cafe.lon is not None]
+    payload = {'bounds': None, 'ids': [], 'lats': [], 'lngs': [], 'clusters': []}
+    if not cafes:
+        return payload
+
+    lats, lons, (min_lat, max_lat, min_lon, max_lon) = clamp_coordinates(cafes)
+    payload['bounds'] = {'south': min_lat, 'north': max_lat, 'west': min_lon, 'east': max_lon}
+    if len(cafes) > MAP_CLUSTER_THRESHOLD:
+        #too many markers for the browser, nearby cafes are shown as one marker with their count
+        zoom = zoom_for_bounds(min_lat, max_lat, min_lon, max_lon)
+        single_indexes, clusters = cluster_points(zip(lats, lons, range(len(cafes))), zoom)
+        payload['clusters'] = [[round(cluster['lat'], MAP_DIGITS), round(cluster['lng'], MAP_DIGITS), cluster['count'],
+                                url_for('api.api_cluster', key=cluster['key'], **(filters or {}))]
+                               for cluster in clusters]
+    else:
+        single_indexes = range(len(cafes))
+    payload['ids'] = [cafes[i].id for i in single_indexes]
+    payload['lats'] = [round(lats[i], MAP_DIGITS) for i in single_indexes]
+    payload['lngs'] = [round(lons[i], MAP_DIGITS) for i in single_indexes]
+    logger.debug("Map of %s cafes has %s markers and %s clusters", len(cafes), len(payload['ids']),
+                 len(payload['clusters']))
+    return payload
+
+
+def map_shell(map_url=None, map_data=None, tiles_bounds=None):
+    # template variables of a map drawn by static/js/cafes_map.js, its data is loaded from map_url or inlined;
+    # with tiles_bounds the map starts there and static/js/index.js loads the tiles the user looks at
+    return {
+        'map_url': map_url,
+        'map_data': map_data,
+        'tiles_bounds': tiles_bounds,
+        'tiles_url': url_for('api.api_tile', zoom=0, row=0, column=0)[:-len("0/0/0")],
+        'maps_key': GOOGLE_MAPS_KEY,
+        'infobox_url': url_for('api.api_map_infobox', cafe_id=0)[:-1],
+        'cafe_icon': CAFE_ICON,
+        'cluster_icon': CLUSTER_ICON,
+    }
+
+
+def cafes_bounds():
+    # {south, north, west, east} of all cafes for the first view of the map, None without cafes
+    south, north, west, east = read_session.execute(db.select(
+        db.func.min(Cafe.lat), db.func.max(Cafe.lat), db.func.min(Cafe.lon), db.func.max(Cafe.lon))).one()
+    if south is None:
+        return None
+    return {'south': max(-90.0, south), 'north': min(90.0, north), 'west': max(-180.0, west), 'east': min(180.0, east)}
@@ -0,0 +1,96 @@
+import math
+
+
+# size of one grid cell on the screen, the same idea as the cluster grid of the Google marker clusterer
+CLUSTER_CELL_PIXELS = 60
+TILE_SIZE = 256
+MAX_ZOOM = 21
+
+
+def cell_size(zoom):
+    # width of a grid cell in degrees at the given zoom
+    return CLUSTER_CELL_PIXELS * 360 / (TILE_SIZE * 2 ** zoom)
+
+
+def zoom_for_bounds(min_lat, max_lat, min_lon, max_lon, map_width=800, map_height=500):
+    # roughly the zoom Google picks when fitting the bounds into the map (fit_markers_to_bounds)
+    lon_span = max(max_lon - min_lon, 1e-6)
+    lat_span = max(max_lat - min_lat, 1e-6)
+    zoom_lon = math.log2(360 * map_width / (TILE_SIZE * lon_span))
+    zoom_lat = math.log2(180 * map_height / (TILE_SIZE * lat_span))
+    return max(0, min(MAX_ZOOM, int(math.floor(min(zoom_lon, zoom_lat)))))
+
+
+def cell_key(lat, lon, zoom):
+    size = cell_size(zoom)
+    return f"{zoom}:{int((lat + 90) // size)}:{int((lon + 180) // size)}"
+
+
+def cell_bounds(key):
+    # (zoom, min_lat, max_lat, min_lon, max_lon) of a cell key made by cell_key()
+    zoom, row, column = (int(part) for part in key.split(":"))
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise ValueError("zoom out of range")
+    size = cell_size(zoom)
+    return zoom, row * size - 90, (row + 1) * size - 90, column * size - 180, (column + 1) * size - 180
+
+
+def cluster_points(points, zoom):
+    # points are (lat, lon, item) tuples, returns the list of single items and the list of clusters,
+    # a cluster is a dict with key, count, centre and bounds of the cafes in one grid cell
+    cells = {}
+    for lat, lon, item in points:
+        cells.setdefault(cell_key(lat, lon, zoom), []).append((lat, lon, item))
+
+    singles = []
+    clusters = []
+    for key, members in cells.items():
+        if len(members) == 1:
+            singles.append(members[0][2])
+            continue
+        lats = [lat for lat, lon, item in members]
+        lons = [lon for lat, lon, item in members]
+        clusters.append({
+            "key": key,
+            "count": len(members),
+            "lat": sum(lats) / len(lats),
+            "lng": sum(lons) / len(lons),
+            "bounds": {"south": min(lats), "north": max(lats), "west": min(lons), "east": max(lons)},
+        })
+    return singles, clusters
+
+
+# tiles of the viewport loading (/api/tiles), squares of the lat/lon grid as wide as TILE_SIZE pixels at their zoom,
+# static/js/index.js computes the same tiles for the visible part of the map
+def tile_size(zoom):
+    return 360 / 2 ** zoom
+
+
+def tile_bounds(zoom, row, column):
+    # (south, north, west, east) of a tile, ValueError for tiles outside of the world
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise ValueError("zoom out of range")
+    size = tile_size(zoom)
+    if not (0 <= row and row * size < 180 and 0 <= column < 2 ** zoom):
+        raise ValueError("tile out of range")
+    return row * size - 90, min(90, (row + 1) * size - 90), column * size - 180, (column + 1) * size - 180
+
+
+def tile_parts(cafes, south, west, size):
+    # the cafes (id, lat, lon) of a tile counted per part of the given size, as the GROUP BY of /api/tiles does:
+    # (count, lowest id, mean lat, mean lon, south, west, north, east) per part, ordered by part row and column
+    parts = {}
+    for cafe_id, lat, lon in cafes:
+        key = (int((lat - south) / size), int((lon - west) / size))
+        part = parts.get(key)
+        if part is None:
+            parts[key] = [1, cafe_id, lat, lon, lat, lon, lat, lon]
+        else:
+            part[0] += 1
+            part[1] = min(part[1], cafe_id)
+            part[2] += lat
+            part[3] += lon
+            part[4], part[5] = min(part[4], lat), min(part[5], lon)
+            part[6], part[7] = max(part[6], lat), max(part[7], lon)
+    return [(count, cafe_id, lat_sum / count, lon_sum / count, *bounds)
+            for count, cafe_id, lat_sum, lon_sum, *bounds in (parts[key] for key in sorted(parts))]
@@ -0,0 +1,100 @@
+import os
+
+from flask import current_app
+from flask.globals import app_ctx
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+
+
+# pragmas run on every new SQLite connection, each one can be changed by a system var, e.g. SQLITE_SYNCHRONOUS=FULL;
+# WAL lets readers go on while one writer commits, NORMAL sync is safe in WAL (a crash can only lose the last commits)
+SQLITE_PRAGMA_DEFAULTS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    # negative cache_size is KiB, 64 MiB page cache per connection
+    "cache_size": -64000,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+# pragmas that change the database file, not allowed on the read only connections
+WRITE_PRAGMAS = ("journal_mode",)
+
+
+def sqlite_pragmas(environ=os.environ):
+    # the defaults overridden by SQLITE_<PRAGMA> system vars, SQLITE_TUNING=0 leaves SQLite at its own defaults
+    if environ.get("SQLITE_TUNING", "1") == "0":
+        return {}
+    return {name: environ.get(f"SQLITE_{name.upper()}", default) for name, default in SQLITE_PRAGMA_DEFAULTS.items()}
+
+
+def is_file_sqlite(engine):
+    return engine.dialect.name == "sqlite" and engine.url.database not in (None, "", ":memory:")
+
+
+def configure_sqlite(engine, pragmas, read_only=False):
+    # runs the pragmas on every connection the pool opens
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                if read_only and name in WRITE_PRAGMAS:
+                    continue
+                cursor.execute(f"PRAGMA {name} = {value}")
+            if read_only:
+                cursor.execute("PRAGMA query_only = ON")
+        finally:
+            cursor.close()
+
+
+def create_read_engine(engine, pragmas):
+    # engine on the same file opened read only, GET routes use it so they never take a write lock;
+    # anything else than a SQLite file (memory DB, another server) simply shares the main engine
+    if not is_file_sqlite(engine):
+        return engine
+    path = os.path.abspath(engine.url.database)
+    read_engine = create_engine(f"sqlite:///file:{path}?mode=ro&uri=true")
+    configure_sqlite(read_engine, pragmas, read_only=True)
+    return read_engine
+
+
+class AppReadSession(Session):
+    # without an engine of its own it reads through the read engine of the current app,
+    # app.extensions["read_engine"] set by create_app() in main.py
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.bind is not None:
+            return self.bind
+        return current_app.extensions["read_engine"]
+
+
+def create_read_session(read_engine=None):
+    # one session per app context, removed at its end (see main.py)
+    return scoped_session(sessionmaker(class_=AppReadSession, bind=read_engine),
+                          scopefunc=lambda: id(app_ctx._get_current_object()))
+
+
+def track_committed_writes(session, model, callback):
+    # calls callback(ids) after every commit that inserted, changed or deleted instances of model;
+    # listeners run in the order they were added
+    changed_key = f"changed:{id(callback)}"
+
+    @event.listens_for(session, "after_flush")
+    def collect_changes(flush_session, flush_context):
+        changed = flush_session.info.setdefault(changed_key, set())
+        for instance in list(flush_session.new) + list(flush_session.dirty) + list(flush_session.deleted):
+            if isinstance(instance, model):
+                changed.add(instance.id)
+
+    @event.listens_for(session, "after_commit")
+    def report_changes(commit_session):
+        changed = commit_session.info.pop(changed_key, None)
+        if changed:
+            callback(changed)
+
+    @event.listens_for(session, "after_rollback")
+    def forget_changes(rollback_session):
+        rollback_session.info.pop(changed_key, None)
@@ -0,0 +1,68 @@
+from flask import current_app
+
+from database import create_read_session, track_committed_writes
+from models import db, Cafe
+from instrumentation import Instrumentation
+from response_cache import ResponseCache
+
+
+# objects shared by the blueprints (web.py, api.py), created without an app; create_app() in main.py keeps the
+# state of every app in app.extensions and they find it through current_app, like db of Flask-SQLAlchemy
+
+# INSTRUMENTATION=1 times every request (Server-Timing header, GET /metrics), off by default
+instrumentation = Instrumentation()
+
+# cache of rendered pages and API answers, every committed write of a cafe invalidates what depends on it
+response_cache = ResponseCache()
+
+# GET routes read through their own read only connections, they never wait for a write lock;
+# the session reads through the read engine of the current app
+read_session = create_read_session()
+
+
+def current_read_model():
+    # READ_MODEL=1: compact copy of the cafe table in memory (read_model.ReadModel) made by create_app(), else None
+    return current_app.extensions.get("read_model")
+
+
+def current_price_buffer():
+    # PRICE_WRITE_BEHIND=1: the write_buffer.PriceBuffer of the app bound by create_app(), else None
+    return current_app.extensions.get("price_buffer")
+
+
+def cafes_changed(cafe_ids=None):
+    # after every committed write of cafes: the read model first, a page cached after the write has to see the
+    # new data; Core writes (bulk import) skip the ORM events and report here, no ids means any cafe could have changed
+    read_model = current_read_model()
+    if read_model is not None:
+        read_model.refresh(cafe_ids)
+    response_cache.invalidate(cafe_ids or ())
+
+
+# db.session is one for all apps, its listeners are added once here and cafes_changed() finds the app of the commit
+track_committed_writes(db.session, Cafe, cafes_changed)
+
+
+def queue_coffee_prices(prices):
+    # {cafe id: price} into the price buffer, a queued price is already shown on the cafe page (see coffee_price_of()),
+    # the lists get it with the flush
+    price_buffer = current_price_buffer()
+    for cafe_id, coffee_price in prices.items():
+        price_buffer.add(cafe_id, coffee_price)
+    response_cache.invalidate(prices, lists=False)
+
+
+def set_coffee_price(cafe, coffee_price):
+    # price update of the web page and the API: queued with PRICE_WRITE_BEHIND=1, committed at once otherwise
+    if current_price_buffer() is not None:
+        queue_coffee_prices({cafe.id: coffee_price})
+    else:
+        cafe.coffee_price = coffee_price
+        db.session.commit()
+
+
+def coffee_price_of(cafe):
+    # the price to show, one still waiting in the price buffer wins over the database
+    price_buffer = current_price_buffer()
+    pending = price_buffer.pending_price(cafe.id) if price_buffer is not None else None
+    return cafe.coffee_price if pending is None else pending
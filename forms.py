@@ -0,0 +1,46 @@
+from flask_wtf import FlaskForm
+from wtforms import StringField, SubmitField, BooleanField, PasswordField
+from wtforms.validators import DataRequired, URL, NumberRange
+
+
+# forms of the web pages, imported by the first page that needs them (see web.py)
+
+
+class SearchForm(FlaskForm):
+    location = StringField('City or area')
+    has_toilet = BooleanField('Toilets')
+    has_wifi = BooleanField('Wifi')
+
+
+    can_take_calls = BooleanField('Calling')
+    has_sockets = BooleanField('Power supply')
+    submit = SubmitField('Search')
+
+class LocateNewCafeForm(FlaskForm):
+    text_input = StringField('Name and location of your cafe:', validators=[DataRequired()])
+    submit = SubmitField('Locate')
+
+class PriceUpdateForm(FlaskForm):
+    coffee_price=StringField('New coffee price', validators=[DataRequired()])
+    submit = SubmitField('Submit')
+
+class DeleteConfirmationForm(FlaskForm):
+    delete_key=PasswordField('Enter secret key', validators=[DataRequired()])
+    submit = SubmitField('Confirm deletion')
+class CafeForm(FlaskForm):
+    name=StringField('Name', validators=[DataRequired()])
+
+    seats=StringField('Number of seats', validators=[DataRequired()])
+    coffee_price=StringField('Coffee price', validators=[DataRequired()])
+    has_wifi = BooleanField('Is there wifi?')
+    has_toilet = BooleanField('Are there toilets?')
+    has_sockets = BooleanField('Are there sockets?')
+    can_take_calls = BooleanField('Is OK to take call?')
+
+    location = StringField('Location/address', validators=[DataRequired()])
+    map_url = StringField('Map URL', validators=[DataRequired(), URL()])
+    img_url = StringField('Image URL', validators=[DataRequired(), URL()])
+    lat = StringField('Latitude', validators=[DataRequired(),NumberRange(min=-90, max=90, message="Please stay on our planet and input valid values")])
+    lng = StringField('Longitude', validators=[DataRequired(), NumberRange(min=-180, max=180, message="Please stay on our planet and input valid values")])
+
+    submit = SubmitField('Submit Cafe')
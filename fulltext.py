@@ -0,0 +1,99 @@
+import logging
+import os
+import re
+
+from flask import current_app, has_app_context
+from sqlalchemy import Table, Column, Integer, String, Float, MetaData, literal_column, or_, select, text
+from sqlalchemy.exc import OperationalError
+
+from models import Cafe
+
+
+logger = logging.getLogger(__name__)
+
+# SQLite FTS5 index over cafe name and location, external content table kept in sync by triggers.
+# Own metadata, db.create_all() must not create it as an ordinary table.
+cafe_fts = Table(
+    "cafe_fts", MetaData(),
+    Column("rowid", Integer, primary_key=True),
+    Column("name", String),
+    Column("location", String),
+    Column("rank", Float),
+)
+
+# upper limit of cafes returned by one text search (web and API)
+SEARCH_RESULTS_LIMIT = int(os.environ.get("SEARCH_RESULTS_LIMIT", 500))
+
+FTS_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS cafe_fts USING fts5(
+           name, location, content='cafe', content_rowid='id', tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER IF NOT EXISTS cafe_fts_insert AFTER INSERT ON cafe
+       BEGIN
+           INSERT INTO cafe_fts (rowid, name, location) VALUES (NEW.id, NEW.name, NEW.location);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS cafe_fts_delete AFTER DELETE ON cafe
+       BEGIN
+           INSERT INTO cafe_fts (cafe_fts, rowid, name, location) VALUES ('delete', OLD.id, OLD.name, OLD.location);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS cafe_fts_update AFTER UPDATE OF id, name, location ON cafe
+       BEGIN
+           INSERT INTO cafe_fts (cafe_fts, rowid, name, location) VALUES ('delete', OLD.id, OLD.name, OLD.location);
+           INSERT INTO cafe_fts (rowid, name, location) VALUES (NEW.id, NEW.name, NEW.location);
+       END""",
+]
+
+WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def init_fulltext_index(engine):
+    # idempotent, safe to run on every start; True when the FTS5 index could be made
+    if engine.dialect.name != "sqlite":
+        return False
+    try:
+        with engine.begin() as connection:
+            for statement in FTS_SCHEMA:
+                connection.execute(text(statement))
+            # rebuild when rows were written while the triggers did not exist (first start on an old DB)
+            indexed = connection.execute(text("SELECT count(*) FROM cafe_fts_docsize")).scalar()
+            stored = connection.execute(text("SELECT count(*) FROM cafe")).scalar()
+            if indexed != stored:
+                connection.execute(text("INSERT INTO cafe_fts (cafe_fts) VALUES ('rebuild')"))
+        return True
+    except OperationalError as error:
+        logger.warning("SQLite FTS5 not available, searching with LIKE: %s", error)
+        return False
+
+
+def fulltext_available():
+    # whether the current app's database has the FTS5 index, app.extensions["fulltext_index"] set by
+    # schema.detect_indexes(); without it the search falls back to LIKE, scripts pass fts= themselves
+    return has_app_context() and current_app.extensions.get("fulltext_index", False)
+
+
+def match_expression(query):
+    # "Shoreditch lon" -> "shoreditch"* "lon"*, every word has to match, as a prefix
+    words = WORD.findall(str(query).lower())
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def search_statement(query, *filters, limit=None, fts=None):
+    # select of cafes matching query in name or location, best matches first;
+    # an empty query matches everything, so only the filters apply; fts=None uses FTS5 when the current app has it
+    expression = match_expression(query)
+    if expression is None:
+        statement = select(Cafe).where(*filters).order_by(Cafe.id)
+    elif fulltext_available() if fts is None else fts:
+        statement = (select(Cafe)
+                     .join(cafe_fts, cafe_fts.c.rowid == Cafe.id)
+                     .where(literal_column("cafe_fts").op("MATCH")(expression), *filters)
+                     .order_by(cafe_fts.c.rank))
+    else:
+        words = WORD.findall(str(query).lower())
+        statement = (select(Cafe)
+                     .where(*[or_(Cafe.name.icontains(word), Cafe.location.icontains(word)) for word in words], *filters)
+                     .order_by(Cafe.id))
+    if limit:
+        statement = statement.limit(limit)
+    return statement
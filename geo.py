@@ -0,0 +1,84 @@
+import math
+
+
+# geohash of every cafe is stored with this many characters (a cell of about 5 x 5 m)
+GEOHASH_PRECISION = 9
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = 2 * math.pi * EARTH_RADIUS_M / 360
+
+
+def encode(lat, lon, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        # even bits split the longitude, odd bits the latitude
+        coordinate, interval = (lon, lon_range) if even else (lat, lat_range)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
+
+
+def cell_size(precision):
+    # (height, width) of a geohash cell in degrees
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180 / 2 ** lat_bits, 360 / 2 ** lon_bits
+
+
+def precision_for_radius(lat, radius_m):
+    # the finest precision whose cells are still at least radius_m high and wide at this latitude,
+    # then the cell of the point and its 8 neighbours always cover the whole circle
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        width_m = width * METERS_PER_DEGREE * math.cos(math.radians(min(abs(lat), 89.9)))
+        if height * METERS_PER_DEGREE >= radius_m and width_m >= radius_m:
+            return precision
+    return 1
+
+
+def neighbour_cells(lat, lon, precision):
+    # geohash of the cell with the point and of the cells around it (fewer at the poles)
+    height, width = cell_size(precision)
+    cells = []
+    for lat_step in (-1, 0, 1):
+        cell_lat = lat + lat_step * height
+        if not -90 <= cell_lat <= 90:
+            continue
+        for lon_step in (-1, 0, 1):
+            # wraps over the antimeridian
+            cell_lon = (lon + lon_step * width + 180) % 360 - 180
+            cell = encode(cell_lat, cell_lon, precision)
+            if cell not in cells:
+                cells.append(cell)
+    return cells
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(1.0, a)))
+
+
+def cafe_geohash(lat, lon):
+    # None when the coordinates are missing or not numbers, the column stays empty then
+    try:
+        return encode(float(lat), float(lon))
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,357 @@
+import hashlib
+import hmac
+import ipaddress
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from io import BytesIO
+from urllib.parse import quote, urljoin, urlsplit
+
+from flask import current_app, request, url_for
+
+from cache import TTLCache, app_caches
+
+
+# cafe and candidate photos served from our own disk instead of hot-linked: each source image is downloaded once,
+# shrunk to the widths the pages show and kept in a content-addressed cache, see /images/<width> in api.py
+
+logger = logging.getLogger(__name__)
+
+# 200 for the map infoboxes, 600 for the cafe page
+THUMBNAIL_WIDTHS = (200, 600)
+# a thumbnail never changes under its url (the url is signed for one source and width), browsers keep it a year
+IMAGE_MAX_AGE = 365 * 24 * 60 * 60
+JPEG_QUALITY = 80
+# larger downloads are refused, Google photos at maxwidth=1000 are far below
+MAX_SOURCE_BYTES = 10 * 1024 * 1024
+MAX_REDIRECTS = 3
+# the start of the file -> its type, without Pillow the original is served and has to be one of these
+IMAGE_SIGNATURES = ((b"\xff\xd8\xff", "image/jpeg"), (b"\x89PNG\r\n\x1a\n", "image/png"),
+                    (b"GIF87a", "image/gif"), (b"GIF89a", "image/gif"))
+
+Thumbnail = namedtuple("Thumbnail", "path mimetype etag")
+
+# set by load_pillow()
+Image = None
+_pillow_loaded = False
+
+
+def load_pillow():
+    # Pillow is optional, without it the proxy keeps and serves the downloaded original in every width
+    global Image, _pillow_loaded
+    if not _pillow_loaded:
+        try:
+            from PIL import Image
+        except ImportError:
+            Image = None
+            logger.warning("Pillow is not installed, the image proxy serves the photos without resizing them")
+        _pillow_loaded = True
+    return Image
+
+
+class ImageProxy:
+    # signing key and ImageCache of one app, kept in app.extensions["image_proxy"] by init_app()
+    def __init__(self, signing_key, image_cache):
+        self.signing_key = signing_key.encode() if isinstance(signing_key, str) else signing_key
+        self.image_cache = image_cache
+        self.url_prefixes = {}
+
+    def signature(self, source_url, width):
+        # only urls the app made itself are served, the proxy cannot be used to download anything else
+        return hmac.new(self.signing_key, f"{width}:{source_url}".encode(), hashlib.sha256).hexdigest()[:32]
+
+    def valid_signature(self, source_url, width, sig):
+        return hmac.compare_digest(self.signature(source_url, width), sig or "")
+
+
+def init_app(app):
+    # IMAGE_PROXY=0 switches the proxy off; IMAGE_CACHE_DIR (default instance/images), IMAGE_CACHE_MAX_MB,
+    # IMAGE_SEED_DIR with local copies of the photos, IMAGE_PROXY_OFFLINE=1 never downloads anything;
+    # without a key (FLASK_APP_SECRET_KEY or IMAGE_PROXY_KEY) the pages link the photos directly
+    key = os.environ.get("IMAGE_PROXY_KEY") or app.config.get("SECRET_KEY")
+    if os.environ.get("IMAGE_PROXY", "1") == "0" or not key:
+        app.extensions["image_proxy"] = None
+        return
+    app.extensions["image_proxy"] = ImageProxy(key, ImageCache(
+        os.environ.get("IMAGE_CACHE_DIR") or os.path.join(app.instance_path, "images"),
+        max_bytes=int(float(os.environ.get("IMAGE_CACHE_MAX_MB", 256)) * 1024 * 1024),
+        seed_dir=os.environ.get("IMAGE_SEED_DIR"),
+        offline=os.environ.get("IMAGE_PROXY_OFFLINE") == "1",
+        allow_private=os.environ.get("IMAGE_PROXY_ALLOW_PRIVATE") == "1",
+        timeout=float(os.environ.get("IMAGE_FETCH_TIMEOUT", 5)),
+        registry=app_caches(app)))
+
+
+def current_proxy():
+    # ImageProxy of the current app, None when the proxy is off
+    return current_app.extensions.get("image_proxy")
+
+
+def proxied(source_url, width):
+    # url of the photo in one of THUMBNAIL_WIDTHS, the source itself when the proxy is off or it is no web url
+    proxy = current_proxy()
+    if proxy is None or not source_url or not source_url.startswith(("http://", "https://")):
+        return source_url
+    prefix = proxy.url_prefixes.get(request.script_root)
+    if prefix is None:
+        # url_for once per script root, a map with many infoboxes only appends the params
+        prefix = proxy.url_prefixes[request.script_root] = url_for('api.api_image', width=0)[:-1]
+    return f"{prefix}{width}?url={quote(source_url, safe='')}&sig={proxy.signature(source_url, width)}"
+
+
+def is_public_host(host):
+    # photos come from urls users typed in, the server must not be made to call itself or the internal network
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except (socket.gaierror, UnicodeError):
+        return False
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%")[0])
+        if ip.is_private or ip.is_loopback or ip.is_link_local or ip.is_reserved or ip.is_multicast:
+            return False
+    return bool(addresses)
+
+
+def image_type(data):
+    for start, mimetype in IMAGE_SIGNATURES:
+        if data.startswith(start):
+            return mimetype
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+class ImageCache:
+    # thumbnails on disk named by the sha256 of the downloaded image: <root>/<2 hex>/<sha256>-<width>, so the same
+    # photo under different urls is kept once; <root>/sources/<sha256 of the url> says which image an url is;
+    # over max_bytes the least recently served thumbnails are removed
+    def __init__(self, root, max_bytes=256 * 1024 * 1024, seed_dir=None, offline=False, allow_private=False,
+                 timeout=5, registry=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.seed_dir = seed_dir
+        self.offline = offline
+        self.allow_private = allow_private
+        self.timeout = timeout
+        self.session = None
+        # sources that could not be loaded are not tried again for a while
+        self.failed = TTLCache("image_failures", maxsize=1024, ttl=300, registry=registry)
+        self._lock = threading.Lock()
+        # one download per source url at a time, the other requests for it wait for the result
+        self._source_locks = {}
+        self._size = None
+        self.hits = 0
+        self.downloads = 0
+        self.seeded = 0
+        self.failures = 0
+        self.evictions = 0
+
+    def thumbnail(self, source_url, width):
+        # the Thumbnail of the source in the given width, None when the source cannot be loaded
+        url_key = hashlib.sha256(source_url.encode()).hexdigest()
+        found = self._cached(url_key, width)
+        if found is not None:
+            return found
+        if self.failed.get(url_key):
+            return None
+
+        lock = self._source_lock(url_key)
+        try:
+            with lock:
+                # someone else may have loaded it meanwhile
+                found = self._cached(url_key, width)
+                if found is not None:
+                    return found
+                data = self._load(source_url)
+                if data is None or not self._store(url_key, data):
+                    self.failed.set(url_key, True)
+                    with self._lock:
+                        self.failures += 1
+                    return None
+        finally:
+            with self._lock:
+                if not lock.locked():
+                    self._source_locks.pop(url_key, None)
+        return self._cached(url_key, width, count_hit=False)
+
+    def _cached(self, url_key, width, count_hit=True):
+        try:
+            with open(self._source_path(url_key)) as source:
+                content_key, stored = source.read().split()
+        except (OSError, ValueError):
+            return None
+        # stored: "thumbnails" (JPEG in every width) or the type of the original kept without Pillow
+        path = self._thumbnail_path(content_key, width if stored == "thumbnails" else "original")
+        try:
+            # the modification time is the last use, eviction removes the oldest; touched once an hour at most
+            if time.time() - os.stat(path).st_mtime > 3600:
+                os.utime(path)
+        except OSError:
+            return None
+        if count_hit:
+            with self._lock:
+                self.hits += 1
+        mimetype = "image/jpeg" if stored == "thumbnails" else stored
+        return Thumbnail(path, mimetype, f"{content_key[:32]}-{width}")
+
+    def _source_lock(self, url_key):
+        with self._lock:
+            return self._source_locks.setdefault(url_key, threading.Lock())
+
+    def _source_path(self, url_key):
+        return os.path.join(self.root, "sources", url_key)
+
+    def _thumbnail_path(self, content_key, variant):
+        return os.path.join(self.root, content_key[:2], f"{content_key}-{variant}")
+
+    def _load(self, source_url):
+        # the local copy from IMAGE_SEED_DIR (named by the sha256 of the url or by the file name in the url),
+        # otherwise the download
+        if self.seed_dir:
+            url_key = hashlib.sha256(source_url.encode()).hexdigest()
+            for name in (url_key, os.path.basename(urlsplit(source_url).path)):
+                path = os.path.join(self.seed_dir, name)
+                if name and os.path.isfile(path):
+                    with open(path, "rb") as seed:
+                        data = seed.read(MAX_SOURCE_BYTES + 1)
+                    if len(data) <= MAX_SOURCE_BYTES:
+                        with self._lock:
+                            self.seeded += 1
+                        return data
+        if self.offline:
+            return None
+        return self._download(source_url)
+
+    def _download(self, source_url):
+        if self.session is None:
+            # imported by the first download, like the Google client
+            import requests
+            self.network_errors = (requests.RequestException,)
+            self.session = requests.Session()
+        url = source_url
+        try:
+            for _ in range(MAX_REDIRECTS + 1):
+                parts = urlsplit(url)
+                if parts.scheme not in ("http", "https") or not parts.hostname:
+                    return None
+                if not self.allow_private and not is_public_host(parts.hostname):
+                    logger.warning("Image %s is not on a public host, not downloaded", parts.hostname)
+                    return None
+                # every redirect is checked like the first url
+                with self.session.get(url, timeout=self.timeout, stream=True, allow_redirects=False) as response:
+                    if response.is_redirect and response.headers.get("Location"):
+                        url = urljoin(url, response.headers["Location"])
+                        continue
+                    if response.status_code != 200:
+                        logger.warning("Image %s returned %s", parts.hostname, response.status_code)
+                        return None
+                    data = bytearray()
+                    for chunk in response.iter_content(64 * 1024):
+                        data += chunk
+                        if len(data) > MAX_SOURCE_BYTES:
+                            logger.warning("Image %s is larger than %s bytes", parts.hostname, MAX_SOURCE_BYTES)
+                            return None
+                    with self._lock:
+                        self.downloads += 1
+                    return bytes(data)
+        except self.network_errors as error:
+            # the type only, the url may contain a key
+            logger.warning("Image download failed: %s", type(error).__name__)
+        return None
+
+    def _store(self, url_key, data):
+        # writes the thumbnails of every width (or the original without Pillow) and then the source entry
+        content_key = hashlib.sha256(data).hexdigest()
+        if load_pillow() is not None:
+            try:
+                variants = {width: self._resize(data, width) for width in THUMBNAIL_WIDTHS}
+            except Exception as error:
+                logger.warning("Image %s could not be read: %s", content_key[:12], error)
+                return False
+            stored = "thumbnails"
+        else:
+            stored = image_type(data)
+            if stored is None:
+                logger.warning("Image %s is not a JPEG, PNG, GIF or WebP", content_key[:12])
+                return False
+            variants = {"original": data}
+
+        written = 0
+        for variant, content in variants.items():
+            path = self._thumbnail_path(content_key, variant)
+            if not os.path.exists(path):
+                self._write(path, content)
+                written += len(content)
+        self._write(self._source_path(url_key), f"{content_key} {stored}".encode())
+        self._grow(written)
+        return True
+
+    def _resize(self, data, width):
+        with Image.open(BytesIO(data)) as image:
+            # JPEG decoding at a reduced scale, much faster for large photos
+            image.draft("RGB", (width, width * 4))
+            image = image.convert("RGB")
+            image.thumbnail((width, width * 4))
+            output = BytesIO()
+            image.save(output, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+            return output.getvalue()
+
+    def _write(self, path, content):
+        # a whole file or none, readers never see half of it
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(handle, "wb") as output:
+                output.write(content)
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+    def _files(self):
+        # (modified, size, path) of every thumbnail
+        files = []
+        for directory, _, names in os.walk(self.root):
+            if os.path.basename(directory) == "sources":
+                continue
+            for name in names:
+                if name.startswith(".tmp-"):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def _grow(self, written):
+        with self._lock:
+            if self._size is None:
+                # counted once per process, then kept up to date
+                self._size = sum(size for _, size, _ in self._files())
+            else:
+                self._size += written
+            if self._size <= self.max_bytes:
+                return
+            # down to 90 %, so not every new photo runs an eviction
+            target = self.max_bytes * 0.9
+            for modified, size, path in sorted(self._files()):
+                if self._size <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                self._size -= size
+                self.evictions += 1
+            logger.info("Image cache evicted down to %s bytes", self._size)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "downloads": self.downloads, "seeded": self.seeded, "failures": self.failures,
+                    "evictions": self.evictions, "bytes": self._size, "max_bytes": self.max_bytes}
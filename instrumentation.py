@@ -0,0 +1,296 @@
+import bisect
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+
+from flask import current_app, g, request, has_app_context, before_render_template, template_rendered
+from sqlalchemy import event
+
+
+# where time of a request goes, every span kind gets its own part of the Server-Timing header and of /metrics
+SPAN_KINDS = ("db", "google", "map", "template")
+# seconds, the default buckets of the Prometheus clients
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+# seconds the ASGI entry point spent on Google before the view ran (see asgi.py), counted as the google span
+GOOGLE_PREFETCH_SECONDS = "cafes.google_prefetch_seconds"
+MAX_PROFILE_SECONDS = 60
+
+
+def configure_logging(level):
+    # LOG_LEVEL=DEBUG shows the per request timings and the debug lines of the views
+    logging.basicConfig(level=level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    logging.getLogger().setLevel(level)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Histogram:
+    # Prometheus histogram with labels, observe() is thread safe
+    def __init__(self, name, documentation, labelnames, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # labels -> [count per bucket..., count, sum]
+        self._series = {}
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            label_text = ",".join(f'{name}="{escape_label(value)}"' for name, value in zip(self.labelnames, labels))
+            prefix = label_text + "," if label_text else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {values[-2]}')
+            lines.append(f"{self.name}_count{{{label_text}}} {values[-2]}")
+            lines.append(f"{self.name}_sum{{{label_text}}} {values[-1]:.6f}")
+        return lines
+
+
+class CounterMetric:
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values = Counter()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            label_text = ",".join(f'{name}="{escape_label(value)}"' for name, value in zip(self.labelnames, labels))
+            lines.append(f"{self.name}{{{label_text}}} {value}")
+        return lines
+
+
+class RequestTimings:
+    # spans of one request, kept in flask.g
+    __slots__ = ("start", "spans", "queries", "template_starts")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = defaultdict(float)
+        self.queries = 0
+        self.template_starts = []
+
+
+def sample_stacks(seconds, interval, skip_thread):
+    # samples the stacks of all other threads every interval seconds, returns Counter of collapsed stacks,
+    # "outer;...;inner" -> samples, the format of flamegraph.pl and speedscope
+    stacks = Counter()
+    names = {}
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == skip_thread:
+                continue
+            calls = []
+            while frame is not None:
+                code = frame.f_code
+                label = names.get(code)
+                if label is None:
+                    label = names[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                calls.append(label)
+                frame = frame.f_back
+            stacks[";".join(reversed(calls))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+class RequestMetrics:
+    # the histograms and counters of one app, kept in app.extensions["instrumentation"] by Instrumentation.init_app()
+    def __init__(self, logger):
+        self.logger = logger
+        self.request_seconds = Histogram("cafes_http_request_duration_seconds", "Time to build the response.",
+                                         ("route", "method"), LATENCY_BUCKETS)
+        self.requests = CounterMetric("cafes_http_requests_total", "Finished requests.", ("route", "method", "status"))
+        self.span_seconds = Histogram("cafes_request_span_seconds", "Time of one request spent in each span kind.",
+                                      ("route", "kind"), LATENCY_BUCKETS)
+        self.query_counts = Histogram("cafes_sql_queries_per_request", "SQL statements run by one request.",
+                                      ("route",), QUERY_COUNT_BUCKETS)
+        self._profile_lock = threading.Lock()
+
+    def metrics_text(self):
+        lines = []
+        for metric in (self.request_seconds, self.requests, self.span_seconds, self.query_counts):
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+    def profile(self, seconds, interval):
+        # collapsed stacks of all threads sampled for the given time, None when another profile is running
+        if not self._profile_lock.acquire(blocking=False):
+            return None
+        try:
+            stacks = sample_stacks(min(seconds, MAX_PROFILE_SECONDS), interval, threading.get_ident())
+        finally:
+            self._profile_lock.release()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class Instrumentation:
+    # opt-in timings of every request: spans (db, google, map, template), SQL query counts, Server-Timing header,
+    # latency histograms per route for /metrics; one object for all apps (the views use it at import), the metrics
+    # of an app are made by init_app(), without them nothing is registered and span() costs nothing
+    def init_app(self, app, enabled=None):
+        # INSTRUMENTATION=1 switches it on
+        if enabled is None:
+            enabled = os.environ.get("INSTRUMENTATION") == "1"
+        if not enabled:
+            return
+        app.extensions["instrumentation"] = RequestMetrics(app.logger)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        before_render_template.connect(self._start_template, app)
+        template_rendered.connect(self._finish_template, app)
+
+    @staticmethod
+    def _metrics():
+        # RequestMetrics of the current app, None outside of an app or when it is not instrumented
+        if not has_app_context():
+            return None
+        return current_app.extensions.get("instrumentation")
+
+    @property
+    def enabled(self):
+        return self._metrics() is not None
+
+    def track_engine(self, engine):
+        # counts and times every statement run on the engine for the current request
+        if not self.enabled:
+            return
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def start_query(connection, cursor, statement, parameters, context, executemany):
+            connection.info.setdefault("query_starts", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def finish_query(connection, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - connection.info["query_starts"].pop()
+            timings = self._current()
+            if timings is not None:
+                timings.spans["db"] += elapsed
+                timings.queries += 1
+
+        @event.listens_for(engine, "handle_error")
+        def forget_query(context):
+            # a failed statement never reaches after_cursor_execute
+            if context.connection is not None and context.connection.info.get("query_starts"):
+                context.connection.info["query_starts"].pop()
+
+    def span(self, kind):
+        # with instrumentation.span("google"): ... adds the time of the block to the span of the request
+        if not self.enabled:
+            return nullcontext()
+        return self._span(kind)
+
+    @contextmanager
+    def _span(self, kind):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings = self._current()
+            if timings is not None:
+                timings.spans[kind] += time.perf_counter() - start
+
+    def timed(self, kind):
+        # decorator version of span()
+        def decorator(function):
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with self._span(kind):
+                    return function(*args, **kwargs)
+            wrapper.__name__ = function.__name__
+            wrapper.__doc__ = function.__doc__
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def _current():
+        # None outside of requests (CLI commands, the photo pool threads)
+        if not has_app_context():
+            return None
+        return g.get("request_timings")
+
+    def _start_request(self):
+        timings = g.request_timings = RequestTimings()
+        prefetch_seconds = request.environ.get(GOOGLE_PREFETCH_SECONDS)
+        if prefetch_seconds:
+            timings.spans["google"] += prefetch_seconds
+            timings.start -= prefetch_seconds
+
+    def _start_template(self, sender, template, context, **extra):
+        timings = self._current()
+        if timings is not None:
+            timings.template_starts.append(time.perf_counter())
+
+    def _finish_template(self, sender, template, context, **extra):
+        timings = self._current()
+        if timings is not None and timings.template_starts:
+            timings.spans["template"] += time.perf_counter() - timings.template_starts.pop()
+
+    def _finish_request(self, response):
+        timings = g.pop("request_timings", None)
+        if timings is None:
+            return response
+        metrics = current_app.extensions["instrumentation"]
+        total = time.perf_counter() - timings.start
+        # the rule, not the path, /cafe/1 and /cafe/2 are one route
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.request_seconds.observe((route, request.method), total)
+        metrics.requests.inc((route, request.method, str(response.status_code)))
+        metrics.query_counts.observe((route,), timings.queries)
+        parts = []
+        for kind in SPAN_KINDS:
+            if kind in timings.spans or (kind == "db" and timings.queries):
+                seconds = timings.spans[kind]
+                metrics.span_seconds.observe((route, kind), seconds)
+                description = f';desc="{timings.queries} queries"' if kind == "db" else ""
+                parts.append(f"{kind};dur={seconds * 1000:.1f}{description}")
+        parts.append(f"total;dur={total * 1000:.1f}")
+        response.headers.add("Server-Timing", ", ".join(parts))
+        if metrics.logger.isEnabledFor(logging.DEBUG):
+            spans = "".join(f", {kind} {seconds * 1000:.1f} ms" for kind, seconds in timings.spans.items())
+            metrics.logger.debug("%s %s %s %.1f ms, %s queries%s", request.method, request.path, response.status_code,
+                              total * 1000, timings.queries, spans)
+        return response
+
+    def metrics_text(self):
+        # empty when the app is not instrumented
+        metrics = self._metrics()
+        return metrics.metrics_text() if metrics is not None else ""
+
+    def profile(self, seconds, interval):
+        # None when the app is not instrumented or another profile is running
+        metrics = self._metrics()
+        return metrics.profile(seconds, interval) if metrics is not None else None
@@ -0,0 +1,230 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+
+
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_MAPS_API_URL = "https://maps.googleapis.com"
+
+
+class MapsUnavailable(Exception):
+    # Google did not give a usable answer (timeout, 5xx, open circuit, ...), callers fall back to the DB only path
+    pass
+
+
+class CircuitBreaker:
+    # after failure_threshold failures in a row the circuit opens and calls are refused for reset_timeout seconds,
+    # then one trial call is let through (half open) and its result closes or reopens the circuit
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class MapsClient:
+    # shared client for all Google Maps web service calls: pooled keep-alive connections,
+    # connect/read timeouts, bounded retries with jittered backoff and a circuit breaker
+    def __init__(self, key, base_url=GOOGLE_MAPS_API_URL, connect_timeout=3.05, read_timeout=10,
+                 retries=2, backoff=0.3, pool_connections=4, pool_maxsize=16, breaker=None):
+        self.key = key
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+
+        # imported with the first client, workers that never call Google (API only) do not load requests
+        import requests
+        from requests.adapters import HTTPAdapter
+        # every failure of requests itself (connection, timeout, a body cut short, ...), not only the common ones
+        self.network_errors = requests.RequestException
+        self.session = requests.Session()
+        # pool_maxsize limits open connections per host, pool_block makes extra threads wait for a free one
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, path, params=None, allow_redirects=True):
+        if not self.breaker.allow():
+            raise MapsUnavailable("Circuit breaker is open, Google Maps calls are suspended")
+
+        params = dict(params or {})
+        params["key"] = self.key
+        url = f"{self.base_url}{path}"
+        last_error = None
+        # any way out without an answer from Google counts as a failure, an exception nobody expected too,
+        # otherwise a failed trial call would leave the circuit half open for good
+        answered = False
+        try:
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    # full jitter, spreads the retries of many workers hitting the same outage
+                    time.sleep(random.uniform(0, self.backoff * 2 ** (attempt - 1)))
+                try:
+                    response = self.session.get(url, params=params, timeout=self.timeout,
+                                                allow_redirects=allow_redirects)
+                except self.network_errors as error:
+                    # only the error type is kept, the message contains the url with our key
+                    last_error = type(error).__name__
+                    logger.warning("Google Maps call %s failed (attempt %s): %s", path, attempt + 1, last_error)
+                    continue
+
+                if response.status_code >= 500 or response.status_code == 429:
+                    last_error = f"{response.status_code} from Google Maps"
+                    logger.warning("Google Maps call %s returned %s (attempt %s)", path, response.status_code,
+                                   attempt + 1)
+                    continue
+
+                answered = True
+                self.breaker.record_success()
+                if response.status_code >= 400:
+                    # our request is wrong (bad key, bad params), retrying will not help, Google itself is fine
+                    raise MapsUnavailable(f"Google Maps call {path} returned {response.status_code}")
+                return response
+        finally:
+            if not answered:
+                self.breaker.record_failure()
+        raise MapsUnavailable(f"Google Maps call {path} failed: {last_error}")
+
+    def text_search(self, query):
+        response = self.get("/maps/api/place/textsearch/json", params={"query": f"'{query}'"})
+        try:
+            return response.json()
+        except ValueError as error:
+            raise MapsUnavailable(f"Places text search returned invalid JSON: {error}")
+
+    def photo_url(self, photo_reference, maxwidth=1000):
+        # the photo endpoint answers with a redirect to the real image, only the target url is needed,
+        # so the redirect is not followed and the image itself is never downloaded
+        response = self.get("/maps/api/place/photo",
+                            params={"maxwidth": maxwidth, "photo_reference": photo_reference},
+                            allow_redirects=False)
+        if response.is_redirect and response.headers.get("Location"):
+            return response.headers["Location"]
+        return response.url
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncMapsClient:
+    # asyncio twin of MapsClient on one shared httpx.AsyncClient, used by asgi.py;
+    # pass the breaker of the sync client, both of them talk to the same Google
+    def __init__(self, key, base_url=GOOGLE_MAPS_API_URL, connect_timeout=3.05, read_timeout=10,
+                 retries=2, backoff=0.3, pool_maxsize=100, breaker=None):
+        try:
+            # only the async client of the ASGI entry point (asgi.py) needs it
+            import httpx
+        except ImportError:
+            raise RuntimeError("The async Google Maps client needs httpx, pip install httpx")
+        self.key = key
+        self.base_url = base_url.rstrip("/")
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        # requests waiting for Google hold a connection only, not a thread, so the pool can be larger
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize))
+        # transport errors, broken or undecodable bodies, too many redirects, ...
+        self.transport_errors = httpx.HTTPError
+
+    async def get(self, path, params=None, allow_redirects=True):
+        if not self.breaker.allow():
+            raise MapsUnavailable("Circuit breaker is open, Google Maps calls are suspended")
+
+        params = dict(params or {})
+        params["key"] = self.key
+        url = f"{self.base_url}{path}"
+        last_error = None
+
+        # see MapsClient.get(), every way out without an answer is a failure
+        answered = False
+        try:
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    await asyncio.sleep(random.uniform(0, self.backoff * 2 ** (attempt - 1)))
+                try:
+                    response = await self.client.get(url, params=params, follow_redirects=allow_redirects)
+                except self.transport_errors as error:
+                    # only the error type is kept, the message contains the url with our key
+                    last_error = type(error).__name__
+                    logger.warning("Google Maps call %s failed (attempt %s): %s", path, attempt + 1, last_error)
+                    continue
+
+                if response.status_code >= 500 or response.status_code == 429:
+                    last_error = f"{response.status_code} from Google Maps"
+                    logger.warning("Google Maps call %s returned %s (attempt %s)", path, response.status_code,
+                                   attempt + 1)
+                    continue
+
+                answered = True
+                self.breaker.record_success()
+                if response.status_code >= 400:
+                    raise MapsUnavailable(f"Google Maps call {path} returned {response.status_code}")
+                return response
+        finally:
+            if not answered:
+                self.breaker.record_failure()
+        raise MapsUnavailable(f"Google Maps call {path} failed: {last_error}")
+
+    async def text_search(self, query):
+        response = await self.get("/maps/api/place/textsearch/json", params={"query": f"'{query}'"})
+        try:
+            return response.json()
+        except ValueError as error:
+            raise MapsUnavailable(f"Places text search returned invalid JSON: {error}")
+
+    async def photo_url(self, photo_reference, maxwidth=1000):
+        # the redirect target is the photo url, see MapsClient.photo_url()
+        response = await self.get("/maps/api/place/photo",
+                                  params={"maxwidth": maxwidth, "photo_reference": photo_reference},
+                                  allow_redirects=False)
+        if response.is_redirect and response.headers.get("Location"):
+            return response.headers["Location"]
+        return str(response.url)
+
+    async def close(self):
+        await self.client.aclose()
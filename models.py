@@ -0,0 +1,184 @@
+import logging
+import re
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+from sqlalchemy import Integer, String, Boolean, Float, Index, Computed, event, inspect, text
+
+from geo import cafe_geohash
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+db = SQLAlchemy(model_class=Base)
+logger = logging.getLogger(__name__)
+
+# the Google place id in a map url, https://www.google.com/maps/place/?q=place_id:ChIJ...
+PLACE_ID_IN_URL = re.compile(r"place_id:([\w-]+)")
+
+
+def place_id_for(map_url):
+    # None for map urls without a place id (typed in by hand, made before the locate page existed)
+    match = PLACE_ID_IN_URL.search(map_url or "")
+    return match.group(1) if match else None
+
+
+def default_geohash(context):
+    parameters = context.get_current_parameters()
+    return cafe_geohash(parameters.get("lat"), parameters.get("lon"))
+
+
+def default_place_id(context):
+    return place_id_for(context.get_current_parameters().get("map_url"))
+
+
+# bit of every amenity in Cafe.amenities, a new amenity gets the next free bit (and a new Boolean column)
+AMENITY_BITS = {"has_toilet": 1, "has_wifi": 2, "has_sockets": 4, "can_take_calls": 8}
+# names of the amenity form fields and query params (has_wifi=1, ...), in the order of the bits
+AMENITIES = tuple(AMENITY_BITS)
+# the booleans are stored as 0/1, so the mask is their weighted sum
+AMENITY_MASK_SQL = " + ".join(f"{amenity} * {bit}" for amenity, bit in AMENITY_BITS.items())
+
+
+# Cafe TABLE Configuration
+class Cafe(db.Model):
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(String(250), nullable=False)
+    map_url: Mapped[str] = mapped_column(String(500), nullable=False)
+    img_url: Mapped[str] = mapped_column(String(500), nullable=False)
+    location: Mapped[str] = mapped_column(String(250), nullable=False)
+    seats: Mapped[str] = mapped_column(String(250), nullable=False)
+    has_toilet: Mapped[bool] = mapped_column(Boolean, nullable=False)
+    has_wifi: Mapped[bool] = mapped_column(Boolean, nullable=False)
+    has_sockets: Mapped[bool] = mapped_column(Boolean, nullable=False)
+    can_take_calls: Mapped[bool] = mapped_column(Boolean, nullable=False)
+    coffee_price: Mapped[str] = mapped_column(String(250), nullable=True)
+    lat: Mapped[str] = mapped_column(Float, nullable=False)
+    lon: Mapped[str] = mapped_column(Float, nullable=False)
+    # geohash of lat/lon for the nearby search, the default fills it for every insert (bulk ones too),
+    # update_geohash() below keeps it right when the coordinates change
+    geohash: Mapped[str] = mapped_column(String(12), nullable=True, index=True, default=default_geohash)
+    # all amenities packed into one indexed number, computed by SQLite from the booleans (virtual generated column),
+    # so it is right for every writer, ORM, Core or another tool
+    amenities: Mapped[int] = mapped_column(Integer, Computed(AMENITY_MASK_SQL), index=True)
+    # Google place id taken from map_url, unique, so a cafe found again by the locate page is recognized by one
+    # index lookup; the default fills it for every insert, update_place_id() below when map_url changes
+    place_id: Mapped[str] = mapped_column(String(250), nullable=True, unique=True, index=True,
+                                          default=default_place_id)
+
+    __table_args__ = (
+        # bounding box searches, see spatial.py
+        Index("ix_cafe_lat_lon", "lat", "lon"),
+    )
+
+
+@event.listens_for(Cafe, "before_update")
+def update_geohash(mapper, connection, cafe):
+    state = inspect(cafe)
+    if state.attrs.lat.history.has_changes() or state.attrs.lon.history.has_changes():
+        cafe.geohash = cafe_geohash(cafe.lat, cafe.lon)
+
+
+@event.listens_for(Cafe, "before_update")
+def update_place_id(mapper, connection, cafe):
+    if inspect(cafe).attrs.map_url.history.has_changes():
+        cafe.place_id = place_id_for(cafe.map_url)
+
+
+# columns served by the API, selected directly when no ORM instance is needed
+API_COLUMNS = (Cafe.id, Cafe.name, Cafe.map_url, Cafe.img_url, Cafe.location, Cafe.seats, Cafe.has_toilet,
+               Cafe.has_wifi, Cafe.has_sockets, Cafe.can_take_calls, Cafe.coffee_price, Cafe.lat, Cafe.lon)
+
+
+def cafe_to_json(cafe):
+    # the one API representation of a cafe, works for Cafe instances and for rows of API_COLUMNS
+    return {
+        "id": cafe.id,
+        "name": cafe.name,
+        "map_url": cafe.map_url,
+        "img_url": cafe.img_url,
+        "location": cafe.location,
+        "seats": cafe.seats,
+        "has_toilet": cafe.has_toilet,
+        "has_wifi": cafe.has_wifi,
+        "has_sockets": cafe.has_sockets,
+        "can_take_calls": cafe.can_take_calls,
+        "coffee_price": cafe.coffee_price,
+        "lat": cafe.lat,
+        "lng": cafe.lon,
+    }
+
+
+# columns needed to draw a cafe on the map
+MAP_COLUMNS = (Cafe.id, Cafe.name, Cafe.img_url, Cafe.lat, Cafe.lon, Cafe.has_toilet, Cafe.has_wifi,
+               Cafe.has_sockets, Cafe.can_take_calls)
+
+def amenity_mask(cafe):
+    # written out instead of looping over AMENITY_BITS, it runs once per marker
+    return ((1 if cafe.has_toilet else 0) | (2 if cafe.has_wifi else 0)
+            | (4 if cafe.has_sockets else 0) | (8 if cafe.can_take_calls else 0))
+
+
+def mask_for(amenities):
+    # ["has_wifi", "can_take_calls"] -> 10
+    return sum(AMENITY_BITS[amenity] for amenity in amenities)
+
+
+def amenity_filters(mask):
+    # where clauses for cafes having (at least) all amenities of mask, none for an empty mask;
+    # "amenities & mask = mask" could not use the index, the list of all masks containing mask can
+    if not mask:
+        return []
+    supersets = [value for value in range(2 ** len(AMENITY_BITS)) if value & mask == mask]
+    return [Cafe.amenities.in_(supersets)]
+
+
+def init_amenity_column(engine):
+    # adds the generated column and its index to DBs made before it existed, idempotent;
+    # a changed AMENITY_BITS needs the column dropped first, SQLite cannot alter a generated column
+    columns = {column["name"] for column in inspect(engine).get_columns("cafe")}
+    with engine.begin() as connection:
+        if "amenities" not in columns:
+            connection.execute(text(f"ALTER TABLE cafe ADD COLUMN amenities INTEGER "
+                                    f"GENERATED ALWAYS AS ({AMENITY_MASK_SQL}) VIRTUAL"))
+        connection.execute(text("CREATE INDEX IF NOT EXISTS ix_cafe_amenities ON cafe (amenities)"))
+
+
+def known_places(session, place_ids):
+    # place id -> (id, img_url) of the cafes already in the DB, one IN query on the unique index
+    place_ids = {place_id for place_id in place_ids if place_id}
+    if not place_ids:
+        return {}
+    return {place_id: (cafe_id, img_url) for cafe_id, place_id, img_url in session.execute(
+        db.select(Cafe.id, Cafe.place_id, Cafe.img_url).where(Cafe.place_id.in_(place_ids)))}
+
+
+def init_place_id_column(engine, batch_size=10000):
+    # migration of DBs made before the place_id column existed: adds it, fills it from the map urls and adds the
+    # unique index; of cafes sharing a place id only the oldest one gets it, idempotent
+    columns = {column["name"] for column in inspect(engine).get_columns("cafe")}
+    with engine.begin() as connection:
+        if "place_id" not in columns:
+            connection.execute(text("ALTER TABLE cafe ADD COLUMN place_id VARCHAR(250)"))
+        taken = set(connection.execute(text("SELECT place_id FROM cafe WHERE place_id IS NOT NULL")).scalars())
+        missing = connection.execute(text("SELECT id, map_url FROM cafe WHERE place_id IS NULL"
+                                          " AND map_url LIKE '%place_id:%' ORDER BY id")).all()
+        updates = []
+        duplicates = 0
+        for cafe_id, map_url in missing:
+            place_id = place_id_for(map_url)
+            if place_id is None or place_id in taken:
+                duplicates += place_id is not None
+                continue
+            taken.add(place_id)
+            updates.append({"id": cafe_id, "place_id": place_id})
+        update = text("UPDATE cafe SET place_id = :place_id WHERE id = :id")
+        for start in range(0, len(updates), batch_size):
+            connection.execute(update, updates[start:start + batch_size])
+        connection.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_cafe_place_id ON cafe (place_id)"))
+    if updates:
+        logger.info("Place id filled for %s cafes", len(updates))
+    if duplicates:
+        logger.warning("%s cafes share the place id of an older cafe, their place_id stays empty", duplicates)
@@ -0,0 +1,149 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from flask import current_app, request, has_request_context
+
+from maps_client import MapsClient, MapsUnavailable, CircuitBreaker, GOOGLE_MAPS_API_URL
+from cache import TTLCache, SqliteCacheStore, normalize_query, app_caches
+from extensions import instrumentation
+
+
+# Google Places calls of the search and locate pages, with their caches
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_MAPS_KEY = os.environ.get("GOOGLE_MAPS_KEY")
+
+# candidate photos are resolved in parallel, at most PHOTO_CONCURRENCY at once and only PHOTO_DEADLINE seconds per page
+PHOTO_DEADLINE = float(os.environ.get("PHOTO_DEADLINE", 3))
+DEFAULT_PHOTO_URL = "https://storage.googleapis.com/support-forums-api/attachment/thread-229005770-10479669858494658829.jpg"
+
+# the ASGI entry point (asgi.py) awaits the Google calls before the view runs and passes the answers
+# in the WSGI environ: {normalized query: results or None} and {photo_reference: url}
+PREFETCHED_PLACES = "cafes.places_results"
+PREFETCHED_PHOTOS = "cafes.photo_urls"
+
+
+class Places:
+    # the Google client, answer caches and photo pool of one app, kept in app.extensions["places"] by init_app()
+    def __init__(self, app):
+        # PLACES_CACHE_PERSIST=1 keeps the answers also in instance/places_cache.db so they survive restarts
+        store = None
+        if os.environ.get("PLACES_CACHE_PERSIST"):
+            os.makedirs(app.instance_path, exist_ok=True)
+            store = SqliteCacheStore(os.path.join(app.instance_path, "places_cache.db"))
+        # cache of Places text search answers, the same city is searched again and again
+        self.places_cache = TTLCache("places",
+                                     maxsize=int(os.environ.get("PLACES_CACHE_SIZE", 512)),
+                                     ttl=int(os.environ.get("PLACES_CACHE_TTL", 24 * 60 * 60)),
+                                     store=store, registry=app_caches(app))
+        # photo_reference -> photo url, confirming the same area again does not call Google at all
+        self.photo_cache = TTLCache("photos",
+                                    maxsize=int(os.environ.get("PHOTO_CACHE_SIZE", 4096)),
+                                    ttl=int(os.environ.get("PHOTO_CACHE_TTL", 24 * 60 * 60)),
+                                    store=store, registry=app_caches(app))
+        self.photo_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("PHOTO_CONCURRENCY", 8)),
+                                                 thread_name_prefix="photo")
+        # one shared client for all Google calls, made by the first call (see maps_client())
+        self._maps_client = None
+        self._maps_client_lock = threading.Lock()
+
+    def maps_client(self):
+        # GOOGLE_MAPS_API_URL can point the client to a local stub server
+        if self._maps_client is None:
+            with self._maps_client_lock:
+                if self._maps_client is None:
+                    self._maps_client = MapsClient(
+                        GOOGLE_MAPS_KEY,
+                        base_url=os.environ.get("GOOGLE_MAPS_API_URL", GOOGLE_MAPS_API_URL),
+                        connect_timeout=float(os.environ.get("GOOGLE_MAPS_CONNECT_TIMEOUT", 3.05)),
+                        read_timeout=float(os.environ.get("GOOGLE_MAPS_READ_TIMEOUT", 10)),
+                        retries=int(os.environ.get("GOOGLE_MAPS_RETRIES", 2)),
+                        pool_maxsize=int(os.environ.get("GOOGLE_MAPS_POOL_SIZE", 16)),
+                        breaker=CircuitBreaker(
+                            failure_threshold=int(os.environ.get("GOOGLE_MAPS_BREAKER_FAILURES", 5)),
+                            reset_timeout=float(os.environ.get("GOOGLE_MAPS_BREAKER_RESET", 30))))
+        return self._maps_client
+
+    def remember_places_results(self, key, results):
+        logger.debug("Places text search for %s returned %s", key, results.get("status"))
+        # errors like OVER_QUERY_LIMIT or REQUEST_DENIED are not cached, only real answers
+        if results.get("status") in ("OK", "ZERO_RESULTS"):
+            self.places_cache.set(key, results)
+
+    def fetch_photo_url(self, photo_reference):
+        # runs in the photo pool, stores the url itself so even answers arriving after the deadline warm the cache
+        photo_url = self.maps_client().photo_url(photo_reference)
+        self.photo_cache.set(photo_reference, photo_url)
+        return photo_url
+
+
+def init_app(app):
+    app.extensions["places"] = Places(app)
+
+
+def current_places():
+    return current_app.extensions["places"]
+
+
+def places_text_search(query):
+    # returns parsed answer of Places text search, None if Google is not available
+    key = normalize_query(query)
+    prefetched = request.environ.get(PREFETCHED_PLACES, {}) if has_request_context() else {}
+    if key in prefetched:
+        return prefetched[key]
+    places = current_places()
+    results = places.places_cache.get(key)
+    if results is not None:
+        return results
+
+    try:
+        with instrumentation.span("google"):
+            results = places.maps_client().text_search(query)
+    except MapsUnavailable as error:
+        logger.warning("Places text search for %s failed: %s", key, error)
+        return None
+    places.remember_places_results(key, results)
+    return results
+
+
+def candidate_photo_refs(candidates):
+    # photo reference of every candidate, None for candidates without a photo
+    photo_refs = []
+    for candidate in candidates:
+        try:
+            photo_refs.append(candidate['photos'][0]['photo_reference'])
+        except (KeyError, IndexError, TypeError):
+            photo_refs.append(None)
+    return photo_refs
+
+
+def resolve_photo_urls(photo_references, deadline=None):
+    # returns photo_reference -> url, references not resolved before the deadline are missing in the result
+    prefetched = request.environ.get(PREFETCHED_PHOTOS) if has_request_context() else None
+    if prefetched is not None:
+        return {photo_reference: prefetched[photo_reference]
+                for photo_reference in photo_references if photo_reference in prefetched}
+    places = current_places()
+    photo_urls = {}
+    pending = {}
+    for photo_reference in set(photo_references):
+        photo_url = places.photo_cache.get(photo_reference)
+        if photo_url is not None:
+            photo_urls[photo_reference] = photo_url
+        else:
+            pending[places.photo_executor.submit(places.fetch_photo_url, photo_reference)] = photo_reference
+
+    if pending:
+        with instrumentation.span("google"):
+            done, not_done = wait(pending, timeout=PHOTO_DEADLINE if deadline is None else deadline)
+        for future in done:
+            try:
+                photo_urls[pending[future]] = future.result()
+            except Exception as error:
+                logger.warning("Photo %s could not be resolved: %s", pending[future], error)
+        if not_done:
+            logger.warning("%s photos missed the deadline, default picture used", len(not_done))
+    return photo_urls
@@ -0,0 +1,225 @@
+import bisect
+import threading
+from array import array
+from collections import namedtuple
+
+from sqlalchemy import select
+
+from models import Cafe, API_COLUMNS, amenity_mask
+
+
+# text columns, kept as utf-8 in one shared buffer, the cafes only hold offsets and lengths
+TEXT_FIELDS = ("name", "map_url", "img_url", "location", "seats", "coffee_price")
+NAME, MAP_URL, IMG_URL, LOCATION, SEATS, COFFEE_PRICE = range(len(TEXT_FIELDS))
+# length of a NULL text (coffee_price is nullable)
+NULL_LENGTH = 0xFFFFFFFF
+
+# rows handed out by the read model, they work everywhere a row of MAP_COLUMNS / API_COLUMNS does
+MapRow = namedtuple("MapRow", "id name img_url lat lon has_toilet has_wifi has_sockets can_take_calls")
+ApiRow = namedtuple("ApiRow", [column.key for column in API_COLUMNS])
+
+
+class _Tables:
+    # one column array per field, position i of every array is the same cafe, ids ascending
+    __slots__ = ("ids", "lats", "lons", "masks", "alive", "starts", "lengths", "text", "deleted", "garbage",
+                 "lat_order", "sorted_lats")
+
+    def __init__(self):
+        self.ids = array("q")
+        self.lats = array("d")
+        self.lons = array("d")
+        self.masks = array("B")
+        self.alive = array("B")
+        self.starts = [array("Q") for _ in TEXT_FIELDS]
+        self.lengths = [array("I") for _ in TEXT_FIELDS]
+        self.text = bytearray()
+        # deleted cafes and replaced text stay in the arrays until the next rebuild
+        self.deleted = 0
+        self.garbage = 0
+        # positions ordered by latitude for the tiles, made by the first tile after a change (see lat_index())
+        self.lat_order = None
+        self.sorted_lats = None
+
+    def nbytes(self):
+        arrays = [self.ids, self.lats, self.lons, self.masks, self.alive, *self.starts, *self.lengths]
+        return sum(len(column) * column.itemsize for column in arrays) + len(self.text)
+
+
+class ReadModel:
+    # compact snapshot of the cafe table for the hot read routes, built by the first read (create_app() does not
+    # open the database) and updated after every committed write (see track_committed_writes); it lives in one
+    # process, other workers do not see its updates
+    def __init__(self, engine, chunk=10000):
+        self.engine = engine
+        self.chunk = chunk
+        # None until the first read
+        self.tables = None
+        self._lock = threading.RLock()
+
+    def build(self):
+        tables = _Tables()
+        with self.engine.connect() as connection:
+            rows = connection.execute(select(*API_COLUMNS).order_by(Cafe.id).execution_options(yield_per=self.chunk))
+            for row in rows:
+                self._append(tables, row)
+        with self._lock:
+            self.tables = tables
+
+    def _built(self):
+        # the tables, the first caller builds them and the others wait for it
+        with self._lock:
+            if self.tables is None:
+                self.build()
+            return self.tables
+
+    def refresh(self, cafe_ids=None):
+        # reloads the given cafes, all of them when no ids are known (Core writes like the bulk import);
+        # nothing to do before the first read, that one reads the committed data anyway
+        if self.tables is None:
+            return
+        if cafe_ids is None:
+            return self.build()
+        cafe_ids = sorted(set(cafe_ids))
+        with self.engine.connect() as connection:
+            rows = {row.id: row for row in connection.execute(select(*API_COLUMNS).where(Cafe.id.in_(cafe_ids)))}
+
+        with self._lock:
+            tables = self.tables
+            tables.lat_order = tables.sorted_lats = None
+            for cafe_id in cafe_ids:
+                position = self._position(tables, cafe_id)
+                row = rows.get(cafe_id)
+                if row is None:
+                    if position is not None:
+                        tables.alive[position] = 0
+                        tables.deleted += 1
+                elif position is not None:
+                    self._replace(tables, position, row)
+                elif not tables.ids or cafe_id > tables.ids[-1]:
+                    self._append(tables, row)
+                else:
+                    # an id lower than the last one, the arrays would not be ordered any more
+                    return self.build()
+            if tables.deleted > len(tables.ids) // 4 or tables.garbage > len(tables.text) // 2:
+                return self.build()
+
+    @staticmethod
+    def _position(tables, cafe_id):
+        # the live entry of the id, ids only grow, a re-added id sits after its deleted entry
+        position = bisect.bisect_right(tables.ids, cafe_id) - 1
+        if position >= 0 and tables.ids[position] == cafe_id and tables.alive[position]:
+            return position
+        return None
+
+    @staticmethod
+    def _store_text(tables, field, value, position=None):
+        if value is None:
+            start, length = 0, NULL_LENGTH
+        else:
+            encoded = value.encode("utf-8")
+            start, length = len(tables.text), len(encoded)
+            tables.text += encoded
+        if position is None:
+            tables.starts[field].append(start)
+            tables.lengths[field].append(length)
+        else:
+            old_length = tables.lengths[field][position]
+            tables.garbage += 0 if old_length == NULL_LENGTH else old_length
+            tables.starts[field][position] = start
+            tables.lengths[field][position] = length
+
+    def _append(self, tables, row):
+        tables.ids.append(row.id)
+        tables.lats.append(row.lat)
+        tables.lons.append(row.lon)
+        tables.masks.append(amenity_mask(row))
+        tables.alive.append(1)
+        for field, name in enumerate(TEXT_FIELDS):
+            self._store_text(tables, field, getattr(row, name))
+
+    def _replace(self, tables, position, row):
+        tables.lats[position] = row.lat
+        tables.lons[position] = row.lon
+        tables.masks[position] = amenity_mask(row)
+        for field, name in enumerate(TEXT_FIELDS):
+            self._store_text(tables, field, getattr(row, name), position)
+
+    @staticmethod
+    def _text(tables, field, position):
+        length = tables.lengths[field][position]
+        if length == NULL_LENGTH:
+            return None
+        start = tables.starts[field][position]
+        return tables.text[start:start + length].decode("utf-8")
+
+    def _positions(self, tables, mask=0, after=0, limit=None):
+        # positions of live cafes with id > after having all amenities of mask, in id order
+        position = bisect.bisect_right(tables.ids, after)
+        alive = tables.alive
+        masks = tables.masks
+        found = 0
+        for position in range(position, len(tables.ids)):
+            if alive[position] and masks[position] & mask == mask:
+                yield position
+                found += 1
+                if limit is not None and found >= limit:
+                    return
+
+    def map_rows(self, mask=0):
+        # what the map needs (MAP_COLUMNS) of every cafe with the amenities of mask
+        with self._lock:
+            tables = self._built()
+            rows = []
+            for position in self._positions(tables, mask):
+                cafe_mask = tables.masks[position]
+                rows.append(MapRow(tables.ids[position], self._text(tables, NAME, position),
+                                   self._text(tables, IMG_URL, position), tables.lats[position], tables.lons[position],
+                                   bool(cafe_mask & 1), bool(cafe_mask & 2), bool(cafe_mask & 4), bool(cafe_mask & 8)))
+            return rows
+
+    def api_rows(self, mask=0, after=0, limit=None):
+        # rows of API_COLUMNS ordered by id, for cafe_to_json()
+        with self._lock:
+            tables = self._built()
+            rows = []
+            for position in self._positions(tables, mask, after, limit):
+                cafe_mask = tables.masks[position]
+                rows.append(ApiRow(
+                    tables.ids[position], self._text(tables, NAME, position), self._text(tables, MAP_URL, position),
+                    self._text(tables, IMG_URL, position), self._text(tables, LOCATION, position),
+                    self._text(tables, SEATS, position), bool(cafe_mask & 1), bool(cafe_mask & 2),
+                    bool(cafe_mask & 4), bool(cafe_mask & 8), self._text(tables, COFFEE_PRICE, position),
+                    tables.lats[position], tables.lons[position]))
+            return rows
+
+    @staticmethod
+    def lat_index(tables):
+        if tables.lat_order is None:
+            lats = tables.lats
+            tables.lat_order = array("q", sorted(range(len(lats)), key=lats.__getitem__))
+            tables.sorted_lats = array("d", (lats[position] for position in tables.lat_order))
+        return tables.lat_order, tables.sorted_lats
+
+    def tile_rows(self, south, north, west, east, mask=0):
+        # (id, lat, lon) of the cafes in one map tile in id order, the edges as in spatial.tile_condition();
+        # only the cafes between the tile's latitudes are looked at
+        with self._lock:
+            tables = self._built()
+            lat_order, sorted_lats = self.lat_index(tables)
+            lats, lons, alive, masks = tables.lats, tables.lons, tables.alive, tables.masks
+            positions = []
+            for position in lat_order[bisect.bisect_left(sorted_lats, south):bisect.bisect_right(sorted_lats, north)]:
+                lat, lon = lats[position], lons[position]
+                if (alive[position] and masks[position] & mask == mask and (lat < north or north >= 90)
+                        and west <= lon and (lon < east or east >= 180 and lon <= east)):
+                    positions.append(position)
+            positions.sort()
+            return [(tables.ids[position], lats[position], lons[position]) for position in positions]
+
+    def stats(self):
+        with self._lock:
+            tables = self._built()
+            cafes = len(tables.ids) - tables.deleted
+            size = tables.nbytes()
+            return {"cafes": cafes, "bytes": size, "bytes_per_cafe": round(size / cafes, 1) if cafes else None,
+                    "deleted": tables.deleted, "garbage_bytes": tables.garbage}
@@ -0,0 +1,271 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from functools import wraps
+
+from flask import current_app, request, session, make_response
+from werkzeug.http import http_date
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from cache import TTLCache, app_caches
+
+
+logger = logging.getLogger(__name__)
+
+# the data version every cached response depends on, per cafe tags are "cafe:<id>"
+ALL_CAFES = "all"
+# seconds a page with a form (CSRF token) can be revalidated with 304
+SESSION_PAGE_LIFETIME = 1800
+
+# what ResponseCache.init_app() keeps in app.extensions["response_cache"]; versions: the DatabaseVersions of the
+# app's database, set by schema.detect_indexes() when it has the cache_version table, without it only the writes of
+# this process (and of the workers sharing a RedisBackend) change the versions
+CacheSettings = namedtuple("CacheSettings", "backend enabled versions")
+
+# versions kept in the database itself: every write of a cafe, by any process (workers, flask import-cafes,
+# the price buffer), bumps "all" and "cafe:<id>" in the same transaction
+UNIX_NOW = "(julianday('now') - 2440587.5) * 86400.0"
+VERSIONS_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS cache_version (
+           tag TEXT PRIMARY KEY, version INTEGER NOT NULL, modified REAL NOT NULL) WITHOUT ROWID""",
+    f"""CREATE TRIGGER IF NOT EXISTS cache_version_insert AFTER INSERT ON cafe
+       BEGIN
+           INSERT INTO cache_version (tag, version, modified) VALUES ('all', 1, {UNIX_NOW}), ('cafe:' || NEW.id, 1, {UNIX_NOW})
+           ON CONFLICT (tag) DO UPDATE SET version = version + 1, modified = excluded.modified;
+       END""",
+    f"""CREATE TRIGGER IF NOT EXISTS cache_version_update AFTER UPDATE ON cafe
+       BEGIN
+           INSERT INTO cache_version (tag, version, modified)
+           VALUES ('all', 1, {UNIX_NOW}), ('cafe:' || OLD.id, 1, {UNIX_NOW}), ('cafe:' || NEW.id, 1, {UNIX_NOW})
+           ON CONFLICT (tag) DO UPDATE SET version = version + 1, modified = excluded.modified;
+       END""",
+    f"""CREATE TRIGGER IF NOT EXISTS cache_version_delete AFTER DELETE ON cafe
+       BEGIN
+           INSERT INTO cache_version (tag, version, modified) VALUES ('all', 1, {UNIX_NOW}), ('cafe:' || OLD.id, 1, {UNIX_NOW})
+           ON CONFLICT (tag) DO UPDATE SET version = version + 1, modified = excluded.modified;
+       END""",
+]
+
+
+def init_cache_versions(engine):
+    # idempotent, run by init_schema(); True when the table could be made
+    if engine.dialect.name != "sqlite":
+        return False
+    try:
+        with engine.begin() as connection:
+            for statement in VERSIONS_SCHEMA:
+                connection.execute(text(statement))
+        return True
+    except OperationalError as error:
+        logger.warning("Cache versions not kept in the database, other processes' writes are not seen: %s", error)
+        return False
+
+
+class DatabaseVersions:
+    # reads the cache_version table through one connection kept open, the lookup runs for every cached response
+    # and a checkout from the pool would cost more than the lookup itself
+    def __init__(self, engine):
+        self.engine = engine
+        self._connection = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def versions(self, tags):
+        # (version, modified) of every tag, (0, 0) for a tag never written
+        with self._lock:
+            # a worker forked from a preloaded app (gunicorn --preload) opens its own
+            if self._connection is None or self._pid != os.getpid():
+                self._connection = self.engine.raw_connection()
+                self._pid = os.getpid()
+            try:
+                cursor = self._connection.cursor()
+                rows = [cursor.execute("SELECT version, modified FROM cache_version WHERE tag = ?", (tag,)).fetchone()
+                        for tag in tags]
+                cursor.close()
+            except Exception:
+                self._connection.close()
+                self._connection = None
+                raise
+        return [tuple(row) if row is not None else (0, 0.0) for row in rows]
+
+
+class MemoryBackend:
+    # in-process backend, every worker has its own entries and versions; the versions in the database
+    # (CacheSettings.versions) tell every worker about the writes of the others
+    def __init__(self, maxsize=1024, ttl=300, registry=None):
+        self.entries = TTLCache("responses", maxsize=maxsize, ttl=ttl, registry=registry)
+        self._versions = {}
+        self._started = time.time()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, value):
+        self.entries.set(key, value)
+
+    def version(self, tag):
+        with self._lock:
+            return self._versions.get(tag, (0, self._started))
+
+    def bump(self, tag):
+        with self._lock:
+            version, _ = self._versions.get(tag, (0, self._started))
+            self._versions[tag] = (version + 1, time.time())
+
+
+class RedisBackend:
+    # shared backend, all workers see the same entries and versions;
+    # anything with the redis-py interface (get/set/incr/mget) can stand in for the client
+    def __init__(self, url=None, client=None, ttl=300, prefix="cafes:response:"):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+
+    def version(self, tag):
+        version, modified = self.client.mget(self.prefix + "version:" + tag, self.prefix + "modified:" + tag)
+        if modified is None:
+            # first use of the tag, from now on responses can be compared with this time
+            modified = time.time()
+            self.client.set(self.prefix + "modified:" + tag, modified, nx=True)
+        return int(version or 0), float(modified)
+
+    def bump(self, tag):
+        self.client.incr(self.prefix + "version:" + tag)
+        self.client.set(self.prefix + "modified:" + tag, time.time())
+
+
+class ResponseCache:
+    # caches GET responses and answers conditional requests (ETag / Last-Modified) with 304,
+    # every entry is keyed by the data versions it depends on, so a write just bumps the version;
+    # one object for all apps (the views are decorated at import), init_app() gives every app its own backend
+    def init_app(self, app, backend=None):
+        # RESPONSE_CACHE=0 switches it off, RESPONSE_CACHE_URL=redis://... shares the entries between all workers;
+        # the versions kept in the database are added by use_database_versions() once the tables are known
+        if backend is None:
+            ttl = int(os.environ.get("RESPONSE_CACHE_TTL", 300))
+            if os.environ.get("RESPONSE_CACHE_URL"):
+                backend = RedisBackend(os.environ["RESPONSE_CACHE_URL"], ttl=ttl)
+            else:
+                backend = MemoryBackend(maxsize=int(os.environ.get("RESPONSE_CACHE_SIZE", 1024)), ttl=ttl,
+                                        registry=app_caches(app))
+        app.extensions["response_cache"] = CacheSettings(backend, os.environ.get("RESPONSE_CACHE", "1") != "0", None)
+
+    @staticmethod
+    def use_database_versions(app, engine):
+        # the versions of the cache_version table read through engine (the read engine of the app), None: not kept
+        settings = app.extensions["response_cache"]
+        app.extensions["response_cache"] = settings._replace(
+            versions=DatabaseVersions(engine) if engine is not None else None)
+
+    @property
+    def backend(self):
+        return current_app.extensions["response_cache"].backend
+
+    @property
+    def enabled(self):
+        return current_app.extensions["response_cache"].enabled
+
+    def versions(self, cafe_id=None):
+        # (key part, last modified) of the data a response depends on
+        settings = current_app.extensions["response_cache"]
+        tags = [ALL_CAFES] if cafe_id is None else [f"cafe:{cafe_id}"]
+        # the local versions stay part of the key, prices waiting in the price buffer bump only them
+        state = [settings.backend.version(tag) for tag in tags]
+        if settings.versions is not None:
+            state += settings.versions.versions(tags)
+        key = ".".join(str(version) for version, modified in state)
+        return key, max(modified for version, modified in state)
+
+    def invalidate(self, cafe_ids=(), lists=True):
+        # called after every committed write, lists always change, the cafe pages only for the given ids;
+        # lists=False for changes only the cafe pages show yet (prices waiting in the write_buffer.PriceBuffer)
+        if lists:
+            self.backend.bump(ALL_CAFES)
+        for cafe_id in set(cafe_ids):
+            self.backend.bump(f"cafe:{cafe_id}")
+
+    def fragment(self, name, build):
+        # cached piece of a page (e.g. the rendered map), valid until the next write
+        if not self.enabled:
+            return build()
+        version_key, modified = self.versions()
+        key = f"fragment:{name}:{version_key}"
+        value = self.backend.get(key)
+        if value is None:
+            value = build()
+            self.backend.set(key, value)
+        return value
+
+    def cached(self, cafe_arg=None, per_session=False, negotiate=None):
+        # cafe_arg: name of the view argument with the cafe id, the response then depends on that cafe only;
+        # per_session: the page contains a form with the CSRF token of the session, so its body is not
+        # shared between users, only the 304 revalidation for the same session is done;
+        # negotiate: function returning the format the view answers in, for views choosing it by the Accept
+        # header, the format becomes part of the key and ETag and the responses say Vary: Accept
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or request.method != "GET" or session.get("_flashes"):
+                    return self._vary(view(*args, **kwargs), negotiate)
+
+                version_key, modified = self.versions(kwargs.get(cafe_arg) if cafe_arg else None)
+                key = f"{request.full_path}:{version_key}"
+                if negotiate is not None:
+                    key += f":{negotiate()}"
+                if per_session:
+                    # the CSRF token in the page expires, so a kept page is valid for half an hour at most
+                    key += f":{session.get('csrf_token')}:{int(time.time() // SESSION_PAGE_LIFETIME)}"
+                etag = hashlib.sha1(key.encode()).hexdigest()
+
+                not_modified = request.if_none_match.contains(etag)
+                if not per_session and not request.if_none_match and request.if_modified_since is not None:
+                    not_modified = int(modified) <= request.if_modified_since.timestamp()
+                if not_modified:
+                    response = make_response("", 304)
+                    return self._vary(self._validators(response, etag, modified), negotiate)
+
+                entry = None if per_session else self.backend.get(key)
+                if entry is not None:
+                    response = make_response(entry["body"], entry["status"])
+                    response.mimetype = entry["mimetype"]
+                    return self._vary(self._validators(response, etag, modified), negotiate)
+
+                response = self._vary(view(*args, **kwargs), negotiate)
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                if not per_session:
+                    self.backend.set(key, {"body": response.get_data(as_text=True),
+                                           "status": response.status_code, "mimetype": response.mimetype})
+                return self._validators(response, etag, modified)
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def _vary(response, negotiate):
+        response = make_response(response)
+        if negotiate is not None:
+            response.vary.add("Accept")
+        return response
+
+    def _validators(self, response, etag, modified):
+        response.set_etag(etag)
+        response.headers["Last-Modified"] = http_date(modified)
+        # clients may keep the response but have to revalidate it, which is cheap now
+        response.headers["Cache-Control"] = "no-cache"
+        return response
@@ -0,0 +1,52 @@
+import logging
+import threading
+
+from models import db, init_amenity_column, init_place_id_column
+from spatial import init_spatial_index, init_geohash_column
+from fulltext import init_fulltext_index
+from response_cache import init_cache_versions, ResponseCache
+
+
+logger = logging.getLogger(__name__)
+
+_detect_lock = threading.Lock()
+
+
+def init_schema(engine):
+    # tables, R*Tree, geohash, amenity and place id columns, the full text index and the cache versions, whatever
+    # is missing is created and filled from the existing rows, safe to run again; done once per database by
+    # "flask --app main init-db" (python main.py runs it before starting), the workers never change the schema
+    db.metadata.create_all(engine)
+    init_spatial_index(engine)
+    init_geohash_column(engine)
+    init_amenity_column(engine)
+    init_place_id_column(engine)
+    init_fulltext_index(engine)
+    init_cache_versions(engine)
+
+
+def detect_indexes(app, engine):
+    # tells spatial.py, fulltext.py and the response cache which of their tables init_schema() could make in the
+    # database of the app, by one read of sqlite_master and without changing anything; kept in app.extensions, every
+    # app has its own database; without the tables they fall back to plain SQL
+    tables = set()
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as connection:
+            tables = set(connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'table'").scalars())
+        if "cafe" not in tables:
+            logger.warning("The database has no cafe table, run: flask --app main init-db")
+        elif "cache_version" not in tables:
+            logger.warning("The database keeps no cache versions, writes of other processes are not seen by the "
+                           "response cache, run: flask --app main init-db")
+    app.extensions["spatial_index"] = "cafe_rtree" in tables
+    app.extensions["fulltext_index"] = "cafe_fts" in tables
+    ResponseCache.use_database_versions(app, engine if "cache_version" in tables else None)
+
+
+def detect_indexes_once(app, engine):
+    # the first request of a worker (of every app it runs) does it, importing the app does not touch the database
+    if "spatial_index" in app.extensions:
+        return
+    with _detect_lock:
+        if "spatial_index" not in app.extensions:
+            detect_indexes(app, engine)
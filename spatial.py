@@ -0,0 +1,171 @@
+import logging
+import math
+
+from flask import current_app, has_app_context
+from sqlalchemy import Table, Column, Integer, Float, MetaData, and_, or_, select, text, inspect
+from sqlalchemy.exc import OperationalError
+
+from models import Cafe
+from geo import cafe_geohash, precision_for_radius, neighbour_cells, haversine_m, METERS_PER_DEGREE
+
+
+logger = logging.getLogger(__name__)
+
+# SQLite R*Tree virtual table with one (degenerate) box per cafe, kept in sync with the cafe table by triggers.
+# It has its own metadata so db.create_all() never tries to create it as an ordinary table.
+cafe_rtree = Table(
+    "cafe_rtree", MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("min_lat", Float),
+    Column("max_lat", Float),
+    Column("min_lon", Float),
+    Column("max_lon", Float),
+)
+
+RTREE_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS cafe_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)",
+    """CREATE TRIGGER IF NOT EXISTS cafe_rtree_insert AFTER INSERT ON cafe
+       WHEN NEW.lat IS NOT NULL AND NEW.lon IS NOT NULL
+       BEGIN
+           INSERT OR REPLACE INTO cafe_rtree (id, min_lat, max_lat, min_lon, max_lon)
+           VALUES (NEW.id, NEW.lat, NEW.lat, NEW.lon, NEW.lon);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS cafe_rtree_update AFTER UPDATE OF id, lat, lon ON cafe
+       BEGIN
+           DELETE FROM cafe_rtree WHERE id = OLD.id;
+           INSERT INTO cafe_rtree (id, min_lat, max_lat, min_lon, max_lon)
+           SELECT NEW.id, NEW.lat, NEW.lat, NEW.lon, NEW.lon WHERE NEW.lat IS NOT NULL AND NEW.lon IS NOT NULL;
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS cafe_rtree_delete AFTER DELETE ON cafe
+       BEGIN
+           DELETE FROM cafe_rtree WHERE id = OLD.id;
+       END""",
+]
+
+
+def init_spatial_index(engine):
+    # idempotent, safe to run on every start; True when the R*Tree could be made
+    with engine.begin() as connection:
+        connection.execute(text("CREATE INDEX IF NOT EXISTS ix_cafe_lat_lon ON cafe (lat, lon)"))
+
+    if engine.dialect.name != "sqlite":
+        return False
+    try:
+        with engine.begin() as connection:
+            for statement in RTREE_SCHEMA:
+                connection.execute(text(statement))
+            # fill the index for rows inserted before the triggers existed (or by a tool that dropped them)
+            indexed = connection.execute(text("SELECT count(*) FROM cafe_rtree")).scalar()
+            located = connection.execute(
+                text("SELECT count(*) FROM cafe WHERE lat IS NOT NULL AND lon IS NOT NULL")).scalar()
+            if indexed != located:
+                connection.execute(text("DELETE FROM cafe_rtree"))
+                connection.execute(text(
+                    "INSERT INTO cafe_rtree (id, min_lat, max_lat, min_lon, max_lon) "
+                    "SELECT id, lat, lat, lon, lon FROM cafe WHERE lat IS NOT NULL AND lon IS NOT NULL"))
+        return True
+    except OperationalError as error:
+        logger.warning("SQLite R*Tree module not available, using the lat/lon index only: %s", error)
+        return False
+
+
+def rtree_available():
+    # whether the current app's database has the R*Tree, app.extensions["spatial_index"] set by
+    # schema.detect_indexes(); without it the composite lat/lon index is used, scripts pass rtree= themselves
+    return has_app_context() and current_app.extensions.get("spatial_index", False)
+
+
+def init_geohash_column(engine, batch_size=10000):
+    # migration of DBs made before the geohash column existed, then fills the rows without a geohash
+    # (written by something else than SQLAlchemy); idempotent, safe to run on every start
+    columns = {column["name"] for column in inspect(engine).get_columns("cafe")}
+    with engine.begin() as connection:
+        if "geohash" not in columns:
+            connection.execute(text("ALTER TABLE cafe ADD COLUMN geohash VARCHAR(12)"))
+        connection.execute(text("CREATE INDEX IF NOT EXISTS ix_cafe_geohash ON cafe (geohash)"))
+
+    with engine.begin() as connection:
+        missing = connection.execute(text("SELECT id, lat, lon FROM cafe WHERE geohash IS NULL"
+                                          " AND lat IS NOT NULL AND lon IS NOT NULL")).all()
+        update = text("UPDATE cafe SET geohash = :geohash WHERE id = :id")
+        for start in range(0, len(missing), batch_size):
+            connection.execute(update, [{"id": cafe_id, "geohash": cafe_geohash(lat, lon)}
+                                        for cafe_id, lat, lon in missing[start:start + batch_size]])
+    if missing:
+        logger.info("Geohash filled for %s cafes", len(missing))
+
+
+def nearby_condition(lat, lon, radius_m):
+    # where clause for the cafes in the geohash cells around the point, a superset of the circle;
+    # every cell is a range of the geohash index, together with a lat/lon box around the circle
+    precision = precision_for_radius(lat, radius_m)
+    cells = neighbour_cells(lat, lon, precision)
+    # "{" follows "z", the last geohash character, so the range holds exactly the hashes with the prefix
+    in_cells = or_(*[and_(Cafe.geohash >= cell, Cafe.geohash < cell + "{") for cell in cells])
+    lat_delta = radius_m / METERS_PER_DEGREE
+    lon_delta = lat_delta / max(math.cos(math.radians(min(abs(lat), 89.9))), 1e-6)
+    in_box = Cafe.lat.between(lat - lat_delta, lat + lat_delta)
+    if lon_delta < 180:
+        in_box = and_(in_box, or_(*[Cafe.lon.between(low, high) for low, high in _lon_ranges(
+            (lon - lon_delta + 180) % 360 - 180, (lon + lon_delta + 180) % 360 - 180)]))
+    return and_(in_cells, in_box)
+
+
+def rank_by_distance(lat, lon, radius_m, cafes, limit):
+    # (distance in meters, cafe) of the cafes inside the circle, nearest first
+    ranked = []
+    for cafe in cafes:
+        distance = haversine_m(lat, lon, cafe.lat, cafe.lon)
+        if distance <= radius_m:
+            ranked.append((distance, cafe))
+    ranked.sort(key=lambda pair: pair[0])
+    return ranked[:limit]
+
+
+def _lon_ranges(lon_min, lon_max):
+    # a viewport crossing the antimeridian comes with lon_min > lon_max (e.g. 170 .. -170)
+    if lon_min <= lon_max:
+        return [(lon_min, lon_max)]
+    return [(lon_min, 180), (-180, lon_max)]
+
+
+def bounds_condition(lat_min, lat_max, lon_min, lon_max, rtree=None):
+    # where clause for cafes strictly inside the box, same semantics as the old text() condition;
+    # rtree=None uses the R*Tree when the current app has it
+    lat_min, lat_max, lon_min, lon_max = float(lat_min), float(lat_max), float(lon_min), float(lon_max)
+    lon_ranges = _lon_ranges(lon_min, lon_max)
+
+    exact = and_(Cafe.lat > lat_min, Cafe.lat < lat_max,
+                 or_(*[and_(Cafe.lon > low, Cafe.lon < high) for low, high in lon_ranges]))
+    if not (rtree_available() if rtree is None else rtree):
+        return exact
+
+    # the R*Tree stores 32 bit floats rounded outwards, so it only narrows the candidates and
+    # the exact comparison above still decides about the cafes on the edge
+    in_tree = select(cafe_rtree.c.id).where(
+        cafe_rtree.c.max_lat >= lat_min, cafe_rtree.c.min_lat <= lat_max,
+        or_(*[and_(cafe_rtree.c.max_lon >= low, cafe_rtree.c.min_lon <= high) for low, high in lon_ranges]))
+    return and_(Cafe.id.in_(in_tree), exact)
+
+
+def tile_condition(south, north, west, east, rtree=None):
+    # where clause for the cafes of one map tile: the south and west edges belong to the tile, the north and east
+    # ones to the next tile (the edges of the world to the last one), so every cafe is in exactly one tile of a zoom
+    below_north = Cafe.lat <= north if north >= 90 else Cafe.lat < north
+    before_east = Cafe.lon <= east if east >= 180 else Cafe.lon < east
+    exact = and_(Cafe.lat >= south, below_north, Cafe.lon >= west, before_east)
+    if not (rtree_available() if rtree is None else rtree):
+        return exact
+    in_tree = select(cafe_rtree.c.id).where(
+        cafe_rtree.c.max_lat >= south, cafe_rtree.c.min_lat <= north,
+        cafe_rtree.c.max_lon >= west, cafe_rtree.c.min_lon <= east)
+    return and_(Cafe.id.in_(in_tree), exact)
+
+
+def merge_results(*result_lists):
+    # union of several query results, keeps the first occurrence order
+    merged = {}
+    for results in result_lists:
+        for cafe in results:
+            merged.setdefault(cafe.id, cafe)
+    return list(merged.values())
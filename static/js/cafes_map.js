@@ -0,0 +1,127 @@
+// Map of cafes drawn from the compact data of /api/map (see map_payload() in cafe_map.py), the page itself is rendered
+// without markers. The data is fetched while the Google Maps script loads, the infobox of a cafe is loaded when
+// its marker is clicked and the cafes of a cluster when the user asks for them.
+// The markers and infoboxes are shared with the viewport loading of the landing page (index.js).
+var cafesMapElement = document.getElementById("cafes_map");
+var cafesMapData = loadCafesMapData();
+var cafesMap = null;
+var cafesMapMarkers = [];
+var cafesInfoWindow = null;
+
+function loadCafesMapData() {
+  // search results come inlined in the page, the map of all cafes from its own cacheable url,
+  // nothing for the viewport loading
+  const inlined = document.getElementById("cafes_map_data");
+  if (inlined) {
+    return Promise.resolve(JSON.parse(inlined.textContent));
+  }
+  if (!cafesMapElement.dataset.url) {
+    return null;
+  }
+  return fetch(cafesMapElement.dataset.url).then((response) => response.json());
+}
+
+function showInfo(marker, content) {
+  if (!cafesInfoWindow) {
+    cafesInfoWindow = new google.maps.InfoWindow();
+  }
+  cafesInfoWindow.setContent(content);
+  cafesInfoWindow.open(cafesMap, marker);
+}
+
+function addCafeMarker(id, lat, lng) {
+  const marker = new google.maps.Marker({
+    position: { lat: lat, lng: lng },
+    map: cafesMap,
+    icon: cafesMapElement.dataset.cafeIcon,
+  });
+  marker.addListener("click", () => {
+    fetch(cafesMapElement.dataset.infoboxUrl + id)
+      .then((response) => response.text())
+      .then((html) => showInfo(marker, html));
+  });
+  return marker;
+}
+
+function addClusterMarker(lat, lng, count, url) {
+  const marker = new google.maps.Marker({
+    position: { lat: lat, lng: lng },
+    map: cafesMap,
+    icon: cafesMapElement.dataset.clusterIcon,
+    label: String(count),
+  });
+  marker.addListener("click", () => {
+    const content = document.createElement("div");
+    const title = document.createElement("h6");
+    title.textContent = count + " cafes";
+    const link = document.createElement("a");
+    link.href = "#";
+    link.textContent = "Show them";
+    link.addEventListener("click", (event) => {
+      event.preventDefault();
+      expandCluster(url, lat, lng);
+    });
+    content.append(title, link);
+    showInfo(marker, content);
+  });
+  return marker;
+}
+
+// also called from the infoboxes of the smaller clusters /api/cluster/<key> answers with
+function expandCluster(url, lat, lng) {
+  fetch(url)
+    .then((response) => response.json())
+    .then((data) => {
+      // the cluster marker itself is replaced by its cafes
+      cafesMapMarkers.forEach((marker) => {
+        const position = marker.getPosition();
+        if (marker.getLabel() && Math.abs(position.lat() - lat) < 1e-6 && Math.abs(position.lng() - lng) < 1e-6) {
+          marker.setMap(null);
+        }
+      });
+
+      const bounds = new google.maps.LatLngBounds();
+      data.markers.forEach((raw) => {
+        const marker = new google.maps.Marker({
+          position: new google.maps.LatLng(raw.lat, raw.lng),
+          map: cafesMap,
+          icon: raw.icon,
+          label: raw.label ? raw.label : null,
+        });
+        cafesMapMarkers.push(marker);
+        if (raw.infobox) {
+          marker.addListener("click", () => showInfo(marker, raw.infobox));
+        }
+        bounds.extend(marker.getPosition());
+      });
+      if (data.markers.length) {
+        cafesMap.fitBounds(bounds);
+      }
+    });
+}
+
+function createCafesMap() {
+  cafesMap = new google.maps.Map(cafesMapElement, {
+    center: { lat: 50, lng: 10 },
+    zoom: 3,
+    mapTypeControl: false,
+  });
+}
+
+function fitCafesBounds(bounds, pointZoom) {
+  if (bounds && bounds.south === bounds.north && bounds.west === bounds.east) {
+    // one place only, fitting it would zoom in as far as the map goes
+    cafesMap.setCenter({ lat: bounds.south, lng: bounds.west });
+    cafesMap.setZoom(pointZoom);
+  } else if (bounds) {
+    cafesMap.fitBounds(bounds);
+  }
+}
+
+async function initCafesMap() {
+  createCafesMap();
+  const data = await cafesMapData;
+  fitCafesBounds(data.bounds, 15);
+  data.ids.forEach((id, i) => cafesMapMarkers.push(addCafeMarker(id, data.lats[i], data.lngs[i])));
+  data.clusters.forEach(([lat, lng, count, url]) => cafesMapMarkers.push(addClusterMarker(lat, lng, count, url)));
+}
@@ -1,33 +1,116 @@
-async function initMap() {
-  // Request needed libraries.
-  const { Map } = await google.maps.importLibrary("maps");
-  const myLatlng = { lat: -25.363, lng: 131.044 };
-  const map = new google.maps.Map(document.getElementById("map"), {
-    zoom: 4,
-    center: myLatlng,
+// Viewport loading of the map of all cafes (landing page): after every pan or zoom, debounced, the map asks
+// /api/tiles/<zoom>/<row>/<column> for the tiles it shows, so the page stays the same for a hundred or a million
+// cafes. Tiles are squares of the lat/lon grid, the same as clustering.tile_bounds() on the server; a tile is always
+// the same url, the browser revalidates it with its ETag. Markers and infoboxes come from cafes_map.js.
+const TILE_DEBOUNCE_MS = 250;
+const MAX_TILE_ZOOM = 21;
+// answers of tiles out of the view kept for panning back
+const TILES_KEPT = 256;
+var tileAnswers = new Map();
+var tileMarkers = new Map();
+var visibleTileKeys = new Set();
+var tileTimer = null;
+
+function visibleTiles() {
+  const zoom = Math.max(0, Math.min(MAX_TILE_ZOOM, Math.round(cafesMap.getZoom())));
+  const size = 360 / 2 ** zoom;
+  const bounds = cafesMap.getBounds();
+  const south = bounds.getSouthWest().lat();
+  const north = bounds.getNorthEast().lat();
+  const west = bounds.getSouthWest().lng();
+  const east = bounds.getNorthEast().lng();
+  const rows = Math.ceil(180 / size);
+  const columns = 2 ** zoom;
+
+  const firstRow = Math.max(0, Math.floor((south + 90) / size));
+  const lastRow = Math.min(rows - 1, Math.floor((north + 90) / size));
+  let firstColumn = Math.floor((west + 180) / size);
+  let lastColumn = Math.floor((east + 180) / size);
+  if (lastColumn < firstColumn) {
+    // the view crosses the antimeridian
+    lastColumn += columns;
+  }
+  if (lastColumn - firstColumn >= columns) {
+    firstColumn = 0;
+    lastColumn = columns - 1;
+  }
+  const keys = [];
+  for (let row = firstRow; row <= lastRow; row++) {
+    for (let column = firstColumn; column <= lastColumn; column++) {
+      keys.push(zoom + "/" + row + "/" + (column % columns));
+    }
+  }
+  return keys;
+}
+
+function addZoomCluster(lat, lng, count, south, west, north, east) {
+  // a cluster of a tile, clicking it zooms into its cafes, the next tiles split it up
+  const marker = new google.maps.Marker({
+    position: { lat: lat, lng: lng },
+    map: cafesMap,
+    icon: cafesMapElement.dataset.clusterIcon,
+    label: String(count),
   });
-  // Create the initial InfoWindow.
-  let infoWindow = new google.maps.InfoWindow({
-    content: "Click the map to get Lat/Lng!",
-    position: myLatlng,
+  marker.addListener("click", () => {
+    fitCafesBounds({ south: south, west: west, north: north, east: east }, cafesMap.getZoom() + 2);
   });
+  return marker;
+}
 
-infoWindow.open(map);
+function drawTile(key, tile) {
+  const markers = [];
+  tile.ids.forEach((id, i) => markers.push(addCafeMarker(id, tile.lats[i], tile.lngs[i])));
+  tile.clusters.forEach(([lat, lng, count, south, west, north, east]) =>
+    markers.push(addZoomCluster(lat, lng, count, south, west, north, east)));
+  tileMarkers.set(key, markers);
+}
 
-  // Configure the click listener.
-  map.addListener("click", (mapsMouseEvent) => {
-    // Close the current InfoWindow.
-    infoWindow.close();
-    // Create a new InfoWindow.
-    infoWindow = new google.maps.InfoWindow({
-      position: mapsMouseEvent.latLng,
+function loadTile(key) {
+  if (!tileAnswers.has(key)) {
+    const answer = fetch(cafesMapElement.dataset.tilesUrl + key).then((response) => {
+      if (!response.ok) {
+        throw new Error("tile " + key + ": " + response.status);
+      }
+      return response.json();
     });
-    infoWindow.setContent(
-      JSON.stringify(mapsMouseEvent.latLng.toJSON(), null, 2),
-    );
-    infoWindow.open(map);
+    // a failed tile is asked for again with the next view
+    answer.catch(() => tileAnswers.delete(key));
+    tileAnswers.set(key, answer);
+  }
+  tileAnswers.get(key).then((tile) => {
+    // the view may have moved on while the tile was loading
+    if (visibleTileKeys.has(key) && !tileMarkers.has(key)) {
+      drawTile(key, tile);
+    }
+  }, () => {});
+}
+
+function showVisibleTiles() {
+  visibleTileKeys = new Set(visibleTiles());
+  tileMarkers.forEach((markers, key) => {
+    if (!visibleTileKeys.has(key)) {
+      markers.forEach((marker) => marker.setMap(null));
+      tileMarkers.delete(key);
+    }
   });
+  visibleTileKeys.forEach(loadTile);
+  // the oldest answers go first, Map keeps the insertion order
+  for (const key of tileAnswers.keys()) {
+    if (tileAnswers.size <= TILES_KEPT) {
+      break;
+    }
+    if (!visibleTileKeys.has(key)) {
+      tileAnswers.delete(key);
+    }
+  }
 }
 
-initMap();
-console.log("blabla");
+function initCafesViewport() {
+  createCafesMap();
+  fitCafesBounds(JSON.parse(cafesMapElement.dataset.bounds), 15);
+  // "idle" follows every pan and zoom once the map stopped moving
+  cafesMap.addListener("idle", () => {
+    clearTimeout(tileTimer);
+    tileTimer = setTimeout(showVisibleTiles, TILE_DEBOUNCE_MS);
+  });
+}
@@ -0,0 +1,35 @@
+#apps of main.create_app() on throw-away databases, each test sets the env vars the app is created with
+import os
+import sys
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+API_KEY = "test key"
+
+
+@pytest.fixture
+def make_app(tmp_path, monkeypatch):
+    # make_app(INSTRUMENTATION="1", ...) -> a new app on its own database (tmp_path / database, a test may put a
+    # copy there first), init_schema=False leaves a missing file missing; api_only=False adds the pages
+    def make(init_schema=True, api_only=True, database="cafes.db", **env):
+        monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / database}")
+        monkeypatch.setenv("FLASK_APP_SECRET_KEY", generate_password_hash(API_KEY))
+        monkeypatch.setenv("IMAGE_PROXY", "0")
+        for name in ("INSTRUMENTATION", "READ_MODEL", "PRICE_WRITE_BEHIND", "RESPONSE_CACHE", "LOG_LEVEL"):
+            monkeypatch.delenv(name, raising=False)
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        import main
+        from models import db
+        from schema import init_schema as make_schema
+
+        app = main.create_app(api_only=api_only)
+        app.config["WTF_CSRF_ENABLED"] = False
+        if init_schema:
+            with app.app_context():
+                make_schema(db.engine)
+        return app
+    return make
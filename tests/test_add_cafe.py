@@ -0,0 +1,46 @@
+#adding a cafe that is already there, on a copy of instance/cafes.db: its names are unique and most of its cafes
+#have no Google place id
+#run: python -m pytest tests
+import os
+import shutil
+
+from conftest import API_KEY
+
+SHIPPED_DATABASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "instance", "cafes.db")
+
+
+def shipped_app(make_app, tmp_path):
+    shutil.copy(SHIPPED_DATABASE, tmp_path / "cafes.db")
+    app = make_app(api_only=False)
+    from models import db, Cafe
+    with app.app_context():
+        cafe = db.session.execute(db.select(Cafe).where(Cafe.place_id.is_(None)).limit(1)).scalar()
+        return app, cafe.name
+
+
+def new_cafe(name):
+    return {"name": name, "map_url": "https://www.google.com/maps/place/?q=place_id:brandnewplace",
+            "img_url": "https://img.example.com/new.jpg", "location": "Somewhere 1", "seats": "10-20",
+            "coffee_price": "£2.50", "lat": "51.5", "lng": "-0.1"}
+
+
+def test_locate_candidate_with_a_known_name_opens_the_cafe(make_app, tmp_path):
+    app, name = shipped_app(make_app, tmp_path)
+    client = app.test_client()
+    response = client.get("/add", query_string={"name": name, "place_id": "brandnewplace", "lat": 51.5, "lng": -0.1})
+    assert response.status_code == 200
+    assert "Your cafe already exists" in response.get_data(as_text=True)
+
+
+def test_adding_a_known_name_is_no_server_error(make_app, tmp_path):
+    app, name = shipped_app(make_app, tmp_path)
+    client = app.test_client()
+    response = client.post("/add", data=new_cafe(name))
+    assert response.status_code == 200
+    assert "Your cafe already exists" in response.get_data(as_text=True)
+
+    # the API checks the place id first, the unique name is found when the insert fails
+    query = {**new_cafe(name), "lon": "-0.1", "api_key": API_KEY}
+    response = client.post("/api/add", query_string=query)
+    assert response.status_code == 409
+    assert response.json == {"error": {"Conflict": "A cafe with this name already exists."}}
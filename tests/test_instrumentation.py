@@ -0,0 +1,28 @@
+#/metrics and /debug/profile of an app with and without INSTRUMENTATION=1
+#run: python -m pytest tests
+from conftest import API_KEY
+from extensions import instrumentation
+
+
+def test_profile_without_instrumentation_is_not_found(make_app):
+    app = make_app()
+    client = app.test_client()
+    response = client.get("/debug/profile", query_string={"api_key": API_KEY, "seconds": 0.05})
+    assert response.status_code == 404
+    assert client.get("/metrics").status_code == 404
+    with app.app_context():
+        assert not instrumentation.enabled
+        assert instrumentation.metrics_text() == ""
+        assert instrumentation.profile(0.05, 0.01) is None
+
+
+def test_profile_with_instrumentation(make_app):
+    app = make_app(INSTRUMENTATION="1")
+    client = app.test_client()
+    assert client.get("/debug/profile", query_string={"api_key": "wrong", "seconds": 0.05}).status_code == 403
+    response = client.get("/debug/profile", query_string={"api_key": API_KEY, "seconds": 0.05})
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    metrics = client.get("/metrics")
+    assert metrics.status_code == 200
+    assert 'route="/debug/profile"' in metrics.get_data(as_text=True)
@@ -0,0 +1,150 @@
+#circuit breaker of maps_client.MapsClient and AsyncMapsClient against a local stub of Google: closed, open and
+#half-open states, and failures requests/httpx raise while reading the body (a cut short answer)
+#run: python -m pytest tests
+import asyncio
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from maps_client import MapsClient, AsyncMapsClient, CircuitBreaker, MapsUnavailable
+
+
+RESET_TIMEOUT = 0.2
+ANSWER = b'{"status": "OK", "results": []}'
+
+
+class StubGoogle(BaseHTTPRequestHandler):
+    # answers every request with the next of server.answers: "ok", "error" (500) or "cut" (body shorter
+    # than its Content-Length); "ok" when nothing is queued
+    def do_GET(self):
+        self.server.calls += 1
+        answer = self.server.answers.pop(0) if self.server.answers else "ok"
+        if answer == "error":
+            self.send_response(500)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(ANSWER) + (100 if answer == "cut" else 0)))
+        if answer == "cut":
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(ANSWER)
+        if answer == "cut":
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def google():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubGoogle)
+    server.answers = []
+    server.calls = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def sync_client(google, failure_threshold=2):
+    return MapsClient("key", base_url=f"http://127.0.0.1:{google.server_port}", retries=0, backoff=0,
+                      breaker=CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=RESET_TIMEOUT))
+
+
+def async_client(google, failure_threshold=2):
+    return AsyncMapsClient("key", base_url=f"http://127.0.0.1:{google.server_port}", retries=0, backoff=0,
+                           breaker=CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=RESET_TIMEOUT))
+
+
+def test_closed_circuit_lets_calls_through(google):
+    client = sync_client(google)
+    google.answers = ["error", "ok", "error"]
+    with pytest.raises(MapsUnavailable):
+        client.text_search("prague")
+    assert client.text_search("prague")["status"] == "OK"
+    # a success resets the count, one more failure is still below the threshold
+    with pytest.raises(MapsUnavailable):
+        client.text_search("prague")
+    assert client.breaker.state == "closed"
+    assert google.calls == 3
+
+
+def test_open_circuit_refuses_calls(google):
+    client = sync_client(google)
+    google.answers = ["error", "error"]
+    for _ in range(2):
+        with pytest.raises(MapsUnavailable):
+            client.text_search("prague")
+    assert client.breaker.state == "open"
+    with pytest.raises(MapsUnavailable, match="Circuit breaker is open"):
+        client.text_search("prague")
+    assert google.calls == 2
+
+
+def test_half_open_trial_closes_or_reopens(google):
+    client = sync_client(google, failure_threshold=1)
+    google.answers = ["error", "error"]
+    with pytest.raises(MapsUnavailable):
+        client.text_search("prague")
+    time.sleep(RESET_TIMEOUT)
+    assert client.breaker.state == "half-open"
+    # the failed trial opens the circuit again
+    with pytest.raises(MapsUnavailable):
+        client.text_search("prague")
+    assert client.breaker.state == "open"
+    time.sleep(RESET_TIMEOUT)
+    assert client.text_search("prague")["status"] == "OK"
+    assert client.breaker.state == "closed"
+
+
+def test_cut_answer_is_a_failure_and_does_not_block_the_trial(google):
+    client = sync_client(google, failure_threshold=1)
+    google.answers = ["cut", "cut"]
+    with pytest.raises(MapsUnavailable, match="ChunkedEncodingError"):
+        client.text_search("prague")
+    assert client.breaker.state == "open"
+    time.sleep(RESET_TIMEOUT)
+    # the trial fails the same way, the circuit opens again instead of staying half open with the trial taken
+    with pytest.raises(MapsUnavailable):
+        client.text_search("prague")
+    assert client.breaker.state == "open"
+    time.sleep(RESET_TIMEOUT)
+    assert client.text_search("prague")["status"] == "OK"
+    assert client.breaker.state == "closed"
+
+
+def test_async_client_states(google):
+    pytest.importorskip("httpx")
+
+    async def calls():
+        client = async_client(google, failure_threshold=1)
+        google.answers = ["cut", "error"]
+        try:
+            with pytest.raises(MapsUnavailable):
+                await client.text_search("prague")
+            assert client.breaker.state == "open"
+            with pytest.raises(MapsUnavailable, match="Circuit breaker is open"):
+                await client.text_search("prague")
+            await asyncio.sleep(RESET_TIMEOUT)
+            assert client.breaker.state == "half-open"
+            with pytest.raises(MapsUnavailable):
+                await client.text_search("prague")
+            assert client.breaker.state == "open"
+            await asyncio.sleep(RESET_TIMEOUT)
+            assert (await client.text_search("prague"))["status"] == "OK"
+            assert client.breaker.state == "closed"
+        finally:
+            await client.close()
+
+    asyncio.run(calls())
+    assert google.calls == 3
@@ -0,0 +1,35 @@
+#READ_MODEL=1: the app is made without opening the database, the copy of the cafes is built by the first read
+#and follows the writes
+#run: python -m pytest tests
+import os
+
+from conftest import API_KEY
+
+
+def test_app_with_read_model_starts_without_database(make_app, tmp_path):
+    app = make_app(init_schema=False, READ_MODEL="1")
+    assert not os.path.exists(tmp_path / "cafes.db")
+    assert app.extensions["read_model"].tables is None
+
+    result = app.test_cli_runner().invoke(args=["init-db"])
+    assert result.exit_code == 0, result.output
+    client = app.test_client()
+    assert client.get("/api/all").json == []
+    assert client.get("/api/cache-stats").json["read_model"]["cafes"] == 0
+
+
+def test_read_model_follows_writes(make_app):
+    app = make_app(READ_MODEL="1")
+    client = app.test_client()
+    cafe = {"name": "Read Model Cafe", "map_url": "https://www.google.com/maps/place/?q=place_id:read1",
+            "img_url": "https://img.example.com/1.jpg", "location": "Prague", "seats": "10-20", "has_wifi": "1",
+            "coffee_price": "£2.50", "lat": "50.08", "lon": "14.42"}
+    assert client.post("/api/add", query_string=cafe).status_code == 200
+    assert [row["name"] for row in client.get("/api/all").json] == ["Read Model Cafe"]
+    cafe_id = client.get("/api/all").json[0]["id"]
+    assert client.get("/api/tiles/0/0/0").json["ids"] == [cafe_id]
+
+    response = client.delete(f"/api/delete/{cafe_id}", query_string={"api_key": API_KEY})
+    assert response.status_code == 200
+    assert client.get("/api/all").json == []
+    assert app.extensions["read_model"].stats()["cafes"] == 0
@@ -0,0 +1,48 @@
+#the tables schema.detect_indexes() finds (R*Tree, FTS5, cache versions) belong to the database of one app,
+#two apps of one process on different databases do not see each other's
+#run: python -m pytest tests
+import sqlite3
+
+from models import db
+
+CAFE = {"name": "Schema Cafe", "map_url": "https://www.google.com/maps/place/?q=place_id:schema1",
+        "img_url": "https://img.example.com/s.jpg", "location": "Shoreditch, London", "seats": "10-20",
+        "coffee_price": "£2.00", "lat": "51.52", "lon": "-0.08"}
+
+
+def test_apps_keep_their_own_indexes(make_app, tmp_path):
+    full = make_app()
+    # a database with the plain tables only, as made before the indexes existed
+    plain = make_app(init_schema=False, database="plain.db")
+    with plain.app_context():
+        db.create_all()
+    full_client, plain_client = full.test_client(), plain.test_client()
+    for client in (plain_client, full_client):
+        assert client.post("/api/add", query_string=CAFE).status_code == 200
+
+    assert full.extensions["spatial_index"] and full.extensions["fulltext_index"]
+    assert full.extensions["response_cache"].versions is not None
+    assert not plain.extensions["spatial_index"] and not plain.extensions["fulltext_index"]
+    assert plain.extensions["response_cache"].versions is None
+
+    # detected after the plain app, the full one must not make the plain one query tables it does not have
+    for client in (plain_client, full_client):
+        assert [cafe["name"] for cafe in client.get("/api/search", query_string={"loc": "shoreditch"}).json] == \
+            ["Schema Cafe"]
+        assert len(client.get("/api/tiles/0/0/0").json["ids"]) == 1
+
+
+def test_database_versions_see_writes_of_other_processes(make_app, tmp_path):
+    app = make_app()
+    client = app.test_client()
+    assert client.post("/api/add", query_string=CAFE).status_code == 200
+    etag = client.get("/api/all").headers["ETag"]
+    assert client.get("/api/all", headers={"If-None-Match": etag}).status_code == 304
+
+    connection = sqlite3.connect(tmp_path / "cafes.db")
+    with connection:
+        connection.execute("UPDATE cafe SET coffee_price = '£9.00'")
+    connection.close()
+    response = client.get("/api/all", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json[0]["coffee_price"] == "£9.00"
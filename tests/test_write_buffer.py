@@ -0,0 +1,97 @@
+#write_buffer.PriceBuffer: flushed when max_size cafes wait or after interval seconds, the last price of a cafe wins,
+#and a queued price is served before it is written
+#run: python -m pytest tests
+import time
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from write_buffer import PriceBuffer
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'prices.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE cafe (id INTEGER PRIMARY KEY, coffee_price VARCHAR(250))"))
+        connection.execute(text("INSERT INTO cafe (id, coffee_price) VALUES (1, '£1'), (2, '£1'), (3, '£1')"))
+    yield engine
+    engine.dispose()
+
+
+def prices(engine):
+    with engine.connect() as connection:
+        return dict(connection.execute(text("SELECT id, coffee_price FROM cafe")).all())
+
+
+def wait_for(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_flush_when_full(engine):
+    flushed = []
+    buffer = PriceBuffer(max_size=3, interval=60)
+    buffer.bind(engine, on_flush=flushed.append)
+    try:
+        buffer.add(1, "£2")
+        buffer.add(1, "£3")
+        buffer.add(2, "£2")
+        time.sleep(0.1)
+        # two cafes wait, the interval is far away
+        assert prices(engine) == {1: "£1", 2: "£1", 3: "£1"}
+        buffer.add(3, "£2")
+        assert wait_for(lambda: buffer.stats()["flushes"] == 1)
+        assert prices(engine) == {1: "£3", 2: "£2", 3: "£2"}
+        assert sorted(flushed[0]) == [1, 2, 3]
+        assert buffer.stats()["written"] == 3
+    finally:
+        buffer.close()
+
+
+def test_flush_after_interval(engine):
+    buffer = PriceBuffer(max_size=100, interval=0.1)
+    buffer.bind(engine)
+    try:
+        buffer.add(2, "£4")
+        assert wait_for(lambda: buffer.stats()["flushes"] == 1)
+        assert prices(engine)[2] == "£4"
+        assert buffer.pending_price(2) is None
+    finally:
+        buffer.close()
+
+
+def test_close_writes_what_is_left(engine):
+    buffer = PriceBuffer(max_size=100, interval=60)
+    buffer.bind(engine)
+    buffer.add(3, "£5")
+    buffer.close()
+    assert prices(engine)[3] == "£5"
+
+
+def test_queued_price_is_read_before_it_is_written(make_app):
+    app = make_app(PRICE_WRITE_BEHIND="1", PRICE_FLUSH_INTERVAL="60")
+    client = app.test_client()
+    cafe = {"name": "Buffered Cafe", "map_url": "https://www.google.com/maps/place/?q=place_id:buffered1",
+            "img_url": "https://img.example.com/b.jpg", "location": "Prague", "seats": "10-20",
+            "coffee_price": "£2.00", "lat": "50.08", "lon": "14.42"}
+    assert client.post("/api/add", query_string=cafe).status_code == 200
+    cafe_id = client.get("/api/all").json[0]["id"]
+    assert client.get(f"/api/cafe/{cafe_id}").json["coffee_price"] == "£2.00"
+
+    assert client.patch(f"/api/update-price/{cafe_id}", query_string={"coffee_price": "£3.10"}).status_code == 200
+    price_buffer = app.extensions["price_buffer"]
+    assert price_buffer.pending_price(cafe_id) == "£3.10"
+    # the cafe page shows it at once, the cached answer was invalidated
+    assert client.get(f"/api/cafe/{cafe_id}").json["coffee_price"] == "£3.10"
+    # the lists get it with the flush
+    assert client.get("/api/all").json[0]["coffee_price"] == "£2.00"
+
+    assert price_buffer.flush() == 1
+    assert client.get("/api/all").json[0]["coffee_price"] == "£3.10"
+    assert price_buffer.pending_price(cafe_id) is None
+    price_buffer.close()
@@ -0,0 +1,387 @@
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, flash
+from markupsafe import escape
+from werkzeug.security import check_password_hash
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Cafe, MAP_COLUMNS, AMENITIES, mask_for, amenity_filters, place_id_for, known_places
+from spatial import bounds_condition, merge_results
+from fulltext import search_statement, SEARCH_RESULTS_LIMIT
+from extensions import response_cache, read_session, set_coffee_price, coffee_price_of
+from places import (GOOGLE_MAPS_KEY, DEFAULT_PHOTO_URL, places_text_search, candidate_photo_refs,
+                    resolve_photo_urls)
+from cafe_map import map_payload, map_shell, cafes_bounds
+from image_proxy import proxied
+
+
+# the pages of the app; their forms (forms.py, WTForms) and the flask_googlemaps maps are imported by the first
+# page that needs them, Bootstrap and flask_googlemaps are set up when the blueprint is registered,
+# an API only worker (API_ONLY=1) does not load any of them
+web = Blueprint("web", __name__)
+
+
+@web.app_context_processor
+def cafe_helpers():
+    # show_cafe.html shows the price through it, a price still waiting in the price buffer is the current one;
+    # and the photo through our image proxy
+    return {"coffee_price_of": coffee_price_of, "proxied": proxied}
+
+
+@web.record_once
+def init_page_extensions(state):
+    from flask_bootstrap import Bootstrap5
+    from flask_googlemaps import GoogleMaps
+    GoogleMaps(state.app, key=GOOGLE_MAPS_KEY)
+    Bootstrap5(state.app)
+
+
+def get_empty_map():
+    from flask_googlemaps import Map
+    empty_map = Map(
+        identifier="empty_map",
+        lat=50,
+        lng=10,
+        markers=[],
+        style="height:500px;width:100%;margin:0;",
+        zoom=3,
+        maptype_control=False
+
+    )
+    return empty_map
+
+# HTTP GET - Read Record - API
+@web.route("/cafe/<cafe_id>", methods=["GET"])
+@response_cache.cached(cafe_arg="cafe_id")
+def show_cafe(cafe_id):
+    chosen_cafe = read_session.execute(db.select(Cafe).where(Cafe.id == cafe_id)).scalar()
+    if chosen_cafe:
+        return render_template("show_cafe.html", cafe=chosen_cafe)
+    else:
+        flash('Your cafe does not exist')
+        return redirect(url_for('web.search'))
+
+
+
+@web.route("/", methods=["GET", "POST"])
+@web.route("/search", methods=["GET","POST"])
+@response_cache.cached(per_session=True)
+def search():
+
+    from forms import SearchForm
+    search_form = SearchForm()
+
+    if request.method == "GET":
+        # only the page, the browser loads the cafes of the part of the map it shows from /api/tiles;
+        # the bounds need a scan of the table, they are kept until the next write
+        bounds = response_cache.fragment("all-cafes-bounds", cafes_bounds)
+        if bounds:
+            return render_template("search.html", h1="All cafes", form=search_form, **map_shell(tiles_bounds=bounds))
+        else:
+            flash("There is no cafe in the DB, please insert a new one")
+            return redirect(url_for('web.locate'))
+
+    else:
+
+
+
+        if search_form.validate_on_submit():
+
+            place = search_form.location.data
+
+            # the ticked amenities as one indexed mask test
+            wanted = amenity_filters(mask_for(amenity for amenity in AMENITIES if search_form[amenity].data))
+
+            # get the candidates from the information given calling API (or from the cache)
+            results = places_text_search(place)
+            viewport = None
+            if results is not None:
+                try:
+                    viewport = results['results'][0]['geometry']['viewport']
+                except (KeyError, IndexError):
+                    viewport = None
+
+            # only the columns the map needs, no ORM instances
+            by_location = search_statement(place, *wanted, limit=SEARCH_RESULTS_LIMIT).with_only_columns(*MAP_COLUMNS)
+            if viewport is None:
+                cafes = read_session.execute(by_location).all()
+            else:
+                # two separate queries instead of one OR, so the viewport one can use the spatial index
+                in_viewport = db.select(*MAP_COLUMNS).where(
+                    bounds_condition(viewport['southwest']['lat'], viewport['northeast']['lat'],
+                                     viewport['southwest']['lng'], viewport['northeast']['lng']),
+                    *wanted)
+                cafes = merge_results(read_session.execute(in_viewport).all(),
+                                      read_session.execute(by_location).all())
+
+            if not cafes:
+
+                return render_template("search.html", form=search_form, h1 = "Nothing found",map = get_empty_map() )
+            else:
+                #the cafes are known already, their compact map data goes into the page,
+                #clusters expanded later have to use the same amenity filters
+                filters = {amenity: 1 for amenity in AMENITIES if search_form[amenity].data}
+                return render_template("search.html", h1 = "Your cafes", form=search_form,
+                                       **map_shell(map_data=map_payload(cafes, filters)))
+        else:
+            return render_template("search.html", form = search_form, h1 = "Search cafes", map = get_empty_map())
+
+
+@web.route("/locate", methods=["POST", "GET"])
+def locate():
+    from forms import LocateNewCafeForm
+    locate_form = LocateNewCafeForm()
+
+    if locate_form.validate_on_submit():
+
+        markers_list=[] #to create map markers
+        place = locate_form.text_input.data
+        place += "restaurant"
+
+        #get the candidates from the information given calling API (or from the cache)
+        results = places_text_search(place)
+
+        if results is None:
+            flash("There is some issue with getting your cafes, please insert your data manually. ")
+            return redirect(url_for('web.add'))
+        else:
+            try:
+                candidates = results['results']
+            except KeyError:
+                flash("There is some issue with getting your cafes, please insert your data manually. ")
+                return redirect(url_for('web.add'))
+
+            #candidates already in our list are found by one query and need no picture from Google
+            known = known_places(read_session, [candidate.get('place_id') for candidate in candidates])
+
+            #get pictures of all other candidates at once
+            photo_refs = candidate_photo_refs(candidates)
+            photo_urls = resolve_photo_urls([photo_ref for candidate, photo_ref in zip(candidates, photo_refs)
+                                             if photo_ref and candidate.get('place_id') not in known])
+
+            #create markers on the map to confirm the candidate
+            for candidate, photo_ref in zip(candidates, photo_refs):
+                #take name, url, lat, lon, picture and show point on a map
+                #if there is something wrong with getting place picture simply assign some defaul picture
+                response_photo_url = photo_urls.get(photo_ref, DEFAULT_PHOTO_URL)
+
+                try:
+                    if candidate.get('place_id') in known:
+                        cafe_id, img_url = known[candidate['place_id']]
+                        markers_list.append({
+                            'icon': 'http://maps.google.com/mapfiles/ms/icons/green-dot.png',
+                            'lat': candidate['geometry']['location']['lat'],
+                            'lng': candidate['geometry']['location']['lng'],
+                            'infobox': f"<h5> {escape(candidate['name'])} </h5> <br /> <a href='{url_for('web.show_cafe', cafe_id=cafe_id)}'>"
+                                       f"<h6>Already in our list</h6> </a> <br/><img src='{escape(proxied(img_url, 200))}' width='200px'/>",
+                        })
+                        continue
+
+                    add_url = url_for('web.add', lat=candidate['geometry']['location']['lat'],
+                                      place_id=candidate['place_id'], lng=candidate['geometry']['location']['lng'],
+                                      photo_url=response_photo_url, name=candidate['name'],
+                                      address=candidate['formatted_address'])
+                    candidate_marker = {
+                        'icon': 'http://maps.google.com/mapfiles/ms/icons/red-dot.png',
+                        'lat': candidate['geometry']['location']['lat'],
+                        'lng': candidate['geometry']['location']['lng'],
+                        #the names and addresses come from Google, url_for() encodes them into the link and escape() keeps
+                        #them from breaking the infobox html
+                        'infobox': f"<h5> {escape(candidate['name'])} </h5> <br /> <a href='{escape(add_url)}'>"
+                                   f"<h6>Choose this cafe</h6> </a> <br/><img src='{escape(proxied(response_photo_url, 200))}' width='200px'/>",
+                    }
+
+                    markers_list.append(candidate_marker)
+
+
+                except KeyError:
+                    flash("There is some issue with getting your suggestions, please insert your data manually. ")
+                    return redirect(url_for('web.add'))
+
+            try:
+                lat = markers_list[0]['lat']
+                lon = markers_list[0]['lng']
+            except:
+                lat = 51
+                lon = 0
+
+
+
+            from flask_googlemaps import Map
+            map = Map(
+                identifier="located_points_map",
+                lat=lat,
+                lng=lon,
+                markers=markers_list,
+                style="height:500px;width:100%;margin:0;",
+                zoom=13
+            )
+
+            #return rendered map and submit button to submit new_cafe_form
+            return render_template("search.html", h1="Confirm cafe", map = map, form=locate_form)
+
+
+    else:
+        map = get_empty_map()
+        return render_template("search.html", form=locate_form, h1="Add a new cafe", map=map)
+
+def existing_cafe(place_id, name):
+    # the cafe a new one would repeat: the same Google place (one lookup on the unique place_id index) or the same
+    # name, unique in databases made before the place ids (instance/cafes.db)
+    duplicate = Cafe.name == name
+    if place_id:
+        duplicate = or_(Cafe.place_id == place_id, duplicate)
+    return db.session.execute(db.select(Cafe).where(duplicate).limit(1)).scalar()
+
+
+@web.route("/add", methods=["POST", "GET"])
+def add():
+
+    from forms import CafeForm
+    new_cafe_form = CafeForm()
+    if request.method == 'GET':
+
+        if request.args.get("name"):
+            new_cafe_form.name.data = request.args.get("name")
+            chosen_cafe = existing_cafe(request.args.get("place_id"), new_cafe_form.name.data)
+            if chosen_cafe:
+                flash("Your cafe already exists, wellcome at its page")
+                return render_template("show_cafe.html", cafe=chosen_cafe)
+
+        if request.args.get("place_id"):
+            new_cafe_form.map_url.data = f"https://www.google.com/maps/place/?q=place_id:{request.args.get('place_id')}"
+        if request.args.get("lat"):
+            new_cafe_form.lat.data = float(request.args.get("lat"))
+        if request.args.get("lng"):
+            new_cafe_form.lng.data = float(request.args.get("lng"))
+        if request.args.get("photo_url"):
+            new_cafe_form.img_url.data= request.args.get("photo_url")
+        if request.args.get("address"):
+            new_cafe_form.location.data = request.args.get("address")
+
+    if request.method == 'POST':
+        try:
+            new_cafe_form.lat.data = float(new_cafe_form.lat.data)
+            new_cafe_form.lng.data = float(new_cafe_form.lng.data)
+        except:
+            flash("Please stay somewhere on the Earth, insert valid latitude and longtitude")
+            return render_template("add_new_cafe.html", form=new_cafe_form)
+
+
+    if new_cafe_form.validate_on_submit():
+
+        try:
+            lat = float(new_cafe_form.lat.data)
+            lon = float(new_cafe_form.lng.data)
+        except:
+            flash("Please stay somewhere on the Earth, insert valid latitude and longtitude")
+            return render_template("add_new_cafe.html", form=new_cafe_form)
+
+
+        if not (lat >= -90 and lat <= 90 and lon >= -180 and lon <= 180):
+            flash("Please stay somewhere on the Earth, insert valid latitude and longtitude")
+            return render_template("add_new_cafe.html", form = new_cafe_form)
+        else:
+            try:
+                new_cafe = Cafe(
+                    name=new_cafe_form.name.data,
+                    map_url=new_cafe_form.map_url.data,
+                    img_url=new_cafe_form.img_url.data,
+                    location=new_cafe_form.location.data,
+                    seats=new_cafe_form.seats.data,
+                    has_wifi=new_cafe_form.has_wifi.data,
+                    has_toilet = new_cafe_form.has_toilet.data,
+                    has_sockets = new_cafe_form.has_sockets.data,
+                    can_take_calls =new_cafe_form.can_take_calls.data,
+                    coffee_price = new_cafe_form.coffee_price.data,
+                    lat = lat,
+                    lon = lon
+
+                )
+
+            except KeyError:
+                flash("Something went wrong during inserting into the DB, please try again.")
+                return render_template("add_new_cafe.html", form = new_cafe_form)
+            except:
+                flash("Do not understand you, please start again and do not cheat.")
+                return redirect(url_for("web.add"))
+            else:
+                place_id = place_id_for(new_cafe.map_url)
+                chosen_cafe = existing_cafe(place_id, new_cafe.name)
+                if chosen_cafe:
+                    flash("Your cafe already exists, wellcome at its page")
+                    return render_template("show_cafe.html", cafe=chosen_cafe)
+
+                with current_app.app_context():
+                    db.session.add(new_cafe)
+                    try:
+                        db.session.commit()
+                    except IntegrityError:
+                        # added by someone else since the check above, other errors are not about the cafe
+                        db.session.rollback()
+                        chosen_cafe = existing_cafe(place_id, new_cafe.name)
+                        if not chosen_cafe:
+                            raise
+                        flash("Your cafe already exists, wellcome at its page")
+                        return render_template("show_cafe.html", cafe=chosen_cafe)
+                    return render_template("show_cafe.html", cafe=new_cafe)
+
+    return render_template("add_new_cafe.html", form=new_cafe_form, h1="Add a new cafe!")
+
+# Web page update price
+@web.route("/update-price/<cafe_id>", methods=["POST", "GET"])
+def update_price(cafe_id):
+    from forms import PriceUpdateForm
+    price_update_form = PriceUpdateForm()
+    cafe = db.session.execute(db.select(Cafe).where(Cafe.id == cafe_id)).scalar()
+    if cafe:
+        if price_update_form.validate_on_submit():
+            new_coffee_price = price_update_form.coffee_price.data
+            set_coffee_price(cafe, new_coffee_price)
+            return render_template('show_cafe.html', cafe = cafe)
+
+        else:
+            price_update_form.coffee_price.data = coffee_price_of(cafe)
+            return render_template('show_cafe.html', cafe = cafe, price_update_form = price_update_form)
+    else:
+        flash('Cafe does not exists')
+        return redirect(url_for('web.search'))
+
+
+
+# HTTP DELETE - Delete Record
+
+@web.route("/delete/<cafe_id>", methods=["POST", "GET"])
+def delete(cafe_id):
+    from forms import DeleteConfirmationForm
+    delete_form = DeleteConfirmationForm()
+
+    cafe = db.session.execute(db.select(Cafe).where(Cafe.id == cafe_id)).scalar()
+    if cafe:
+        if delete_form.validate_on_submit():
+            api_key = delete_form.delete_key.data
+
+            if check_password_hash(current_app.secret_key,api_key):
+
+                db.session.delete(cafe)
+                db.session.commit()
+                flash("Successfully deleted.")
+                return redirect(url_for('web.search'))
+            else:
+                flash("Your key is not correct.")
+                return render_template('show_cafe.html', cafe=cafe, delete_form=delete_form)
+
+        else:
+            return render_template('show_cafe.html', cafe=cafe, delete_form=delete_form)
+    else:
+        return redirect(url_for('web.search'))
+
+@web.route("/api-doc")
+def apidoc():
+    return render_template("api_doc.html")
+
+@web.app_errorhandler(404)
+# inbuilt function which takes error as parameter
+def not_found(e):
+    # defining function
+
+    return redirect(url_for('web.search'))
@@ -0,0 +1,119 @@
+import atexit
+import logging
+import os
+import threading
+
+from sqlalchemy import text
+
+
+logger = logging.getLogger(__name__)
+
+
+class PriceBuffer:
+    # write-behind queue of coffee price updates: the last price per cafe wins and a background thread writes all of
+    # them in one transaction once max_size cafes are waiting or interval seconds passed, instead of one SQLite write
+    # transaction (and lock of the whole file) per update; the prices waiting here are served by pending_price(),
+    # so the worker that took an update shows it at once, other workers after the flush
+    def __init__(self, max_size=200, interval=1.0):
+        self.max_size = max_size
+        self.interval = interval
+        self.engine = None
+        self.on_flush = None
+        self._pending = {}
+        # taken by the running flush, still served by pending_price() until they are committed
+        self._flushing = {}
+        self._lock = threading.Lock()
+        # one flush at a time, the worker and flush() on shutdown
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._worker = None
+        self._worker_pid = None
+        self._stopped = False
+        self.queued = 0
+        self.written = 0
+        self.flushes = 0
+        self.failures = 0
+
+    def bind(self, engine, on_flush=None):
+        # on_flush(cafe_ids) runs after every committed flush, the writes are Core statements without ORM events
+        if self.engine is None:
+            atexit.register(self.close)
+        self.engine = engine
+        self.on_flush = on_flush
+
+    def add(self, cafe_id, coffee_price):
+        with self._lock:
+            self._pending[cafe_id] = coffee_price
+            self.queued += 1
+            full = len(self._pending) >= self.max_size
+        self._start_worker()
+        if full:
+            self._wake.set()
+
+    def pending_price(self, cafe_id):
+        # the price of the cafe not yet in the database, None when there is none
+        with self._lock:
+            if cafe_id in self._pending:
+                return self._pending[cafe_id]
+            return self._flushing.get(cafe_id)
+
+    def _start_worker(self):
+        # started by the first update, a worker forked from a preloaded app (gunicorn --preload) starts its own
+        if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or self._worker_pid != os.getpid() or not self._worker.is_alive():
+                self._worker_pid = os.getpid()
+                self._worker = threading.Thread(target=self._run, name="price-flush", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        # writes everything waiting in one transaction, returns the number of cafes written;
+        # after a failure the prices go back to the queue unless a newer one came meanwhile
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._flushing, self._pending = self._pending, {}
+            prices = [{"id": cafe_id, "coffee_price": price} for cafe_id, price in self._flushing.items()]
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(text("UPDATE cafe SET coffee_price = :coffee_price WHERE id = :id"), prices)
+            except Exception:
+                logger.exception("Writing %s coffee prices failed, they are tried again", len(prices))
+                with self._lock:
+                    self._pending = {**self._flushing, **self._pending}
+                    self._flushing = {}
+                    self.failures += 1
+                return 0
+            cafe_ids = list(self._flushing)
+            if self.on_flush is not None:
+                try:
+                    self.on_flush(cafe_ids)
+                except Exception:
+                    logger.exception("Refreshing after %s coffee prices failed", len(cafe_ids))
+            with self._lock:
+                self._flushing = {}
+                self.written += len(cafe_ids)
+                self.flushes += 1
+            logger.debug("Wrote %s coffee prices in one transaction", len(cafe_ids))
+            return len(cafe_ids)
+
+    def close(self):
+        # runs at exit: stops the worker and writes what is left
+        self._stopped = True
+        self._wake.set()
+        if self.engine is not None:
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {"pending": len(self._pending) + len(self._flushing), "queued": self.queued,
+                    "written": self.written, "flushes": self.flushes, "failures": self.failures,
+                    "max_size": self.max_size, "interval": self.interval}